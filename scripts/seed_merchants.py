@@ -19,7 +19,7 @@ with transaction.atomic():
     print("✅ Old data deleted")
 
     pool_total = CREDIT_LIMIT * N * POOL_MULTIPLIER
-    pool = CreditPool.objects.create(id=1, available_amount=pool_total)
+    pool_available = CreditPool.topup(pool_total)
 
     wallet_fields = {f.name for f in WalletAccount._meta.get_fields() if hasattr(f, "name")}
     has_bank_account = "bank_account" in wallet_fields
@@ -38,4 +38,4 @@ with transaction.atomic():
 
         MerchantCredit.objects.create(merchant=m, credit_limit=CREDIT_LIMIT)
 
-print(f"🎉 Seed done: merchants={N}, credit/merchant={CREDIT_LIMIT}, pool_available={pool.available_amount}")
\ No newline at end of file
+print(f"🎉 Seed done: merchants={N}, credit/merchant={CREDIT_LIMIT}, pool_available={pool_available}")
\ No newline at end of file
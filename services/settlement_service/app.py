@@ -1,11 +1,16 @@
 from fastapi import FastAPI, Header, HTTPException
-from pydantic import BaseModel, condecimal
+from pydantic import BaseModel, ValidationError, condecimal
 from decimal import Decimal
 import os
 
+import simulator
+
 INTERNAL_TOKEN = os.getenv('INTERNAL_TOKEN', 'ChangeMeInternalToken123')
+MAX_BATCH_ITEMS = int(os.getenv('MAX_BATCH_ITEMS', '1000'))
 
 app = FastAPI(title='Settlement Service')
+# Bank-side latency/fault simulation for load tests; inert unless configured (simulator.py)
+sim = simulator.from_env()
 
 class WithdrawIn(BaseModel):
     merchant_id: int
@@ -13,12 +18,79 @@ class WithdrawIn(BaseModel):
     amount: condecimal(max_digits=18, decimal_places=2)
     bank_account: str | None = None
 
-@app.post('/api/settlement/withdraw')
-def settlement_withdraw(payload: WithdrawIn, authorization: str | None = Header(default=None)):
+class BatchIn(BaseModel):
+    # Items are validated one by one so a bad item fails alone, not the whole batch
+    items: list[dict]
+
+def _check_auth(authorization: str | None):
     if not authorization or not authorization.startswith('Bearer '):
         raise HTTPException(status_code=401, detail='Missing bearer token')
     token = authorization.split(' ', 1)[1]
     if token != INTERNAL_TOKEN:
         raise HTTPException(status_code=403, detail='Forbidden')
+
+def _settle(payload: WithdrawIn) -> dict:
     ref = f"BNK-{payload.merchant_id}-{payload.account_id[:8]}-{str(payload.amount).replace('.', '')}"
     return {'status': 'SUCCESS', 'bank_reference': ref}
+
+@app.post('/api/settlement/withdraw')
+async def settlement_withdraw(payload: WithdrawIn, authorization: str | None = Header(default=None)):
+    _check_auth(authorization)
+    async with sim.call():
+        return _settle(payload)
+
+@app.post('/api/settlement/withdraw/batch')
+async def settlement_withdraw_batch(payload: BatchIn, authorization: str | None = Header(default=None)):
+    """
+    Settle many withdrawals in one call. Each item may carry a client `ref`
+    that is echoed back; results are returned in request order.
+    """
+    _check_auth(authorization)
+    if len(payload.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f'At most {MAX_BATCH_ITEMS} items per batch')
+    async with sim.call(items=len(payload.items)):
+        results = []
+        for item in payload.items:
+            ref = item.get('ref')
+            try:
+                out = _settle(WithdrawIn(**{k: v for k, v in item.items() if k != 'ref'}))
+            except ValidationError as exc:
+                out = {'status': 'REJECTED', 'detail': exc.errors()[0].get('msg', 'invalid item')}
+            results.append({'ref': ref, **out})
+        return {'results': results}
+
+@app.get('/admin/simulator')
+def simulator_state(authorization: str | None = Header(default=None)):
+    """Current simulator config, in-flight calls and counters."""
+    _check_auth(authorization)
+    return sim.state()
+
+@app.put('/admin/simulator')
+def simulator_replace(body: dict, authorization: str | None = Header(default=None)):
+    """Replace the config (optionally from a preset); counters restart."""
+    _check_auth(authorization)
+    return _configure(body)
+
+@app.patch('/admin/simulator')
+def simulator_update(body: dict, authorization: str | None = Header(default=None)):
+    """Change some fields of the current config, e.g. {"error_rate": 0.1}; counters restart."""
+    _check_auth(authorization)
+    current = sim.config.model_dump()
+    if isinstance(body.get('latency'), dict):
+        body = {**body, 'latency': {**current['latency'], **body['latency']}}
+    return _configure({**current, **body})
+
+@app.post('/admin/simulator/reset')
+def simulator_reset(authorization: str | None = Header(default=None)):
+    """Zero the counters, keeping the config."""
+    _check_auth(authorization)
+    sim.reset_counters()
+    return sim.state()
+
+def _configure(raw: dict) -> dict:
+    try:
+        sim.configure(simulator.build(raw))
+    except (ValueError, OSError) as exc:
+        # pydantic's ValidationError is a ValueError
+        raise HTTPException(status_code=422, detail=str(exc))
+    return sim.state()
@@ -0,0 +1,258 @@
+"""
+Bank-side behaviour simulator for load tests.
+
+Off by default: the service answers instantly, as before. The initial
+config comes from SIM_CONFIG (JSON) or SIM_CONFIG_FILE (path to JSON). At
+runtime it is read and changed through /admin/simulator (see app.py). A
+config may start from a preset ({"preset": "bank", "error_rate": 0.05}).
+
+Each settlement call goes through these steps in order:
+1. Rate limit: a token bucket of `rate_limit_rps` with `rate_limit_burst`.
+   Over it, the call gets 429 with Retry-After.
+2. Concurrency cap: at most `max_concurrency` calls in flight. With
+   `over_capacity` 'queue', later calls wait for a slot (503 after
+   `queue_timeout_s`); with 'reject' they get 503 at once.
+3. Latency: sampled from `latency`, plus `batch_item_ms` per batch item,
+   and awaited, so a slow call holds no worker thread.
+4. Faults: a `timeout_rate` fraction of calls hangs for `timeout_s` (set it
+   past the client's deadline) and then answers 504. An `error_rate`
+   fraction answers one of `error_codes`.
+
+Latency kinds:
+  {"kind": "none"}
+  {"kind": "fixed", "ms": 300}
+  {"kind": "lognormal", "median_ms": 350, "sigma": 0.5, "max_ms": 5000}
+  {"kind": "histogram", "buckets": [[100, 5], [250, 40], [500, 50], [1000, 5]]}
+  {"kind": "histogram", "file": "observed.json", "outcome": "2xx"}
+A histogram lists [upper_ms, count] buckets. A sample picks a bucket by
+count and a uniform point between the previous bound and this one. A
+scrape of the wallet's /metrics can be saved as a histogram file and
+replayed: its wallet_settlement_call_seconds{outcome} buckets are read
+(pick the outcome with "outcome", default 2xx). A trailing "+Inf" bucket
+is replayed at its lower bound.
+
+State (config, rate limit bucket, counters) is per process: run the service
+with one uvicorn worker when simulating.
+"""
+
+from __future__ import annotations
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import Literal
+
+from fastapi import HTTPException
+from pydantic import BaseModel, Field, model_validator
+
+
+class Latency(BaseModel):
+    kind: Literal['none', 'fixed', 'lognormal', 'histogram'] = 'none'
+    ms: float = Field(0.0, ge=0)
+    median_ms: float = Field(300.0, gt=0)
+    sigma: float = Field(0.5, ge=0)
+    max_ms: float = Field(10000.0, gt=0)
+    buckets: list[tuple[float | str, float]] = []
+    file: str | None = None
+    outcome: str | None = None
+
+    @model_validator(mode='after')
+    def _load_buckets(self):
+        if self.kind == 'histogram':
+            if self.file and not self.buckets:
+                self.buckets = _histogram_from(open(self.file).read(), self.outcome)
+            if not any(count > 0 for _, count in self.buckets):
+                raise ValueError('histogram latency needs buckets with a positive count')
+        return self
+
+
+class SimConfig(BaseModel):
+    latency: Latency = Latency()
+    batch_item_ms: float = Field(0.0, ge=0)
+    error_rate: float = Field(0.0, ge=0, le=1)
+    error_codes: list[int] = [500, 502, 503]
+    timeout_rate: float = Field(0.0, ge=0, le=1)
+    timeout_s: float = Field(30.0, ge=0)
+    rate_limit_rps: float | None = Field(None, gt=0)
+    rate_limit_burst: int = Field(10, ge=1)
+    max_concurrency: int | None = Field(None, ge=1)
+    over_capacity: Literal['queue', 'reject'] = 'queue'
+    queue_timeout_s: float = Field(5.0, ge=0)
+    seed: int | None = None
+
+
+PRESETS = {
+    'instant': {},
+    # Typical bank API: 200-800ms, a little 5xx, rare hangs past the wallet's 2.5s deadline
+    'bank': {
+        'latency': {'kind': 'lognormal', 'median_ms': 380, 'sigma': 0.35, 'max_ms': 800},
+        'error_rate': 0.01, 'timeout_rate': 0.002, 'timeout_s': 10,
+        'max_concurrency': 64, 'over_capacity': 'queue',
+    },
+    # Bank under stress: slower, more errors, throttling
+    'degraded': {
+        'latency': {'kind': 'lognormal', 'median_ms': 900, 'sigma': 0.6, 'max_ms': 5000},
+        'error_rate': 0.05, 'timeout_rate': 0.02, 'timeout_s': 10,
+        'rate_limit_rps': 50, 'rate_limit_burst': 20, 'max_concurrency': 32, 'over_capacity': 'reject',
+    },
+}
+
+
+def build(raw: dict) -> SimConfig:
+    """Validate a config dict, starting from its preset if it names one."""
+    raw = dict(raw)
+    preset = raw.pop('preset', None)
+    if preset is not None and preset not in PRESETS:
+        raise ValueError(f"unknown preset {preset!r} (one of {', '.join(PRESETS)})")
+    base = json.loads(json.dumps(PRESETS.get(preset, {})))
+    if isinstance(raw.get('latency'), dict) and isinstance(base.get('latency'), dict):
+        raw['latency'] = {**base['latency'], **raw['latency']}
+    return SimConfig.model_validate({**base, **raw})
+
+
+def _histogram_from(text: str, outcome: str | None) -> list[tuple]:
+    # Accepts a JSON bucket list, JSON {"buckets": [...]}, or Prometheus text
+    if text.lstrip()[:1] in ('[', '{'):
+        doc = json.loads(text)
+        return [tuple(b) for b in (doc if isinstance(doc, list) else doc['buckets'])]
+    return _prometheus_buckets(text, outcome or '2xx')
+
+
+def _prometheus_buckets(text: str, outcome: str) -> list[tuple]:
+    """[upper_ms, count] buckets of wallet_settlement_call_seconds{outcome} (cumulative seconds in the scrape)."""
+    cumulative = []
+    pattern = re.compile(r'^wallet_settlement_call_seconds_bucket\{(.*)\}\s+(\S+)')
+    for line in text.splitlines():
+        m = pattern.match(line)
+        if not m:
+            continue
+        labels = dict(re.findall(r'(\w+)="([^"]*)"', m.group(1)))
+        if labels.get('outcome') == outcome:
+            le = labels['le']
+            cumulative.append((math.inf if le == '+Inf' else float(le), float(m.group(2))))
+    cumulative.sort()
+    out, seen = [], 0.0
+    for le, count in cumulative:
+        out.append(('+Inf' if le == math.inf else le * 1000, count - seen))
+        seen = count
+    return out
+
+
+class Simulator:
+    def __init__(self, config: SimConfig | None = None):
+        self._cond = asyncio.Condition()
+        self.in_flight = 0
+        self.configure(config or SimConfig())
+
+    def configure(self, config: SimConfig) -> None:
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self._tokens = float(config.rate_limit_burst)
+        self._refilled = time.monotonic()
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        self.counters = {'calls': 0, 'ok': 0, 'rate_limited': 0, 'over_capacity': 0, 'queued': 0,
+                         'errors': 0, 'timeouts': 0, 'max_in_flight': 0}
+
+    def state(self) -> dict:
+        return {'config': self.config.model_dump(), 'in_flight': self.in_flight, 'counters': dict(self.counters)}
+
+    # --- sampling ---
+
+    def sample_latency_ms(self) -> float:
+        lat = self.config.latency
+        if lat.kind == 'fixed':
+            return lat.ms
+        if lat.kind == 'lognormal':
+            return min(self.rng.lognormvariate(math.log(lat.median_ms), lat.sigma), lat.max_ms)
+        if lat.kind == 'histogram':
+            bounds, weights, lower = [], [], 0.0
+            for upper, count in lat.buckets:
+                hi = float(upper)
+                if math.isinf(hi):
+                    hi = lower
+                bounds.append((lower, hi))
+                weights.append(count)
+                lower = hi
+            lo, hi = self.rng.choices(bounds, weights=weights)[0]
+            return self.rng.uniform(lo, hi)
+        return 0.0
+
+    # --- admission ---
+
+    def _take_token(self) -> float:
+        """0 if admitted, else seconds until a token is available."""
+        rps = self.config.rate_limit_rps
+        if rps is None:
+            return 0.0
+        now = time.monotonic()
+        self._tokens = min(float(self.config.rate_limit_burst), self._tokens + (now - self._refilled) * rps)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / rps
+
+    async def _acquire_slot(self) -> None:
+        cap = self.config.max_concurrency
+        async with self._cond:
+            if cap is not None and self.in_flight >= cap:
+                if self.config.over_capacity == 'reject':
+                    self.counters['over_capacity'] += 1
+                    raise HTTPException(status_code=503, detail='Upstream at capacity')
+                self.counters['queued'] += 1
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self.in_flight < (self.config.max_concurrency or math.inf)),
+                        timeout=self.config.queue_timeout_s)
+                except asyncio.TimeoutError:
+                    self.counters['over_capacity'] += 1
+                    raise HTTPException(status_code=503, detail='Upstream queue timeout')
+            self.in_flight += 1
+            self.counters['max_in_flight'] = max(self.counters['max_in_flight'], self.in_flight)
+
+    async def _release_slot(self) -> None:
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+
+    @asynccontextmanager
+    async def call(self, items: int = 1):
+        """Apply the simulated behaviour around one settlement call; raises HTTPException for injected failures."""
+        self.counters['calls'] += 1
+        wait = self._take_token()
+        if wait:
+            self.counters['rate_limited'] += 1
+            raise HTTPException(status_code=429, detail='Rate limited',
+                                headers={'Retry-After': str(max(1, math.ceil(wait)))})
+        await self._acquire_slot()
+        try:
+            cfg = self.config
+            delay_ms = self.sample_latency_ms() + cfg.batch_item_ms * items
+            roll = self.rng.random()
+            if roll < cfg.timeout_rate:
+                self.counters['timeouts'] += 1
+                await asyncio.sleep(cfg.timeout_s)
+                raise HTTPException(status_code=504, detail='Upstream timeout')
+            if delay_ms:
+                await asyncio.sleep(delay_ms / 1000)
+            if roll < cfg.timeout_rate + cfg.error_rate:
+                self.counters['errors'] += 1
+                raise HTTPException(status_code=self.rng.choice(cfg.error_codes), detail='Injected upstream error')
+            yield
+            self.counters['ok'] += 1
+        finally:
+            await self._release_slot()
+
+
+def from_env() -> Simulator:
+    raw = os.getenv('SIM_CONFIG')
+    path = os.getenv('SIM_CONFIG_FILE')
+    if path and not raw:
+        raw = open(path).read()
+    return Simulator(build(json.loads(raw)) if raw else None)
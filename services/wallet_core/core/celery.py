@@ -1,8 +1,16 @@
 import os
 from celery import Celery
+from celery.signals import worker_process_shutdown
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 app = Celery('core')
 app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
+
+
+@worker_process_shutdown.connect
+def _metrics_process_exited(pid=None, **kwargs):
+    # Multiprocess metrics (payments.metrics): retire the pool process's live gauge files
+    from payments import metrics
+    metrics.process_exited(pid or os.getpid())
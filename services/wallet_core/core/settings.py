@@ -1,4 +1,5 @@
 from pathlib import Path
+import json
 import os
 from datetime import timedelta
 from django.core.exceptions import ImproperlyConfigured
@@ -44,6 +45,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'payments.metrics.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'core.urls'
@@ -113,7 +115,7 @@ STATIC_URL = 'static/'
 # --- DRF / Auth ---
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'payments.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -124,6 +126,8 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=env('ACCESS_TOKEN_LIFETIME_MINUTES', 60, cast=int)),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=env('REFRESH_TOKEN_LIFETIME_DAYS', 7, cast=int)),
 }
+# How long a token that passed the Redis deny-list check is trusted without re-checking
+AUTH_DENYLIST_CHECK_S = env('AUTH_DENYLIST_CHECK_S', 5.0, cast=float)
 
 # --- Celery ---
 CELERY_BROKER_URL = env('CELERY_BROKER_URL', 'redis://redis:6379/0')
@@ -133,5 +137,138 @@ CELERY_TASK_TIME_LIMIT = 60
 
 INTERNAL_TOKEN = env('INTERNAL_TOKEN', 'ChangeMeInternalToken123')
 SETTLEMENT_URL = env('SETTLEMENT_URL', 'http://settlement:9000/api/settlement/withdraw')
+# Shared keep-alive client (payments.settlement_client): socket read/connect timeouts (not a total
+# deadline) and per-process pool size
+SETTLEMENT_TIMEOUT = env('SETTLEMENT_TIMEOUT', 2.5, cast=float)
+SETTLEMENT_CONNECT_TIMEOUT = env('SETTLEMENT_CONNECT_TIMEOUT', 1.0, cast=float)
+SETTLEMENT_POOL_SIZE = env('SETTLEMENT_POOL_SIZE', 10, cast=int)
+# Async dispatch: 'task' enqueues one dispatch_settlement per withdrawal, 'batch' lets the
+# beat-driven batcher drain QUEUED rows into the batch endpoint
+SETTLEMENT_DISPATCH = env('SETTLEMENT_DISPATCH', 'task')
+SETTLEMENT_BATCH_URL = env('SETTLEMENT_BATCH_URL', SETTLEMENT_URL.rstrip('/') + '/batch')
+SETTLEMENT_BATCH_TIMEOUT = env('SETTLEMENT_BATCH_TIMEOUT', 10.0, cast=float)
+SETTLEMENT_BATCH_SIZE = env('SETTLEMENT_BATCH_SIZE', 200, cast=int)
+SETTLEMENT_BATCH_WINDOW_S = env('SETTLEMENT_BATCH_WINDOW_S', 1.0, cast=float)
+# SETTLING rows older than this are requeued by the reaper; keep it above a task's whole retry budget
+SETTLEMENT_CLAIM_TIMEOUT_S = env('SETTLEMENT_CLAIM_TIMEOUT_S', 900, cast=int)
 
-REDIS_URL = env('REDIS_URL', 'redis://redis:6379/0')
\ No newline at end of file
+REDIS_URL = env('REDIS_URL', 'redis://redis:6379/0')
+
+# --- Rate limiting (payments.ratelimit, GCRA) ---
+# Per-tier limits; RL_* configure the default tier, RATE_LIMIT_TIERS (JSON) adds/overrides tiers
+RL_WINDOW_SEC = env('RL_WINDOW_SEC', 60, cast=int)
+RL_MAX_REQUESTS = env('RL_MAX_REQUESTS', 120, cast=int)
+RATE_LIMIT_TIERS = {
+    'standard': {'limit': RL_MAX_REQUESTS, 'period_s': RL_WINDOW_SEC, 'burst': env('RL_BURST', 20, cast=int)},
+    **env('RATE_LIMIT_TIERS', '{}', cast=json.loads),
+}
+RATE_LIMIT_TIER_CACHE_S = env('RATE_LIMIT_TIER_CACHE_S', 60, cast=float)
+# >1 enables local token leases: fetch this many tokens per Redis call, valid for LEASE_TTL
+RATE_LIMIT_LEASE_SIZE = env('RATE_LIMIT_LEASE_SIZE', 0, cast=int)
+RATE_LIMIT_LEASE_TTL_S = env('RATE_LIMIT_LEASE_TTL_S', 1.0, cast=float)
+
+# --- Request audit log ---
+# 'buffered': bounded in-process buffer + bulk flusher thread; 'sync': one INSERT per request
+REQUEST_LOG_MODE = env('REQUEST_LOG_MODE', 'buffered')
+REQUEST_LOG_CAPACITY = env('REQUEST_LOG_CAPACITY', 10000, cast=int)
+REQUEST_LOG_BATCH_SIZE = env('REQUEST_LOG_BATCH_SIZE', 500, cast=int)
+REQUEST_LOG_FLUSH_INTERVAL_S = env('REQUEST_LOG_FLUSH_INTERVAL_S', 0.5, cast=float)
+
+# --- /me profile cache (payments.profile_cache) ---
+# Local LRU entries are served without I/O for PROFILE_LOCAL_TTL_S, then revalidated by version
+PROFILE_LOCAL_TTL_S = env('PROFILE_LOCAL_TTL_S', 2.0, cast=float)
+PROFILE_LOCAL_MAX = env('PROFILE_LOCAL_MAX', 10000, cast=int)
+PROFILE_CACHE_TTL_S = env('PROFILE_CACHE_TTL_S', 300, cast=int)
+
+# --- Idempotency keys ---
+# Replay window (Redis copy and Postgres retention) and the in-flight claim lifetime
+IDEMPOTENCY_TTL_S = env('IDEMPOTENCY_TTL_S', 86400, cast=int)
+IDEMPOTENCY_INFLIGHT_TTL_S = env('IDEMPOTENCY_INFLIGHT_TTL_S', 60, cast=int)
+
+# --- Retention (payments.retention) ---
+# Per-table age in days and action ('delete' or 'archive' to gzip NDJSON); RETENTION_POLICIES (JSON) overrides
+RETENTION_POLICIES = {
+    'request_log': {'days': 30, 'action': 'archive'},
+    'idempotency': {'days': IDEMPOTENCY_TTL_S / 86400, 'action': 'delete'},
+    'celery_task_results': {'days': 7, 'action': 'delete'},
+    'celery_group_results': {'days': 7, 'action': 'delete'},
+    **env('RETENTION_POLICIES', '{}', cast=json.loads),
+}
+RETENTION_BATCH_SIZE = env('RETENTION_BATCH_SIZE', 1000, cast=int)
+RETENTION_SLEEP_S = env('RETENTION_SLEEP_S', 0.05, cast=float)
+# Per beat run, below CELERY_TASK_TIME_LIMIT; an unfinished pass resumes from its checkpoint
+RETENTION_MAX_SECONDS = env('RETENTION_MAX_SECONDS', 45, cast=float)
+RETENTION_ARCHIVE_DIR = env('RETENTION_ARCHIVE_DIR', str(BASE_DIR / 'archive'))
+
+# --- Ledger reconciliation (payments.reconciliation) ---
+# Entries younger than RECON_LAG_S wait for the next run; RECON_INTERVAL_S spaces the beat runs
+RECON_CHUNK_SIZE = env('RECON_CHUNK_SIZE', 50000, cast=int)
+RECON_LAG_S = env('RECON_LAG_S', 60, cast=float)
+RECON_MAX_REPORTED = env('RECON_MAX_REPORTED', 1000, cast=int)
+RECON_INTERVAL_S = env('RECON_INTERVAL_S', 86400.0, cast=float)
+
+# --- Balance checkpoints (payments.balances) ---
+# Point-in-time lookups read at most one interval of ledger rows past a checkpoint
+BALANCE_CHECKPOINT_INTERVAL_S = env('BALANCE_CHECKPOINT_INTERVAL_S', 3600.0, cast=float)
+BALANCE_CHECKPOINT_LAG_S = env('BALANCE_CHECKPOINT_LAG_S', 60, cast=float)
+
+# --- Merchant history pages (payments.history) ---
+HISTORY_PAGE_SIZE = env('HISTORY_PAGE_SIZE', 50, cast=int)
+HISTORY_MAX_PAGE_SIZE = env('HISTORY_MAX_PAGE_SIZE', 200, cast=int)
+
+# --- Streaming exports (payments.export) ---
+# Rows per server-side cursor FETCH; each FETCH is one statement under DB_STATEMENT_TIMEOUT_MS
+EXPORT_CHUNK_SIZE = env('EXPORT_CHUNK_SIZE', 5000, cast=int)
+
+# --- Metrics (payments.metrics) ---
+# Phase timers, per-request DB/Redis counts and /metrics; set PROMETHEUS_MULTIPROC_DIR for gunicorn/Celery workers
+METRICS_ENABLED = env('METRICS_ENABLED', '0', cast=bool)
+METRICS_TOKEN = env('METRICS_TOKEN', '')
+METRICS_COLLECT_DIRS = env('METRICS_COLLECT_DIRS', '')
+# Diagnostic: time every credit-row select_for_update (payments.lockprof, `lock_profile` command)
+LOCK_PROFILE = env('LOCK_PROFILE', '0', cast=bool)
+
+# --- Monthly partitions (payments.partitions) ---
+# Months pre-created ahead (rows beyond them land in the default partition) and, per model, months kept attached (JSON, 0 = all)
+PARTITION_MONTHS_AHEAD = env('PARTITION_MONTHS_AHEAD', 3, cast=int)
+PARTITION_RETENTION_MONTHS = env('PARTITION_RETENTION_MONTHS', '{}', cast=json.loads)
+
+# --- Credit pool ---
+# Split the global CreditPool into N sub-pool rows to spread row-lock contention
+CREDIT_POOL_STRIPES = env('CREDIT_POOL_STRIPES', 1, cast=int)
+# Consumption engine: 'locking' (one transaction per withdrawal), 'group' (group commit)
+# or 'sql' (single CTE statement per withdrawal)
+CREDIT_ENGINE = env('CREDIT_ENGINE', 'locking')
+# Group commit: 'local' batches threads of one process, 'redis' ships requests to `manage.py run_group_commit`
+GROUP_COMMIT_TRANSPORT = env('GROUP_COMMIT_TRANSPORT', 'local')
+GROUP_COMMIT_WINDOW_MS = env('GROUP_COMMIT_WINDOW_MS', 2.0, cast=float)
+GROUP_COMMIT_MAX_BATCH = env('GROUP_COMMIT_MAX_BATCH', 64, cast=int)
+GROUP_COMMIT_REPLY_TIMEOUT_S = env('GROUP_COMMIT_REPLY_TIMEOUT_S', 5.0, cast=float)
+GROUP_COMMIT_REPLY_GRACE_S = env('GROUP_COMMIT_REPLY_GRACE_S', 2.0, cast=float)
+# Redis admission front for credit: reserve in Redis, persist in batches, rebuild periodically
+CREDIT_RESERVATION_FRONT = env('CREDIT_RESERVATION_FRONT', '0', cast=bool)
+CREDIT_FRONT_BATCH_SIZE = env('CREDIT_FRONT_BATCH_SIZE', 500, cast=int)
+CREDIT_HOLD_TTL_S = env('CREDIT_HOLD_TTL_S', 300, cast=int)
+# Hold credit before the settlement call (captured on success, released on failure/expiry)
+CREDIT_HOLDS = env('CREDIT_HOLDS', '1', cast=bool)
+WITHDRAWAL_HOLD_EXPIRY_S = env('WITHDRAWAL_HOLD_EXPIRY_S', 900, cast=int)
+# Integer cents on the locking/hold hot path (payments.money); run backfill_minor_units first
+MONEY_MINOR_UNITS = env('MONEY_MINOR_UNITS', '0', cast=bool)
+
+CELERY_BEAT_SCHEDULE = {
+    'release-expired-holds': {'task': 'payments.tasks.release_expired_holds', 'schedule': 60.0},
+    'reap-stale-settlements': {'task': 'payments.tasks.reap_stale_settlements', 'schedule': 60.0},
+    'apply-retention': {'task': 'payments.tasks.apply_retention', 'schedule': 300.0},
+    'reconcile-ledger': {'task': 'payments.tasks.reconcile_ledger', 'schedule': RECON_INTERVAL_S},
+    'balance-checkpoint': {'task': 'payments.tasks.take_balance_checkpoint', 'schedule': BALANCE_CHECKPOINT_INTERVAL_S},
+    'maintain-partitions': {'task': 'payments.tasks.maintain_partitions', 'schedule': 86400.0},
+}
+if CREDIT_RESERVATION_FRONT:
+    CELERY_BEAT_SCHEDULE.update({
+        'credit-front-writer': {'task': 'payments.tasks.apply_credit_reservations', 'schedule': 1.0},
+        'credit-front-reconcile': {'task': 'payments.tasks.reconcile_credit_front', 'schedule': 300.0},
+    })
+if SETTLEMENT_DISPATCH == 'batch':
+    CELERY_BEAT_SCHEDULE['settlement-batcher'] = {
+        'task': 'payments.tasks.dispatch_settlement_batches', 'schedule': SETTLEMENT_BATCH_WINDOW_S,
+    }
\ No newline at end of file
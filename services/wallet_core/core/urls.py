@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.urls import path, include
+from payments.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('payments.urls')),
+    path('metrics', metrics_view),
 ]
@@ -0,0 +1,9 @@
+"""gunicorn settings, read from the working directory (the compose service runs gunicorn from /app)."""
+import os
+
+
+def child_exit(server, worker):
+    # Multiprocess metrics (payments.metrics): retire the dead worker's live gauge files
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,148 @@
+"""
+JWT authentication that trusts token claims instead of loading the User row.
+
+Access tokens carry the merchant's identity and state as claims: user id,
+username, staff flag, merchant id, account id, approval state and bank
+account, plus the rate-limit tier. `ClaimsJWTAuthentication` turns them into a `Principal`, whose
+`.merchant` is an unsaved Merchant/WalletAccount pair with the real primary
+keys. Authentication and the withdrawal hot path therefore need no User or
+Merchant query. Tokens minted before these claims existed fall back to the
+stock DB lookup.
+
+Revocation uses a Redis deny-list:
+- `auth:deny:jti:<jti>` revokes one token until it expires. Logout denies the
+  access token and the refresh token it was minted from (`refresh_jti` claim);
+  the refresh endpoint checks the list too.
+- `auth:deny:user:<id>` holds an epoch; that user's tokens issued before it
+  are rejected. `approve_merchant` sets it so stale approval claims force a
+  refresh, and the refresh endpoint re-reads the claims from the database.
+  Saving a User whose `is_active` or `is_staff` changed sets it too
+  (`payments.signals`); there is no per-request `is_active` check, so a
+  deactivation done with `QuerySet.update()` is not seen until the access
+  token expires unless the caller runs `revoke_user`.
+
+A passed deny-list check is cached in-process per token for
+AUTH_DENYLIST_CHECK_S, so revocation takes effect within that window.
+"""
+
+from __future__ import annotations
+import threading
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.models import TokenUser
+
+from .models import Merchant, WalletAccount
+from .utils.cache import redis_client
+
+CLAIMS = ('merchant_id', 'account_id', 'is_approved', 'is_staff', 'bank_account', 'rate_tier')
+
+_checked: dict[str, float] = {}
+_checked_lock = threading.Lock()
+_CHECKED_MAX = 50000
+
+
+def _jti_key(jti: str) -> str:
+    return f"auth:deny:jti:{jti}"
+
+
+def _user_key(user_id) -> str:
+    return f"auth:deny:user:{user_id}"
+
+
+def apply_claims(token, user) -> None:
+    """Embed the principal claims for `user` (one query for the merchant/account)."""
+    m = Merchant.objects.select_related('account').filter(user_id=user.id).first()
+    token['username'] = user.username
+    token['is_staff'] = user.is_staff
+    token['merchant_id'] = m.id if m else None
+    token['account_id'] = str(m.account.id) if m else None
+    token['is_approved'] = m.is_approved if m else False
+    token['bank_account'] = m.bank_account if m else ''
+    token['rate_tier'] = m.rate_tier if m else None
+
+
+class Principal(TokenUser):
+    """Request user backed only by token claims."""
+
+    @cached_property
+    def merchant(self) -> Merchant:
+        mid = self.token.get('merchant_id')
+        if mid is None:
+            raise Merchant.DoesNotExist('Token has no merchant')
+        m = Merchant(id=mid, user_id=self.id, is_approved=bool(self.token.get('is_approved')),
+                     bank_account=self.token.get('bank_account') or '')
+        m.account = WalletAccount(id=uuid.UUID(self.token['account_id']), merchant_id=mid)
+        return m
+
+    @property
+    def rate_tier(self):
+        return self.token.get('rate_tier')
+
+
+def bind_refresh(refresh) -> None:
+    """Record the refresh token's jti; access tokens minted from it copy the claim, so logout can deny both."""
+    refresh['refresh_jti'] = refresh['jti']
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if not all(c in validated_token for c in CLAIMS):
+            return super().get_user(validated_token)
+        check_not_revoked(validated_token)
+        return Principal(validated_token)
+
+
+def check_not_revoked(token, check_user: bool = True) -> None:
+    """
+    Raise AuthenticationFailed if `token` is deny-listed. `check_user=False`
+    skips the per-user epoch, which only marks claims stale; the refresh
+    endpoint passes it because it re-reads the claims from the database.
+    """
+    jti = token.get('jti')
+    now = time.monotonic()
+    with _checked_lock:
+        if _checked.get(jti, 0) > now:
+            return
+    revoked_jti, revoked_before = redis_client().mget(_jti_key(jti), _user_key(token['user_id']))
+    if revoked_jti or (check_user and revoked_before and int(token.get('iat', 0)) < int(revoked_before)):
+        raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+    with _checked_lock:
+        if len(_checked) >= _CHECKED_MAX:
+            _checked.clear()
+        _checked[jti] = now + float(getattr(settings, 'AUTH_DENYLIST_CHECK_S', 5.0))
+
+
+def revoke_token(token) -> None:
+    """Deny one token until its expiry (logout), and the refresh token it came from."""
+    now = datetime.now(dt_timezone.utc).timestamp()
+    pipe = redis_client().pipeline()
+    ttl = int(token['exp'] - now) + 1
+    if ttl > 0:
+        pipe.set(_jti_key(token['jti']), 1, ex=ttl)
+    refresh_jti = token.get('refresh_jti')
+    if refresh_jti and refresh_jti != token['jti']:
+        # The refresh token was issued no later than this token
+        lifetime = settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds()
+        ttl = int(token.get('iat', now) + lifetime - now) + 1
+        if ttl > 0:
+            pipe.set(_jti_key(refresh_jti), 1, ex=ttl)
+    pipe.execute()
+    _forget_checks()
+
+
+def revoke_user(user_id) -> None:
+    """Deny every token of `user_id` issued before now (claims changed or account disabled)."""
+    lifetime = int(settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds())
+    redis_client().set(_user_key(user_id), int(time.time()), ex=lifetime + 60)
+    _forget_checks()
+
+
+def _forget_checks() -> None:
+    with _checked_lock:
+        _checked.clear()
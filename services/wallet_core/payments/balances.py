@@ -0,0 +1,111 @@
+"""
+Point-in-time balances from ledger checkpoints.
+
+`take_checkpoint()` runs on a schedule. It aggregates ledger entries created
+since the previous checkpoint, up to now - BALANCE_CHECKPOINT_LAG_S, with one
+GROUP BY over the (created_at, id) index. It then writes a BalanceCheckpoint
+holding the cumulative pool total, and one BalanceSnapshot for each merchant
+whose total changed.
+
+`merchant_balance_at()` and `pool_balance_at()` start from the latest snapshot
+at or before the requested time. They add the entries between that snapshot
+and the requested time, so a lookup reads at most one checkpoint interval of
+ledger rows, never the whole table.
+
+Balances are settled amounts from the ledger. Credit held for withdrawals that
+are still settling is in MerchantCredit.utilized_amount but not yet in the
+ledger. Top-ups are not in the ledger either, so the pool figure is what was
+consumed from it. A ledger write that commits more than the lag after its
+created_at is missed by the checkpoint it belongs to.
+"""
+
+from __future__ import annotations
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import BalanceCheckpoint, BalanceSnapshot, LedgerEntry, q
+
+_LEDGER = LedgerEntry._meta.db_table
+
+_POOL_DEBIT = "direction = 'DEBIT' AND source = 'CREDIT_POOL'"
+_MERCHANT_CREDIT = "direction = 'CREDIT' AND source = 'MERCHANT_CREDIT'"
+
+
+def _amount(minor: int) -> str:
+    return str(q(Decimal(minor) / 100))
+
+
+def take_checkpoint(now: datetime | None = None) -> BalanceCheckpoint | None:
+    """Write the next checkpoint. Returns None if no time has passed since the last one."""
+    through = (now or timezone.now()) - timedelta(seconds=float(getattr(settings, 'BALANCE_CHECKPOINT_LAG_S', 60)))
+    prev = BalanceCheckpoint.objects.order_by('-through').first()
+    if prev is not None and through <= prev.through:
+        return None
+    since = prev.through if prev else None
+
+    where, params = "created_at <= %s", [through]
+    if since is not None:
+        where, params = "created_at > %s AND " + where, [since, through]
+    with connection.cursor() as cur:
+        cur.execute(
+            f"SELECT merchant_id,"
+            f"       (COALESCE(SUM(amount) FILTER (WHERE {_MERCHANT_CREDIT}), 0) * 100)::bigint,"
+            f"       (COALESCE(SUM(amount) FILTER (WHERE {_POOL_DEBIT}), 0) * 100)::bigint"
+            f"  FROM {_LEDGER} WHERE {where} GROUP BY merchant_id",
+            params,
+        )
+        delta = {mid: (credit, pool) for mid, credit, pool in cur.fetchall()}
+
+    changed = [mid for mid, (credit, _) in delta.items() if credit]
+    base = dict(BalanceSnapshot.objects.filter(merchant_id__in=changed)
+                .order_by('merchant_id', '-through').distinct('merchant_id')
+                .values_list('merchant_id', 'utilized_minor'))
+    with transaction.atomic():
+        cp = BalanceCheckpoint.objects.create(
+            through=through, merchants_written=len(changed),
+            pool_consumed_minor=(prev.pool_consumed_minor if prev else 0) + sum(p for _, p in delta.values()),
+        )
+        BalanceSnapshot.objects.bulk_create(
+            [BalanceSnapshot(checkpoint=cp, merchant_id=mid, through=through,
+                             utilized_minor=base.get(mid, 0) + delta[mid][0]) for mid in changed],
+            batch_size=1000,
+        )
+    return cp
+
+
+def _ledger_delta(condition: str, since: datetime | None, at: datetime, merchant_id: int | None = None):
+    """(sum in minor units, entries) of ledger rows matching `condition` in (since, at]."""
+    where, params = [condition, "created_at <= %s"], [at]
+    if since is not None:
+        where.append("created_at > %s"); params.append(since)
+    if merchant_id is not None:
+        where.append("merchant_id = %s"); params.append(merchant_id)
+    with connection.cursor() as cur:
+        cur.execute(f"SELECT (COALESCE(SUM(amount), 0) * 100)::bigint, COUNT(*) FROM {_LEDGER}"
+                    f" WHERE {' AND '.join(where)}", params)
+        total, count = cur.fetchone()
+    return int(total), int(count)
+
+
+def merchant_balance_at(merchant_id: int, at: datetime) -> dict:
+    """Settled utilization of `merchant_id` as of `at`."""
+    snap = (BalanceSnapshot.objects.filter(merchant_id=merchant_id, through__lte=at)
+            .order_by('-through').values_list('through', 'utilized_minor').first())
+    since, base = snap if snap else (None, 0)
+    delta, entries = _ledger_delta(_MERCHANT_CREDIT, since, at, merchant_id)
+    return {
+        'merchant_id': merchant_id, 'at': at, 'utilized_amount': _amount(base + delta),
+        'checkpoint_through': since, 'delta_entries': entries,
+    }
+
+
+def pool_balance_at(at: datetime) -> dict:
+    """Amount consumed from the credit pool through the ledger as of `at`."""
+    cp = BalanceCheckpoint.objects.filter(through__lte=at).order_by('-through').first()
+    since, base = (cp.through, cp.pool_consumed_minor) if cp else (None, 0)
+    delta, entries = _ledger_delta(_POOL_DEBIT, since, at)
+    return {'at': at, 'consumed_amount': _amount(base + delta), 'checkpoint_through': since, 'delta_entries': entries}
@@ -0,0 +1,188 @@
+"""
+Batching settlement dispatcher for ASYNC_SETTLEMENT=1 with SETTLEMENT_DISPATCH=batch.
+
+The view only marks withdrawals QUEUED. `drain()` (run by beat every
+SETTLEMENT_BATCH_WINDOW_S) claims up to SETTLEMENT_BATCH_SIZE of them with
+SKIP LOCKED, flips them to SETTLING so concurrent batchers never pick the
+same rows, makes one call to the batch endpoint and finalizes every result
+in one transaction: hold captures, front commits, releases and status
+updates.
+
+Transport errors and 5xx put the batch back to QUEUED for the next window
+(the per-withdrawal task retries in the same situations). A 4xx fails only
+the items it names (FastAPI's 422 `detail[].loc`) and requeues the rest.
+
+Claims are stamped `claimed_at`; `reap_stale_claims` puts SETTLING rows
+whose worker died before finalizing back to QUEUED.
+"""
+
+from __future__ import annotations
+import logging
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import WithdrawalRequest, CreditHold, atomic_consume_credit
+from . import credit_front, holds, settlement_client, withdrawals
+
+logger = logging.getLogger(__name__)
+
+
+def enabled() -> bool:
+    return getattr(settings, 'SETTLEMENT_DISPATCH', 'task') == 'batch'
+
+
+def claim(batch_size: int) -> list[WithdrawalRequest]:
+    """Move up to `batch_size` QUEUED withdrawals (oldest first) to SETTLING."""
+    with transaction.atomic():
+        ids = list(WithdrawalRequest.objects.select_for_update(skip_locked=True)
+                   .filter(status='QUEUED').order_by('created_at')
+                   .values_list('id', flat=True)[:batch_size])
+        if ids:
+            withdrawals.transition_many(ids, 'SETTLING', claimed_at=timezone.now())
+    return list(WithdrawalRequest.objects.filter(id__in=ids).select_related('merchant').order_by('created_at'))
+
+
+def settle_batch(batch: list[WithdrawalRequest]) -> dict:
+    """Send one claimed batch upstream and finalize it. Returns per-outcome counts."""
+    items = [{
+        'ref': str(wr.id),
+        'merchant_id': wr.merchant_id,
+        'account_id': str(wr.account_id),
+        'amount': str(wr.amount),
+        'bank_account': wr.merchant.bank_account,
+    } for wr in batch]
+    ids = [wr.id for wr in batch]
+    try:
+        resp = settlement_client.settle_batch(items)
+        if resp.status_code >= 500:
+            raise requests.RequestException(f"Upstream 5xx: {resp.status_code}")
+    except requests.RequestException as exc:
+        logger.warning("settlement batch of %d requeued: %s", len(batch), exc)
+        _requeue(ids)
+        return {'requeued': len(batch)}
+    if resp.status_code != 200:
+        rejected = [ids[i] for i in _rejected_items(resp, len(ids))]
+        requeue = [i for i in ids if i not in rejected]
+        logger.error("settlement batch of %d answered %s: %d item(s) rejected, %d requeued",
+                     len(batch), resp.status_code, len(rejected), len(requeue))
+        _requeue(requeue)
+        counts = finalize({str(i): {'status': 'REJECTED'} for i in rejected}) if rejected else {}
+        return {**counts, 'requeued': len(requeue)}
+    return finalize({r.get('ref'): r for r in resp.json().get('results', [])}, ids)
+
+
+def _rejected_items(resp, n: int) -> set[int]:
+    """Indexes of the batch items a 4xx blames (FastAPI detail[].loc = ['body', 'items', i, ...])."""
+    try:
+        detail = resp.json().get('detail')
+    except ValueError:
+        return set()
+    out = set()
+    for err in detail if isinstance(detail, list) else ():
+        loc = err.get('loc') if isinstance(err, dict) else None
+        if isinstance(loc, list) and loc[:2] == ['body', 'items'] and len(loc) > 2 and isinstance(loc[2], int):
+            if 0 <= loc[2] < n:
+                out.add(loc[2])
+    return out
+
+
+def _requeue(ids) -> int:
+    return withdrawals.transition_many(ids, 'QUEUED', claimed_at=None) if ids else 0
+
+
+def reap_stale_claims(max_age_s: float | None = None) -> list[tuple]:
+    """
+    Put SETTLING withdrawals claimed more than SETTLEMENT_CLAIM_TIMEOUT_S ago
+    back to QUEUED: their worker died between claim and finalize. Returns the
+    (id, reservation_id) pairs requeued so task mode can re-dispatch them.
+    """
+    max_age_s = max_age_s if max_age_s is not None else float(getattr(settings, 'SETTLEMENT_CLAIM_TIMEOUT_S', 900))
+    cutoff = timezone.now() - timedelta(seconds=max_age_s)
+    with transaction.atomic():
+        # Rows a finalize is holding are skipped; claims from before claimed_at existed go by created_at
+        stale = list(WithdrawalRequest.objects.select_for_update(skip_locked=True)
+                     .filter(status='SETTLING')
+                     .filter(Q(claimed_at__lt=cutoff) | Q(claimed_at__isnull=True, created_at__lt=cutoff))
+                     .values_list('id', 'reservation_id'))
+        _requeue([wid for wid, _ in stale])
+    if stale:
+        logger.warning("requeued %d withdrawal(s) stuck in SETTLING", len(stale))
+    return stale
+
+
+def finalize(results: dict, ids=None) -> dict:
+    """
+    Apply per-item results ({withdrawal_id: {'status', 'bank_reference'}}) in
+    one transaction. Withdrawals in `ids` without a result keep their hold or
+    reservation and go back to QUEUED. A SUCCESS whose credit can no longer be
+    taken goes to REVIEW with its bank reference, as in dispatch_settlement.
+    """
+    ids = ids if ids is not None else list(results)
+    counts = {'success': 0, 'failed': 0, 'review': 0, 'requeued': 0}
+    with transaction.atomic():
+        # Withdrawal rows before holds, the lock order dispatch_settlement and the sweeper use
+        rows = list(WithdrawalRequest.objects.select_for_update().select_related('merchant', 'account')
+                    .filter(id__in=ids, status='SETTLING').order_by('id'))
+        ok, failed = [], []
+        for wr in rows:
+            result = results.get(str(wr.id))
+            if result is None:
+                withdrawals.advance(wr, 'QUEUED', claimed_at=None)
+                counts['requeued'] += 1
+            else:
+                (ok if result.get('status') == 'SUCCESS' else failed).append(wr)
+        if counts['requeued']:
+            logger.warning("settlement batch answered without %d item(s); requeued", counts['requeued'])
+
+        held = set(CreditHold.objects.filter(withdrawal_id__in=[wr.id for wr in ok], status='HELD')
+                   .values_list('withdrawal_id', flat=True))
+        holds.capture_holds(held)
+        for wr in ok:
+            to = 'SUCCESS'
+            if wr.reservation_id:
+                credit_front.commit(wr.reservation_id, wr.merchant, wr.account, wr.amount)
+            elif wr.id not in held:
+                try:
+                    with transaction.atomic():
+                        atomic_consume_credit(wr.merchant, wr.account, wr.amount)
+                except ValueError:
+                    to = 'REVIEW'
+                    logger.error("withdrawal %s paid by the bank but its credit could not be taken; flagged for review",
+                                 wr.id)
+            withdrawals.advance(wr, to, bank_reference=results[str(wr.id)].get('bank_reference', ''))
+            counts['success' if to == 'SUCCESS' else 'review'] += 1
+
+        for wr in failed:
+            withdrawals.advance(wr, 'FAILED')
+            if wr.reservation_id:
+                credit_front.release(wr.reservation_id, wr.merchant_id)
+            holds.release_hold(wr.id)
+            counts['failed'] += 1
+        WithdrawalRequest.objects.bulk_update(rows, ['status', 'bank_reference', 'claimed_at'])
+    return counts
+
+
+def drain(batch_size: int | None = None, max_seconds: float | None = None) -> dict:
+    """
+    Settle full batches until the queue runs short or `max_seconds` (default:
+    one SETTLEMENT_BATCH_WINDOW_S) has passed. Returns summed counts.
+    """
+    batch_size = batch_size or int(getattr(settings, 'SETTLEMENT_BATCH_SIZE', 200))
+    max_seconds = max_seconds if max_seconds is not None else float(getattr(settings, 'SETTLEMENT_BATCH_WINDOW_S', 1.0))
+    totals = {'batches': 0, 'success': 0, 'failed': 0, 'review': 0, 'requeued': 0}
+    started = time.monotonic()
+    while True:
+        batch = claim(batch_size)
+        if not batch:
+            return totals
+        totals['batches'] += 1
+        for k, v in settle_batch(batch).items():
+            totals[k] += v
+        if totals['requeued'] or len(batch) < batch_size or time.monotonic() - started >= max_seconds:
+            return totals
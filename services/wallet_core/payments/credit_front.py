@@ -0,0 +1,198 @@
+"""
+Redis credit reservation front (CREDIT_RESERVATION_FRONT=1).
+
+Admission for withdrawals happens against Redis counters (see the Lua scripts
+in `utils.cache`), so over-limit requests are rejected without touching
+Postgres and accepted ones never wait on the pool row lock. Settled
+reservations are queued and written to MerchantCredit/CreditPool/LedgerEntry
+in batches by `apply_reservations`; `rebuild_counters` recomputes the Redis
+view from the DB after a Redis restart or drift.
+
+Until the counters have been built (`credit:ready` missing) every reserve
+returns BYPASS and callers use the regular `atomic_consume_credit` path.
+"""
+
+from __future__ import annotations
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import F
+
+from .models import CreditPool, MerchantCredit, LedgerEntry, pool_stripes, q
+from .group_commit import ConsumeRequest, apply_batch
+from . import lockprof
+from .utils.cache import (
+    redis_client, credit_avail_key, credit_reserve, credit_release, credit_commit, credit_claim,
+    credit_inflight, credit_applied,
+    CREDIT_READY_KEY, CREDIT_POOL_KEY, CREDIT_PENDING_KEY, CREDIT_HOLDS_KEY,
+)
+
+logger = logging.getLogger(__name__)
+
+FAILED_KEY = 'credit:apply:failed'
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, 'CREDIT_RESERVATION_FRONT', False))
+
+
+def to_cents(amount) -> int:
+    return int(q(amount) * 100)
+
+
+def reserve(merchant, amount: Decimal) -> tuple[str, str | None]:
+    """
+    Returns (verdict, reservation_id). Verdict is 'OK', 'INSUFFICIENT_*' or
+    'BYPASS'; only 'OK' carries a reservation id.
+    """
+    rid = uuid.uuid4().hex
+    cents = to_cents(amount)
+    verdict = credit_reserve(merchant.id, cents, rid)
+    if verdict == 'MISS':
+        load_merchant_counter(merchant.id)
+        verdict = credit_reserve(merchant.id, cents, rid)
+    if verdict == 'MISS':
+        verdict = 'BYPASS'
+    return verdict, (rid if verdict == 'OK' else None)
+
+
+def release(reservation_id: str, merchant_id: int) -> None:
+    credit_release(reservation_id, merchant_id)
+
+
+def commit(reservation_id: str, merchant, account, amount: Decimal) -> uuid.UUID:
+    """Queue a settled reservation for the DB writer; returns the ledger tx_id it will get."""
+    tx_id = uuid.uuid4()
+    credit_commit(reservation_id, json.dumps({
+        'rid': reservation_id, 'merchant_id': merchant.id, 'account_id': str(account.id),
+        'amount': str(q(amount)), 'tx_id': str(tx_id),
+    }))
+    return tx_id
+
+
+def load_merchant_counter(merchant_id: int) -> None:
+    """
+    Load one merchant's counter on demand. Pending cents are read before the
+    DB balance so a concurrent writer can only make the counter too low.
+    """
+    r = redis_client()
+    pending = int(r.hget(CREDIT_PENDING_KEY, merchant_id) or 0)
+    mc = MerchantCredit.objects.filter(merchant_id=merchant_id).only('credit_limit', 'utilized_amount').first()
+    if mc is None:
+        return
+    r.set(credit_avail_key(merchant_id), to_cents(mc.available) - pending, nx=True)
+
+
+def invalidate_merchant(merchant_id: int) -> None:
+    """Forget a merchant's counter after its limit changed; it reloads on next use."""
+    redis_client().delete(credit_avail_key(merchant_id))
+
+
+def adjust_pool(delta: Decimal) -> None:
+    r = redis_client()
+    if r.exists(CREDIT_READY_KEY):
+        r.incrby(CREDIT_POOL_KEY, to_cents(delta))
+
+
+def apply_reservations(batch_size: int | None = None, max_batches: int = 100) -> int:
+    """
+    Batched writer: apply queued reservations to Postgres with one group-commit
+    transaction per batch. Reservations left in flight by a crashed writer are
+    retried first; tx_ids already in the ledger are skipped. Returns the number
+    of reservations written.
+    """
+    batch_size = batch_size or int(getattr(settings, 'CREDIT_FRONT_BATCH_SIZE', 500))
+    written = 0
+    items = credit_inflight()
+    for _ in range(max_batches):
+        if not items:
+            items = credit_claim(batch_size)
+        if not items:
+            break
+        written += _apply_items([json.loads(x) for x in items])
+        items = []
+    return written
+
+
+def _apply_items(items: list[dict]) -> int:
+    seen = set(LedgerEntry.objects.filter(tx_id__in=[i['tx_id'] for i in items]).values_list('tx_id', flat=True))
+    todo = [i for i in items if uuid.UUID(i['tx_id']) not in seen]
+    batch = [ConsumeRequest(merchant_id=i['merchant_id'], account_id=i['account_id'],
+                            amount=Decimal(i['amount']), tx_id=uuid.UUID(i['tx_id'])) for i in todo]
+    if batch:
+        apply_batch(batch)
+    failed = [(i, req.error) for i, req in zip(todo, batch) if req.error is not None]
+    if any(not isinstance(err, (ValueError, ObjectDoesNotExist)) for _, err in failed):
+        # Database trouble, not a balance problem: leave everything in flight for the next run
+        raise failed[0][1]
+    if failed:
+        r = redis_client()
+        for item, err in failed:
+            logger.error("credit front reservation %s not applied: %s", item['rid'], err)
+            r.rpush(FAILED_KEY, json.dumps({**item, 'error': str(err)}))
+    credit_applied([i['rid'] for i in items])
+    return len(batch) - len(failed)
+
+
+def rebuild_counters() -> dict:
+    """
+    Rebuild every Redis counter from Postgres. Runs while holding the pool and
+    MerchantCredit row locks, taken in the debit paths' order (pool first in
+    single-row mode, merchants first when striped), so no DB consumption or
+    batch write can land between reading the balances and publishing the
+    counters. Held reservations older than CREDIT_HOLD_TTL_S (their request
+    died mid-settlement) are dropped.
+    """
+    r = redis_client()
+    ttl = int(getattr(settings, 'CREDIT_HOLD_TTL_S', 300))
+    now = int(time.time())
+    striped = pool_stripes() > 1
+    # Send new requests down the DB path first, so no reservation lands between
+    # reading the holds and publishing the counters
+    r.delete(CREDIT_READY_KEY)
+    with transaction.atomic():
+        if not striped:
+            pools = _lock_pools()
+        with lockprof.acquire('merchantcredit.rebuild'):
+            balances = list(MerchantCredit.objects.select_for_update().order_by('merchant_id')
+                            .annotate(avail=F('credit_limit') - F('utilized_amount'))
+                            .values_list('merchant_id', 'avail'))
+        if striped:
+            pools = _lock_pools()
+        pool_cents = sum(to_cents(p.available_amount) for p in pools)
+
+        pending = defaultdict(int)
+        stale = []
+        for rid, hold in r.hgetall(CREDIT_HOLDS_KEY).items():
+            mid, cents, ts, state = hold.split(',')
+            if state == 'held' and now - int(ts) > ttl:
+                stale.append(rid)
+                continue
+            pending[int(mid)] += int(cents)
+
+        pipe = r.pipeline()
+        pipe.delete(CREDIT_PENDING_KEY)
+        if stale:
+            pipe.hdel(CREDIT_HOLDS_KEY, *stale)
+        for n, (merchant_id, avail) in enumerate(balances, 1):
+            pipe.set(credit_avail_key(merchant_id), to_cents(avail) - pending.get(merchant_id, 0))
+            if n % 5000 == 0:
+                pipe.execute()
+        if pending:
+            pipe.hset(CREDIT_PENDING_KEY, mapping={k: v for k, v in pending.items()})
+        pipe.set(CREDIT_POOL_KEY, pool_cents - sum(pending.values()))
+        pipe.set(CREDIT_READY_KEY, now)
+        pipe.execute()
+    return {'merchants': len(balances), 'pool_cents': pool_cents, 'pending_cents': sum(pending.values()), 'stale_holds': len(stale)}
+
+
+def _lock_pools() -> list[CreditPool]:
+    with lockprof.acquire('creditpool.rebuild'):
+        return list(CreditPool.objects.select_for_update().order_by('id'))
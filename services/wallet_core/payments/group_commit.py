@@ -0,0 +1,300 @@
+"""
+Group-commit engine for credit consumption (CREDIT_ENGINE=group).
+
+Concurrent `atomic_consume_credit` calls are coalesced into one transaction
+that locks the pool once, applies every merchant debit in arrival order,
+bulk-inserts the ledger pairs and commits once. Each caller still gets its own
+result: the ledger tx_id or the same ValueError('INSUFFICIENT_*') the locking
+engine would raise.
+
+Two transports:
+- local (default): threads of one worker process elect a leader that waits
+  up to GROUP_COMMIT_WINDOW_MS for followers, then runs the batch.
+- redis: callers push requests to a Redis list and block on a reply key; a
+  `python manage.py run_group_commit` process drains and applies batches for
+  every web/Celery worker.
+"""
+
+from __future__ import annotations
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction, close_old_connections
+from django.utils import timezone
+
+from .models import CreditPool, MerchantCredit, LedgerEntry, pool_stripes, pool_stripe_for, profile_changed, q
+from .utils.cache import redis_client
+from . import lockprof
+
+
+@dataclass
+class ConsumeRequest:
+    merchant_id: int
+    account_id: uuid.UUID | str
+    amount: Decimal
+    tx_id: uuid.UUID | None = None
+    error: Exception | None = None
+    done: threading.Event = field(default_factory=threading.Event)
+    promoted: bool = False
+    deadline: float | None = None
+
+
+def apply_batch(batch: list[ConsumeRequest]) -> None:
+    """
+    Apply a batch of consumption requests in a single transaction, filling in
+    `tx_id` or `error` on each request. Lock order matches the locking engine:
+    pool before merchant rows in single-row mode, merchant rows before stripes
+    in striped mode (merchant rows always in merchant_id order). In striped
+    mode only the batch's home stripes are locked (in id order); others are
+    taken with SKIP LOCKED when the home stripes run short.
+    Requests whose `deadline` (epoch seconds) passed while the batch waited for
+    its locks are dropped with ValueError('GROUP_COMMIT_TIMEOUT'); the rest
+    still commit. If the batch fails on anything else, each request is retried
+    on its own so one bad member cannot fail its peers.
+    """
+    stripes = pool_stripes()
+    if stripes == 1:
+        CreditPool.get_solo()
+    else:
+        CreditPool.ensure_stripes(stripes)
+    merchant_ids = sorted({r.merchant_id for r in batch})
+    try:
+        with transaction.atomic():
+            if stripes == 1:
+                with lockprof.acquire('creditpool.group'):
+                    pools = list(CreditPool.objects.select_for_update().filter(id=1))
+            with lockprof.acquire('merchantcredit.group'):
+                credits = {
+                    mc.merchant_id: mc for mc in
+                    MerchantCredit.objects.select_for_update().filter(merchant_id__in=merchant_ids).order_by('merchant_id')
+                }
+            if stripes > 1:
+                homes = sorted({pool_stripe_for(m, stripes) for m in merchant_ids})
+                with lockprof.acquire('creditpool.group'):
+                    pools = list(CreditPool.objects.select_for_update().filter(id__in=homes).order_by('id'))
+            pool_by_id = {p.id: p for p in pools}
+            pool_total = q(sum((p.available_amount for p in pools), Decimal('0.00')))
+            spilled = stripes == 1
+
+            ledger, touched_mc, touched_pool = [], {}, {}
+            # Checked once every lock is held; the writes left before commit are short
+            locked_at = time.time()
+            for r in batch:
+                if r.deadline is not None and locked_at > r.deadline:
+                    r.error = ValueError('GROUP_COMMIT_TIMEOUT')
+                    continue
+                mc = credits.get(r.merchant_id)
+                if mc is None:
+                    r.error = MerchantCredit.DoesNotExist('MerchantCredit matching query does not exist.')
+                    continue
+                if mc.available < r.amount:
+                    r.error = ValueError('INSUFFICIENT_MERCHANT_CREDIT')
+                    continue
+                if pool_total < r.amount and not spilled:
+                    spilled = True
+                    pool_total += _lock_spill_stripes(pool_by_id)
+                if pool_total < r.amount:
+                    r.error = ValueError('INSUFFICIENT_POOL')
+                    continue
+                mc.utilized_amount = q(mc.utilized_amount) + r.amount
+                touched_mc[mc.merchant_id] = mc
+                pool_total -= r.amount
+                _debit_stripes(pool_by_id, pool_stripe_for(r.merchant_id, stripes), r.amount, touched_pool)
+                r.tx_id = r.tx_id or uuid.uuid4()
+                ledger.append(LedgerEntry(tx_id=r.tx_id, merchant_id=r.merchant_id, account_id=r.account_id,
+                                          direction='DEBIT', source='CREDIT_POOL', amount=r.amount))
+                ledger.append(LedgerEntry(tx_id=r.tx_id, merchant_id=r.merchant_id, account_id=r.account_id,
+                                          direction='CREDIT', source='MERCHANT_CREDIT', amount=r.amount))
+
+            now = timezone.now()
+            for mc in touched_mc.values():
+                mc.updated_at = now
+            if touched_mc:
+                MerchantCredit.objects.bulk_update(list(touched_mc.values()), ['utilized_amount', 'updated_at'])
+                profile_changed(*touched_mc)
+            for p in touched_pool.values():
+                p.save(update_fields=['available_amount', 'updated_at'])
+            if ledger:
+                LedgerEntry.objects.bulk_create(ledger)
+    except Exception as exc:
+        for r in batch:
+            r.tx_id, r.error = None, exc
+        if len(batch) > 1:
+            for r in batch:
+                r.error = None
+                apply_batch([r])
+
+
+def _lock_spill_stripes(pool_by_id: dict) -> Decimal:
+    """Lock the funded stripes not yet held, skipping those other transactions hold. Returns the funds added."""
+    with lockprof.acquire('creditpool.group_spill'):
+        extra = list(CreditPool.objects.select_for_update(skip_locked=True)
+                     .filter(available_amount__gt=0).exclude(id__in=list(pool_by_id)).order_by('id'))
+    pool_by_id.update((p.id, p) for p in extra)
+    return q(sum((p.available_amount for p in extra), Decimal('0.00')))
+
+
+def _debit_stripes(pool_by_id: dict, home: int, amount: Decimal, touched: dict) -> None:
+    """Take `amount` from the home stripe first, then from the fullest others."""
+    order = [home] + sorted((i for i in pool_by_id if i != home), key=lambda i: -pool_by_id[i].available_amount)
+    for i in order:
+        if amount <= 0:
+            break
+        p = pool_by_id.get(i)
+        if p is None or p.available_amount <= 0:
+            continue
+        take = min(q(p.available_amount), amount)
+        p.available_amount = q(p.available_amount) - take
+        touched[i] = p
+        amount -= take
+
+
+class GroupCommitter:
+    """In-process leader/follower batcher."""
+
+    def __init__(self, window_ms: float, max_batch: int):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._lock = threading.Lock()
+        self._full = threading.Condition(self._lock)
+        self._queue: list[ConsumeRequest] = []
+        self._leader_active = False
+        self.batches = 0
+        self.requests = 0
+
+    def submit(self, req: ConsumeRequest) -> uuid.UUID:
+        with self._lock:
+            self._queue.append(req)
+            lead = not self._leader_active
+            if lead:
+                self._leader_active = True
+            elif len(self._queue) >= self.max_batch:
+                self._full.notify()
+        if lead:
+            self._lead()
+        while True:
+            req.done.wait()
+            if not req.promoted:
+                break
+            req.promoted = False
+            req.done.clear()
+            self._lead()
+        if req.error is not None:
+            raise req.error
+        return req.tx_id
+
+    def _lead(self) -> None:
+        with self._lock:
+            self._full.wait_for(lambda: len(self._queue) >= self.max_batch, timeout=self.window)
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+        try:
+            apply_batch(batch)
+        finally:
+            with self._lock:
+                self.batches += 1
+                self.requests += len(batch)
+                if self._queue:
+                    # Hand leadership to the oldest waiter so its thread runs the next batch
+                    nxt = self._queue[0]
+                    nxt.promoted = True
+                    nxt.done.set()
+                else:
+                    self._leader_active = False
+            for r in batch:
+                if not r.promoted:
+                    r.done.set()
+
+
+_committer: GroupCommitter | None = None
+_committer_pid: int | None = None
+_committer_lock = threading.Lock()
+
+
+def get_committer() -> GroupCommitter:
+    """Per-process committer (recreated after fork)."""
+    global _committer, _committer_pid
+    with _committer_lock:
+        if _committer is None or _committer_pid != os.getpid():
+            _committer = GroupCommitter(
+                getattr(settings, 'GROUP_COMMIT_WINDOW_MS', 2.0),
+                getattr(settings, 'GROUP_COMMIT_MAX_BATCH', 64),
+            )
+            _committer_pid = os.getpid()
+        return _committer
+
+
+def consume_grouped(merchant, account, amount: Decimal) -> uuid.UUID:
+    if getattr(settings, 'GROUP_COMMIT_TRANSPORT', 'local') == 'redis':
+        return consume_via_redis(merchant.id, account.id, amount)
+    req = ConsumeRequest(merchant_id=merchant.id, account_id=account.id, amount=q(amount))
+    return get_committer().submit(req)
+
+
+# --- Redis transport ---
+
+def _queue_key() -> str:
+    return getattr(settings, 'GROUP_COMMIT_QUEUE_KEY', 'gc:consume')
+
+
+def consume_via_redis(merchant_id: int, account_id, amount: Decimal) -> uuid.UUID:
+    """
+    Enqueue a request for the group-commit server and wait for its result.
+    The server skips requests whose deadline has passed, before the batch and
+    again once its locks are held; the caller keeps waiting
+    GROUP_COMMIT_REPLY_GRACE_S past the deadline for the remaining writes, the
+    commit and clock skew, so a caller that gave up is never debited behind
+    its back.
+    """
+    r = redis_client()
+    timeout = float(getattr(settings, 'GROUP_COMMIT_REPLY_TIMEOUT_S', 5))
+    grace = float(getattr(settings, 'GROUP_COMMIT_REPLY_GRACE_S', 2))
+    req_id = uuid.uuid4().hex
+    r.rpush(_queue_key(), json.dumps({
+        'id': req_id, 'merchant_id': merchant_id, 'account_id': str(account_id),
+        'amount': str(q(amount)), 'deadline': time.time() + timeout,
+    }))
+    reply = r.blpop(f"{_queue_key()}:reply:{req_id}", timeout=math.ceil(timeout + grace))
+    if reply is None:
+        raise ValueError('GROUP_COMMIT_TIMEOUT')
+    data = json.loads(reply[1])
+    if data.get('error'):
+        raise ValueError(data['error'])
+    return uuid.UUID(data['tx_id'])
+
+
+def serve_group_commit(stop: threading.Event | None = None, max_batches: int | None = None) -> int:
+    """Drain the Redis queue in batches until `stop` is set. Returns batches applied."""
+    r = redis_client()
+    key = _queue_key()
+    max_batch = int(getattr(settings, 'GROUP_COMMIT_MAX_BATCH', 64))
+    applied = 0
+    while not (stop and stop.is_set()) and (max_batches is None or applied < max_batches):
+        first = r.blpop(key, timeout=1)
+        if first is None:
+            continue
+        raw = [first[1]] + (r.lpop(key, max_batch - 1) or [])
+        now = time.time()
+        items = [json.loads(x) for x in raw]
+        live = [i for i in items if i['deadline'] > now]
+        batch = [ConsumeRequest(merchant_id=i['merchant_id'], account_id=i['account_id'], amount=Decimal(i['amount']),
+                                deadline=i['deadline'])
+                 for i in live]
+        close_old_connections()
+        if batch:
+            apply_batch(batch)
+        pipe = r.pipeline()
+        for item, req in zip(live, batch):
+            out = {'tx_id': str(req.tx_id)} if req.error is None else {'error': str(req.error.args[0] if req.error.args else req.error)}
+            reply_key = f"{key}:reply:{item['id']}"
+            pipe.rpush(reply_key, json.dumps(out))
+            pipe.expire(reply_key, 60)
+        pipe.execute()
+        applied += 1
+    return applied
@@ -0,0 +1,140 @@
+"""
+Credit holds: reserve a withdrawal's credit before calling settlement.
+
+`hold_credit` debits the balances and records a HELD CreditHold in one
+transaction, so an over-limit merchant gets its 409 without an upstream call.
+After settlement, `capture_hold` writes the ledger pair and `release_hold`
+returns the amount. `release_expired_holds` is the sweeper for holds whose
+request died before settlement was called. Every transition is guarded by the hold's status,
+so retried tasks cannot capture or release twice.
+"""
+
+from __future__ import annotations
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import lockprof, money, withdrawals
+from .models import (
+    CreditHold, CreditPool, LedgerEntry, MerchantCredit, WithdrawalRequest, locked_debit, pool_stripes, profile_changed, q,
+    _move_credit, _write_ledger_pair,
+)
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, 'CREDIT_HOLDS', True))
+
+
+def hold_credit(wr: WithdrawalRequest, then=None) -> CreditHold:
+    """
+    Debit balances for `wr` and record the hold. Raises ValueError('INSUFFICIENT_*').
+    `then()` runs in the same transaction, e.g. to insert `wr` itself.
+    """
+    amount = q(wr.amount)
+    expires_at = timezone.now() + timedelta(seconds=getattr(settings, 'WITHDRAWAL_HOLD_EXPIRY_S', 900))
+
+    def record(stripe_id):
+        hold = CreditHold.objects.create(
+            withdrawal=wr, merchant_id=wr.merchant_id, account_id=wr.account_id,
+            amount=amount, pool_stripe=stripe_id, expires_at=expires_at,
+        )
+        if then is not None:
+            then()
+        return hold
+    return locked_debit(wr.merchant, amount, record)
+
+
+def capture_hold(withdrawal_id) -> uuid.UUID:
+    """Turn the withdrawal's hold into ledger entries. Idempotent; returns the tx_id."""
+    # No savepoint inside a caller's transaction: any failure here aborts it anyway
+    with transaction.atomic(savepoint=False):
+        hold = CreditHold.objects.select_for_update().select_related('merchant', 'account').get(withdrawal_id=withdrawal_id)
+        if hold.status == 'CAPTURED':
+            return hold.tx_id
+        if hold.status != 'HELD':
+            raise ValueError('HOLD_RELEASED')
+        hold.tx_id = _write_ledger_pair(hold.merchant, hold.account, hold.amount)
+        hold.status = 'CAPTURED'
+        hold.save(update_fields=['tx_id', 'status'])
+        return hold.tx_id
+
+
+def capture_holds(withdrawal_ids) -> dict:
+    """
+    Batch form of `capture_hold`: one locking SELECT, one ledger bulk insert and
+    one bulk update. Returns {withdrawal_id: tx_id}; ids without a hold are
+    left out. Raises ValueError('HOLD_RELEASED') like `capture_hold`.
+    """
+    out, captured, ledger = {}, [], []
+    with transaction.atomic():
+        for hold in CreditHold.objects.select_for_update().filter(withdrawal_id__in=withdrawal_ids).order_by('withdrawal_id'):
+            if hold.status == 'HELD':
+                hold.tx_id, hold.status = uuid.uuid4(), 'CAPTURED'
+                captured.append(hold)
+                for direction, source in (('DEBIT', 'CREDIT_POOL'), ('CREDIT', 'MERCHANT_CREDIT')):
+                    ledger.append(LedgerEntry(tx_id=hold.tx_id, merchant_id=hold.merchant_id, account_id=hold.account_id,
+                                              direction=direction, source=source, amount=hold.amount))
+            elif hold.status != 'CAPTURED':
+                raise ValueError('HOLD_RELEASED')
+            out[hold.withdrawal_id] = hold.tx_id
+        LedgerEntry.objects.bulk_create(ledger)
+        CreditHold.objects.bulk_update(captured, ['tx_id', 'status'])
+    return out
+
+
+def release_hold(withdrawal_id) -> bool:
+    """Give a HELD amount back to the merchant and the pool. Returns False if nothing was held."""
+    with transaction.atomic(savepoint=False):
+        hold = CreditHold.objects.select_for_update().filter(withdrawal_id=withdrawal_id, status='HELD').first()
+        if hold is None:
+            return False
+        _credit_back(hold)
+        hold.status = 'RELEASED'
+        hold.save(update_fields=['status'])
+        return True
+
+
+def _credit_back(hold: CreditHold) -> None:
+    # Same lock order as the debit: pool first in single-row mode, merchant first when striped
+    striped = pool_stripes() > 1
+    if not striped:
+        with lockprof.acquire('creditpool.release'):
+            pool = CreditPool.objects.select_for_update().get(id=hold.pool_stripe)
+    with lockprof.acquire('merchantcredit.release'):
+        mc = MerchantCredit.objects.select_for_update().get(merchant_id=hold.merchant_id)
+    if striped:
+        with lockprof.acquire('creditpool.release'):
+            pool = CreditPool.objects.select_for_update().get(id=hold.pool_stripe)
+    _move_credit(mc, pool, -hold.amount, -money.to_minor(hold.amount) if money.enabled() else None)
+    profile_changed(hold.merchant_id)
+
+
+def release_expired_holds(batch_size: int = 500) -> int:
+    """
+    Release holds past `expires_at` and fail their withdrawals if they never
+    reached a final state. Withdrawals in SETTLING are skipped: their
+    settlement call is in flight and the bank may still pay them (claims whose
+    worker died are requeued by `batch_dispatch.reap_stale_claims`). Returns
+    the number released.
+    """
+    released = 0
+    while True:
+        ids = list(CreditHold.objects.filter(status='HELD', expires_at__lt=timezone.now())
+                   .exclude(withdrawal__status='SETTLING')
+                   .values_list('withdrawal_id', flat=True)[:batch_size])
+        if not ids:
+            return released
+        for withdrawal_id in ids:
+            with transaction.atomic():
+                # Lock the withdrawal before the hold, the same order dispatch_settlement uses
+                wr = WithdrawalRequest.objects.select_for_update().filter(id=withdrawal_id).first()
+                if wr is not None and wr.status == 'SETTLING':
+                    continue
+                if release_hold(withdrawal_id):
+                    released += 1
+                    withdrawals.transition_many([withdrawal_id], 'FAILED')
+        if len(ids) < batch_size:
+            return released
@@ -0,0 +1,96 @@
+"""
+Idempotency-Key handling with a Redis fast path.
+
+`begin()` claims the key with one SET NX (in-flight marker, TTL
+IDEMPOTENCY_INFLIGHT_TTL_S) before the withdrawal is processed, so a
+concurrent retry with the same key gets IN_PROGRESS instead of running twice.
+Finished responses are kept in Redis for IDEMPOTENCY_TTL_S and replayed from
+there. Replays and in-flight duplicates never touch the database.
+
+Postgres stays the durable copy. `finish()` writes the IdempotencyRecord, and
+a new claim checks Postgres only while Redis could be missing older keys: from
+the time Redis started tracking keys (`idem:since`, reset when Redis loses
+its data) until one TTL has passed. Redis must not evict these keys
+(maxmemory-policy noeviction or volatile-ttl with headroom).
+`purge_expired()` deletes records older than the TTL in batches (payments.retention).
+"""
+
+from __future__ import annotations
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .models import IdempotencyRecord
+from .utils.cache import idempotency_claim, idempotency_release, idempotency_key, redis_client
+
+
+def ttl_seconds() -> int:
+    return int(getattr(settings, 'IDEMPOTENCY_TTL_S', 86400))
+
+
+@dataclass
+class Claim:
+    key: str
+    request_hash: str
+    verdict: str                  # NEW, REPLAY, CONFLICT or IN_PROGRESS
+    response: dict | None = None
+    marker: str = field(default='', repr=False)
+
+
+def begin(key: str, request_hash: str) -> Claim:
+    marker = json.dumps({'h': request_hash, 't': uuid.uuid4().hex})
+    inflight_ttl = int(getattr(settings, 'IDEMPOTENCY_INFLIGHT_TTL_S', 60))
+    verdict, value = idempotency_claim(key, marker, inflight_ttl)
+    if verdict == 'EXISTS':
+        return _from_stored(key, request_hash, json.loads(value))
+
+    if time.time() - int(value) < ttl_seconds():
+        # Redis may predate keys still retained in Postgres: check the durable copy once
+        rec = IdempotencyRecord.objects.filter(key=key).first()
+        if rec is not None:
+            _store(key, rec.request_hash, rec.response_json)
+            return _from_stored(key, request_hash, {'h': rec.request_hash, 'r': rec.response_json})
+    return Claim(key, request_hash, 'NEW', marker=marker)
+
+
+def _from_stored(key: str, request_hash: str, stored: dict) -> Claim:
+    if stored.get('h') != request_hash:
+        return Claim(key, request_hash, 'CONFLICT')
+    if 'r' not in stored:
+        return Claim(key, request_hash, 'IN_PROGRESS')
+    return Claim(key, request_hash, 'REPLAY', response=stored['r'])
+
+
+def _store(key: str, request_hash: str, response: dict) -> None:
+    redis_client().set(idempotency_key(key), json.dumps({'h': request_hash, 'r': response}, cls=DjangoJSONEncoder),
+                       ex=ttl_seconds())
+
+
+def finish(claim: Claim, response: dict) -> None:
+    """
+    Record the final response: durable row first, then the Redis replay copy.
+    Inside a transaction the row commits with the caller's writes, and the
+    Redis copy is only published once it has.
+    """
+    IdempotencyRecord.objects.bulk_create(
+        [IdempotencyRecord(key=claim.key, request_hash=claim.request_hash, response_json=response)],
+        ignore_conflicts=True,
+    )
+    transaction.on_commit(lambda: _store(claim.key, claim.request_hash, response))
+
+
+def release(claim: Claim) -> None:
+    """Drop our in-flight claim so the client can retry (nothing was recorded)."""
+    if claim.verdict == 'NEW':
+        idempotency_release(claim.key, claim.marker)
+
+
+def purge_expired(batch_size: int = 1000, max_batches: int | None = None) -> int:
+    """Delete IdempotencyRecord rows older than IDEMPOTENCY_TTL_S (the 'idempotency' retention policy)."""
+    from . import retention
+    return retention.run_policy('idempotency', batch_size=batch_size, max_batches=max_batches, sleep_s=0).rows
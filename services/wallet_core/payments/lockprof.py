@@ -0,0 +1,310 @@
+"""
+Row-lock contention profiler for the credit tables (LOCK_PROFILE).
+
+In process: `acquire(site)` wraps the query that takes a `select_for_update`
+lock on CreditPool or MerchantCredit rows. It records the time until the rows
+were returned (lock wait plus one round trip) in
+wallet_lock_wait_seconds{site}. It also records the time from then until the
+transaction commits in wallet_lock_hold_seconds{site}. Sites are
+'<table>.<caller>', e.g. 'creditpool.debit'. Both histograms are served on
+/metrics (METRICS_ENABLED), across workers in multiprocess mode. When
+LOCK_PROFILE is off, `acquire()` returns a shared no-op context manager.
+
+From outside: `snapshot()` reads pg_stat_activity and pg_locks once. It
+returns every session waiting on a lock, with the pids blocking it
+(pg_blocking_pids) and how long it has waited (pg_locks.waitstart,
+Postgres 14+), plus the blocking sessions and their transaction age.
+`lock_profile sample` polls this during a load test and writes the samples
+to a JSONL file, optionally with the in-process histograms scraped from
+/metrics before and after.
+
+`summarize()` turns a sample file into a report:
+- lock wait histograms, overall and per table;
+- the longest blocking chains;
+- the root blockers (sessions holding locks that others queue behind),
+  grouped by their last statement;
+- blocker transaction age (lock hold time so far) by queue depth.
+`violations()` checks the report against thresholds, so
+`lock_profile report --max-p95-wait-ms ...` can gate a run.
+
+For example, against the compose Postgres directly (not through PgBouncer),
+while a load test runs with LOCK_PROFILE=1 METRICS_ENABLED=1 on the web
+service:
+  DB_HOST=127.0.0.1 DB_PORT=5432 python manage.py lock_profile sample locks.jsonl \\
+      --duration 120 --metrics-url http://127.0.0.1:8000/metrics --max-p95-wait-ms 50
+"""
+
+from __future__ import annotations
+import contextlib
+import re
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from prometheus_client import Histogram
+
+_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+LOCK_WAIT_SECONDS = Histogram('wallet_lock_wait_seconds', 'Time to acquire credit row locks (select_for_update)',
+                              ['site'], buckets=_BUCKETS)
+LOCK_HOLD_SECONDS = Histogram('wallet_lock_hold_seconds', 'Time credit row locks were held until commit',
+                              ['site'], buckets=_BUCKETS)
+REPORT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+DEPTH_BUCKETS = ((1, 1), (2, 2), (3, 4), (5, 8), (9, 16), (17, None))
+
+_NOOP = contextlib.nullcontext()
+
+
+def enabled() -> bool:
+    return settings.LOCK_PROFILE
+
+
+class _Acquire:
+    __slots__ = ('site', '_t0')
+
+    def __init__(self, site: str):
+        self.site = site
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            granted = time.perf_counter()
+            LOCK_WAIT_SECONDS.labels(self.site).observe(granted - self._t0)
+            hold = LOCK_HOLD_SECONDS.labels(self.site)
+            # Only committed transactions report a hold time; rollbacks release without a callback
+            transaction.on_commit(lambda: hold.observe(time.perf_counter() - granted))
+        return False
+
+
+def acquire(site: str):
+    """Time the select_for_update evaluated in this block as `site`; a no-op unless LOCK_PROFILE is on."""
+    if not settings.LOCK_PROFILE:
+        return _NOOP
+    return _Acquire(site)
+
+
+# --- Sampling pg_locks / pg_stat_activity ---
+
+_SNAPSHOT_SQL = """
+WITH waiting AS (
+    SELECT a.pid, pg_blocking_pids(a.pid) AS blocked_by,
+           EXTRACT(EPOCH FROM clock_timestamp() - l.waitstart) AS wait_s,
+           EXTRACT(EPOCH FROM l.waitstart) AS wait_started,
+           l.locktype, l.relation::regclass::text AS relation, a.query
+    FROM pg_stat_activity a
+    JOIN pg_locks l ON l.pid = a.pid AND NOT l.granted
+    WHERE a.datname = current_database() AND a.pid <> pg_backend_pid()
+)
+SELECT 'W', w.pid, w.blocked_by, w.wait_s, w.wait_started, w.locktype, w.relation, w.query, NULL, NULL FROM waiting w
+UNION ALL
+SELECT 'B', a.pid, NULL, NULL, NULL, NULL, NULL, a.query,
+       EXTRACT(EPOCH FROM clock_timestamp() - a.xact_start), a.state
+FROM pg_stat_activity a
+WHERE a.pid IN (SELECT unnest(blocked_by) FROM waiting)
+"""
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_TABLE = re.compile(r'(?:FROM|UPDATE|INTO)\s+"?(\w+)"?', re.IGNORECASE)
+
+
+def normalize(query: str) -> str:
+    """Statement shape: literals replaced by ?, whitespace collapsed, capped at 160 chars."""
+    return ' '.join(_LITERALS.sub('?', query or '').split())[:160]
+
+
+def table_of(relation: str | None, query: str) -> str:
+    # Row locks are waited on as the holder's transactionid, which names no relation; fall back to the statement
+    if relation:
+        return relation
+    m = _TABLE.search(query or '')
+    return m.group(1) if m else '?'
+
+
+def snapshot() -> dict:
+    """One sample of the sessions waiting on locks and the sessions blocking them."""
+    waiters, blockers = [], {}
+    with connection.cursor() as cur:
+        cur.execute(_SNAPSHOT_SQL)
+        for kind, pid, blocked_by, wait_s, wait_started, locktype, relation, query, xact_s, state in cur.fetchall():
+            if kind == 'W':
+                waiters.append({
+                    'pid': pid, 'blocked_by': list(blocked_by or ()), 'wait_s': float(wait_s or 0),
+                    'wait_started': float(wait_started or 0), 'locktype': locktype,
+                    'table': table_of(relation, query), 'query': normalize(query),
+                })
+            else:
+                blockers[str(pid)] = {'xact_s': float(xact_s or 0), 'state': state, 'query': normalize(query)}
+    return {'kind': 'sample', 'ts': time.time(), 'waiters': waiters, 'blockers': blockers}
+
+
+# --- Report ---
+
+def _quantile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _histogram_ms(values_s: list[float]) -> dict:
+    counts = {f'le_{b}ms': 0 for b in REPORT_BUCKETS_MS}
+    counts['inf'] = 0
+    for v in values_s:
+        ms = v * 1000
+        label = next((f'le_{b}ms' for b in REPORT_BUCKETS_MS if ms <= b), 'inf')
+        counts[label] += 1
+    return counts
+
+
+def _stats_ms(values_s: list[float]) -> dict:
+    return {
+        'count': len(values_s),
+        'p50_ms': round(_quantile(values_s, 0.50) * 1000, 2),
+        'p95_ms': round(_quantile(values_s, 0.95) * 1000, 2),
+        'p99_ms': round(_quantile(values_s, 0.99) * 1000, 2),
+        'max_ms': round(max(values_s, default=0) * 1000, 2),
+    }
+
+
+def _depth_label(depth: int) -> str:
+    for lo, hi in DEPTH_BUCKETS:
+        if depth >= lo and (hi is None or depth <= hi):
+            return f'{lo}+' if hi is None else (str(lo) if lo == hi else f'{lo}-{hi}')
+    return '0'
+
+
+def _chains(sample: dict) -> tuple[dict, dict]:
+    """Per sample: waiter pid -> chain depth to its root blocker, and root blocker pid -> sessions queued behind it."""
+    edges = {w['pid']: w['blocked_by'] for w in sample['waiters']}
+    depth, roots = {}, defaultdict(set)
+
+    def walk(pid, seen):
+        # Returns (depth, root pids); cycles (deadlocks about to be broken) end the walk
+        parents = [p for p in edges.get(pid, ()) if p not in seen]
+        if not parents:
+            return 0, {pid}
+        best, found = 0, set()
+        for p in parents:
+            d, r = walk(p, seen | {p})
+            best = max(best, d)
+            found |= r
+        return best + 1, found
+
+    for pid in edges:
+        d, r = walk(pid, {pid})
+        depth[pid] = d
+        for root in r - {pid}:
+            roots[root].add(pid)
+    return depth, roots
+
+
+def summarize(records: list[dict]) -> dict:
+    samples = [r for r in records if r.get('kind') == 'sample']
+    # A wait spans several samples: keep its last (longest) observation
+    waits: dict[tuple, dict] = {}
+    blockers = defaultdict(lambda: {'samples': 0, 'waiters': 0, 'max_queue': 0, 'xact_s': []})
+    by_depth = defaultdict(list)
+    longest_chain = 0
+    for s in samples:
+        for w in s['waiters']:
+            waits[(w['pid'], w['wait_started'])] = w
+        depth, roots = _chains(s)
+        longest_chain = max(longest_chain, max(depth.values(), default=0))
+        for root, queued in roots.items():
+            info = s['blockers'].get(str(root), {'xact_s': 0.0, 'state': '?', 'query': '?'})
+            entry = blockers[(info['state'], info['query'])]
+            entry['samples'] += 1
+            entry['waiters'] += len(queued)
+            entry['max_queue'] = max(entry['max_queue'], len(queued))
+            entry['xact_s'].append(info['xact_s'])
+            by_depth[_depth_label(len(queued))].append(info['xact_s'])
+
+    all_waits = [w['wait_s'] for w in waits.values()]
+    per_table = defaultdict(list)
+    for w in waits.values():
+        per_table[w['table']].append(w['wait_s'])
+    top = sorted(blockers.items(), key=lambda kv: kv[1]['waiters'], reverse=True)[:10]
+    report = {
+        'samples': len(samples),
+        'duration_s': round(samples[-1]['ts'] - samples[0]['ts'], 3) if samples else 0,
+        'samples_with_waiters': sum(bool(s['waiters']) for s in samples),
+        'lock_wait': {**_stats_ms(all_waits), 'histogram': _histogram_ms(all_waits)},
+        'lock_wait_by_table': {t: _stats_ms(v) for t, v in sorted(per_table.items())},
+        'longest_chain': longest_chain,
+        'top_blockers': [
+            {'state': state, 'query': query, 'samples': e['samples'], 'waiters': e['waiters'],
+             'max_queue': e['max_queue'], 'xact_p95_ms': round(_quantile(e['xact_s'], 0.95) * 1000, 2)}
+            for (state, query), e in top
+        ],
+        'hold_by_queue_depth': {
+            label: _stats_ms(by_depth[label]) for label in (_depth_label(lo) for lo, _ in DEPTH_BUCKETS)
+            if by_depth[label]
+        },
+    }
+    app = [r for r in records if r.get('kind') == 'app']
+    if app:
+        report['app'] = app[-1]['sites']
+    return report
+
+
+def violations(report: dict, max_p95_wait_ms: float | None = None, max_chain: int | None = None,
+               max_app_p95_wait_ms: float | None = None) -> list[str]:
+    """Threshold breaches in `report` (empty when the run passes)."""
+    out = []
+    if max_p95_wait_ms is not None and report['lock_wait']['p95_ms'] > max_p95_wait_ms:
+        out.append(f"lock wait p95 {report['lock_wait']['p95_ms']}ms > {max_p95_wait_ms}ms")
+    if max_chain is not None and report['longest_chain'] > max_chain:
+        out.append(f"blocking chain of {report['longest_chain']} > {max_chain}")
+    if max_app_p95_wait_ms is not None:
+        for site, s in report.get('app', {}).items():
+            if s.get('wait_p95_ms', 0) > max_app_p95_wait_ms:
+                out.append(f"{site} lock wait p95 {s['wait_p95_ms']}ms > {max_app_p95_wait_ms}ms")
+    return out
+
+
+# --- In-process histograms scraped from /metrics ---
+
+def scrape(text: str) -> dict:
+    """Cumulative bucket counts per (histogram, site) from a /metrics payload."""
+    from prometheus_client.parser import text_string_to_metric_families
+    out = defaultdict(dict)
+    for family in text_string_to_metric_families(text):
+        if family.name not in ('wallet_lock_wait_seconds', 'wallet_lock_hold_seconds'):
+            continue
+        for sample in family.samples:
+            if sample.name.endswith('_bucket'):
+                out[f"{family.name}|{sample.labels['site']}"][sample.labels['le']] = sample.value
+    return out
+
+
+def _bucket_quantile(buckets: dict, q: float) -> float:
+    # Linear interpolation inside the bucket holding the quantile, as PromQL's histogram_quantile
+    bounds = sorted(((float(le), n) for le, n in buckets.items()), key=lambda b: b[0])
+    total = bounds[-1][1] if bounds else 0
+    if not total:
+        return 0.0
+    rank, lower, below = q * total, 0.0, 0.0
+    for upper, count in bounds:
+        if count >= rank:
+            if upper == float('inf'):
+                return lower
+            return lower + (upper - lower) * ((rank - below) / max(count - below, 1e-9))
+        lower, below = upper, count
+    return lower
+
+
+def app_delta(before: dict, after: dict) -> dict:
+    """Per site: lock acquisitions, and wait/hold p50/p95 over the sampling window."""
+    sites = defaultdict(dict)
+    for key, buckets in after.items():
+        name, site = key.split('|', 1)
+        delta = {le: n - before.get(key, {}).get(le, 0) for le, n in buckets.items()}
+        kind = 'wait' if name == 'wallet_lock_wait_seconds' else 'hold'
+        if kind == 'wait':
+            sites[site]['acquired'] = int(delta.get('+Inf', 0))
+        sites[site][f'{kind}_p50_ms'] = round(_bucket_quantile(delta, 0.50) * 1000, 2)
+        sites[site][f'{kind}_p95_ms'] = round(_bucket_quantile(delta, 0.95) * 1000, 2)
+    return dict(sites)
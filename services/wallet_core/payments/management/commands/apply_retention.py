@@ -0,0 +1,27 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from payments import retention
+
+
+class Command(BaseCommand):
+    help = "Delete or archive expired rows per RETENTION_POLICIES in throttled, checkpointed batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('policies', nargs='*', help="Policies to run (default: all configured).")
+        parser.add_argument('--dry-run', action='store_true', help="Walk the batches without archiving or deleting.")
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--max-seconds', type=float, default=None, help="Time budget per policy (default RETENTION_MAX_SECONDS).")
+        parser.add_argument('--sleep', type=float, default=None, help="Pause between batches (default RETENTION_SLEEP_S).")
+
+    def handle(self, *args, **options):
+        names = options['policies'] or list(settings.RETENTION_POLICIES)
+        unknown = [n for n in names if n not in settings.RETENTION_POLICIES or n not in retention.POLICY_TABLES]
+        if unknown:
+            raise CommandError(f"Unknown retention policies: {', '.join(unknown)}")
+        for name in names:
+            outcome = retention.run_policy(name, dry_run=options['dry_run'], batch_size=options['batch_size'],
+                                           max_seconds=options['max_seconds'], sleep_s=options['sleep'])
+            self.stdout.write(json.dumps(outcome.__dict__))
@@ -0,0 +1,29 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments import money
+
+
+class Command(BaseCommand):
+    help = "Fill the integer cents columns (payments.money) for rows written before they existed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help=f"Models to backfill (default: all of {', '.join(money.MINOR_FIELDS)}).")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--sleep', type=float, default=0.05, help="Pause between batches, in seconds.")
+        parser.add_argument('--check', action='store_true',
+                            help="Only count rows still missing cents; exits non-zero if any are left.")
+
+    def handle(self, *args, **options):
+        unknown = [m for m in options['models'] if m not in money.MINOR_FIELDS]
+        if unknown:
+            raise CommandError(f"Unknown models: {', '.join(unknown)}")
+        if not options['check']:
+            filled = money.backfill(batch_size=options['batch_size'], sleep_s=options['sleep'],
+                                    models=options['models'] or None)
+            self.stdout.write(json.dumps({'filled': filled}))
+        left = money.pending()
+        self.stdout.write(json.dumps({'pending': left}))
+        if options['check'] and any(left.values()):
+            raise CommandError("Rows without cents remain; keep MONEY_MINOR_UNITS off until backfill_minor_units completes.")
@@ -0,0 +1,38 @@
+import sys
+import uuid
+from datetime import datetime
+
+from django.core.management.base import BaseCommand
+
+from payments import export
+
+
+class Command(BaseCommand):
+    help = "Stream ledger entries or withdrawals as NDJSON/CSV (optionally gzipped) to a file or stdout."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(export.EXPORTS))
+        parser.add_argument('--format', choices=sorted(export.CONTENT_TYPES), default='ndjson')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output', help="File to write (default stdout).")
+        parser.add_argument('--from', dest='created_from', type=datetime.fromisoformat, help="created_at >= (ISO 8601).")
+        parser.add_argument('--to', dest='created_to', type=datetime.fromisoformat, help="created_at < (ISO 8601).")
+        parser.add_argument('--merchant', type=int, dest='merchant_id')
+        parser.add_argument('--after', nargs=2, metavar=('CREATED_AT', 'ID'),
+                            help="Resume after this row (created_at and id of the last row written).")
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **o):
+        after = (datetime.fromisoformat(o['after'][0]), uuid.UUID(o['after'][1])) if o['after'] else None
+        parts = export.stream(o['kind'], o['format'], o['gzip'], created_from=o['created_from'],
+                              created_to=o['created_to'], merchant_id=o['merchant_id'], after=after,
+                              chunk_size=o['chunk_size'])
+        out = open(o['output'], 'wb') if o['output'] else sys.stdout.buffer
+        try:
+            for part in parts:
+                out.write(part)
+        finally:
+            if o['output']:
+                out.close()
+            else:
+                out.flush()
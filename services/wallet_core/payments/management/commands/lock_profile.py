@@ -0,0 +1,61 @@
+import json
+import time
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+
+from payments import lockprof
+
+
+class Command(BaseCommand):
+    help = ("Sample pg_locks/pg_stat_activity for blocking chains during a load test (`sample`), "
+            "or turn a sample file into a lock contention report and check it against thresholds (`report`).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('sample', 'report'))
+        parser.add_argument('file', help="JSONL sample file (written by `sample`, read by `report`).")
+        parser.add_argument('--duration', type=float, default=60.0, help="Seconds to sample for.")
+        parser.add_argument('--interval', type=float, default=0.05, help="Seconds between samples.")
+        parser.add_argument('--metrics-url', help="Scrape wallet_lock_* histograms (LOCK_PROFILE=1) from this "
+                                                  "/metrics URL before and after sampling.")
+        parser.add_argument('--metrics-token', default='', help="Bearer token for --metrics-url (METRICS_TOKEN).")
+        parser.add_argument('--max-p95-wait-ms', type=float, help="Fail if the sampled lock wait p95 exceeds this.")
+        parser.add_argument('--max-chain', type=int, help="Fail if any blocking chain is longer than this.")
+        parser.add_argument('--max-app-p95-wait-ms', type=float,
+                            help="Fail if any in-process lock site's wait p95 exceeds this.")
+
+    def handle(self, *args, **o):
+        if o['action'] == 'sample':
+            self._sample(o)
+        report = lockprof.summarize(self._read(o['file']))
+        self.stdout.write(json.dumps(report, indent=1))
+        failed = lockprof.violations(report, max_p95_wait_ms=o['max_p95_wait_ms'], max_chain=o['max_chain'],
+                                     max_app_p95_wait_ms=o['max_app_p95_wait_ms'])
+        if failed:
+            raise CommandError('; '.join(failed))
+
+    def _scrape(self, o) -> dict:
+        headers = {'Authorization': f"Bearer {o['metrics_token']}"} if o['metrics_token'] else {}
+        r = requests.get(o['metrics_url'], headers=headers, timeout=10)
+        if r.status_code != 200:
+            raise CommandError(f"{o['metrics_url']} returned {r.status_code}; is METRICS_ENABLED on?")
+        return lockprof.scrape(r.text)
+
+    def _sample(self, o) -> None:
+        before = self._scrape(o) if o['metrics_url'] else None
+        deadline = time.monotonic() + o['duration']
+        with open(o['file'], 'w') as out:
+            while time.monotonic() < deadline:
+                started = time.monotonic()
+                out.write(json.dumps(lockprof.snapshot()) + '\n')
+                time.sleep(max(0.0, o['interval'] - (time.monotonic() - started)))
+            if before is not None:
+                out.write(json.dumps({'kind': 'app', 'sites': lockprof.app_delta(before, self._scrape(o))}) + '\n')
+
+    @staticmethod
+    def _read(path: str) -> list[dict]:
+        try:
+            with open(path) as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except OSError as exc:
+            raise CommandError(str(exc))
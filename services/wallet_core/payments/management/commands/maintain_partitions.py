@@ -0,0 +1,15 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from payments.partitions import maintain
+
+
+class Command(BaseCommand):
+    help = "Create upcoming monthly partitions and detach expired ones (LedgerEntry, WithdrawalRequest, ApiRequestLog)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=None, help="Months to pre-create (default PARTITION_MONTHS_AHEAD).")
+
+    def handle(self, *args, **options):
+        self.stdout.write(json.dumps(maintain(months_ahead=options['ahead'])))
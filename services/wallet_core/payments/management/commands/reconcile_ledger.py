@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from payments.reconciliation import reconcile, summary
+
+
+class Command(BaseCommand):
+    help = "Reconcile MerchantCredit/CreditPool against LedgerEntry (incremental from the last run unless --full)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rescan the whole ledger instead of new entries only.")
+        parser.add_argument('--chunk-size', type=int, default=None, help="Rows per fetch (default RECON_CHUNK_SIZE).")
+        parser.add_argument('--output', help="Write the discrepancy report as JSON to this file.")
+
+    def handle(self, *args, **options):
+        run = reconcile(full=options['full'], chunk_size=options['chunk_size'])
+        report = {**summary(run), 'discrepancies': run.discrepancies}
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        self.stdout.write(json.dumps(summary(run)))
+        if run.discrepancy_count:
+            raise CommandError(f"{run.discrepancy_count} discrepancies (run {run.id})")
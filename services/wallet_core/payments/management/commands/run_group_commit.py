@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from payments.group_commit import serve_group_commit
+
+
+class Command(BaseCommand):
+    help = "Apply credit consumption requests queued in Redis by CREDIT_ENGINE=group workers (GROUP_COMMIT_TRANSPORT=redis)."
+
+    def handle(self, *args, **options):
+        self.stdout.write("group-commit server started")
+        try:
+            serve_group_commit()
+        except KeyboardInterrupt:
+            pass
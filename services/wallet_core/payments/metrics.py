@@ -0,0 +1,213 @@
+"""
+Hot-path instrumentation, exported in Prometheus format on /metrics
+(METRICS_ENABLED).
+
+`phase(name)` times a block into wallet_phase_seconds{phase}; `timed(name)`
+does the same for a whole function. When metrics are disabled, `phase()`
+returns a shared no-op context manager, so an instrumented block costs one
+settings attribute read.
+
+MetricsMiddleware records, per request: its duration, the number and total
+time of DB queries (through `connection.execute_wrapper`), and the number of
+Redis calls. Redis calls are counted by the shared client in `utils.cache`,
+which also feeds wallet_redis_calls_total{command} in every process,
+Celery workers included. A pipeline counts as one call.
+
+Settlement service calls are timed by `settlement_client` into
+wallet_settlement_call_seconds{outcome}.
+
+Multiprocess mode: with PROMETHEUS_MULTIPROC_DIR set (before the process
+starts), each gunicorn or Celery worker process writes its samples to its
+own files in that directory. /metrics then merges every file found in
+METRICS_COLLECT_DIRS (default: PROMETHEUS_MULTIPROC_DIR), so whichever worker
+answers the scrape reports totals for all of them. Point METRICS_COLLECT_DIRS
+at the per-container directories on a shared volume to include Celery workers
+that run in another container. Every directory must be emptied when its
+service starts. Without PROMETHEUS_MULTIPROC_DIR, each process reports only
+its own samples.
+"""
+
+from __future__ import annotations
+import contextlib
+import contextvars
+import functools
+import glob
+import os
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
+
+PHASE_SECONDS = Histogram(
+    'wallet_phase_seconds', 'Time spent in an instrumented hot-path phase', ['phase'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+REQUEST_SECONDS = Histogram(
+    'wallet_request_seconds', 'HTTP request duration until the view returns', ['route', 'method', 'status'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+REQUEST_DB_QUERIES = Histogram(
+    'wallet_request_db_queries', 'DB queries per HTTP request', ['route'],
+    buckets=(0, 1, 2, 4, 8, 16, 32, 64, 128))
+REQUEST_DB_SECONDS = Histogram(
+    'wallet_request_db_seconds', 'Total DB query time per HTTP request', ['route'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+REQUEST_REDIS_CALLS = Histogram(
+    'wallet_request_redis_calls', 'Redis calls per HTTP request', ['route'],
+    buckets=(0, 1, 2, 4, 8, 16, 32))
+REDIS_CALLS = Counter('wallet_redis_calls', 'Redis commands, script calls and pipelines sent', ['command'])
+SETTLEMENT_SECONDS = Histogram(
+    'wallet_settlement_call_seconds', 'Settlement service call duration', ['outcome'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10))
+
+_NOOP = contextlib.nullcontext()
+_phases: dict[str, object] = {}
+
+
+class _RequestScope:
+    __slots__ = ('queries', 'db_s', 'redis')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_s = 0.0
+        self.redis = 0
+
+
+_scope: contextvars.ContextVar[_RequestScope | None] = contextvars.ContextVar('metrics_request_scope', default=None)
+
+
+def enabled() -> bool:
+    return settings.METRICS_ENABLED
+
+
+class _Timer:
+    __slots__ = ('_hist', '_t0')
+
+    def __init__(self, hist):
+        self._hist = hist
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._hist.observe(time.perf_counter() - self._t0)
+        return False
+
+
+def phase(name: str):
+    """Context manager timing its block as `name`; a no-op when metrics are disabled."""
+    if not settings.METRICS_ENABLED:
+        return _NOOP
+    hist = _phases.get(name)
+    if hist is None:
+        hist = _phases.setdefault(name, PHASE_SECONDS.labels(name))
+    return _Timer(hist)
+
+
+def timed(name: str):
+    """Decorator form of `phase`."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not settings.METRICS_ENABLED:
+                return fn(*args, **kwargs)
+            with phase(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def settlement_call(outcome: str, seconds: float) -> None:
+    """Record one settlement call (called by `settlement_client`); outcome is '2xx'..'5xx', 'timeout' or 'error'."""
+    if not settings.METRICS_ENABLED:
+        return
+    SETTLEMENT_SECONDS.labels(outcome).observe(seconds)
+
+
+def redis_call(command) -> None:
+    """Count one Redis round trip (called by the shared client in utils.cache)."""
+    if not settings.METRICS_ENABLED:
+        return
+    REDIS_CALLS.labels(str(command).upper()).inc()
+    scope = _scope.get()
+    if scope is not None:
+        scope.redis += 1
+
+
+def _count_query(execute, sql, params, many, context):
+    scope = _scope.get()
+    if scope is None:
+        return execute(sql, params, many, context)
+    t0 = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        scope.queries += 1
+        scope.db_s += time.perf_counter() - t0
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        scope = _RequestScope()
+        token = _scope.set(scope)
+        t0 = time.perf_counter()
+        try:
+            with connection.execute_wrapper(_count_query):
+                response = self.get_response(request)
+        finally:
+            _scope.reset(token)
+        match = request.resolver_match
+        # The URL pattern, not the path, keeps label cardinality bounded
+        route = match.route if match is not None else 'unmatched'
+        REQUEST_SECONDS.labels(route, request.method, str(response.status_code)).observe(time.perf_counter() - t0)
+        REQUEST_DB_QUERIES.labels(route).observe(scope.queries)
+        REQUEST_DB_SECONDS.labels(route).observe(scope.db_s)
+        REQUEST_REDIS_CALLS.labels(route).observe(scope.redis)
+        return response
+
+
+class _DirsCollector:
+    """Merge the multiprocess files of several directories (one per container) into one set of series."""
+
+    def __init__(self, paths: list[str]):
+        self.paths = paths
+
+    def collect(self):
+        files = [f for path in self.paths for f in sorted(glob.glob(os.path.join(path, '*.db')))]
+        return MultiProcessCollector.merge(files, accumulate=True)
+
+
+def collect_dirs() -> list[str]:
+    own = os.environ.get('PROMETHEUS_MULTIPROC_DIR', '')
+    return [d for d in (settings.METRICS_COLLECT_DIRS or own).split(',') if d]
+
+
+def render() -> bytes:
+    """Current metrics in the Prometheus text format (all processes in multiprocess mode)."""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    registry.register(_DirsCollector(collect_dirs()))
+    return generate_latest(registry)
+
+
+def metrics_view(request):
+    if not settings.METRICS_ENABLED:
+        return HttpResponseNotFound()
+    if settings.METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {settings.METRICS_TOKEN}':
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type=CONTENT_TYPE_LATEST)
+
+
+def process_exited(pid: int) -> None:
+    """Drop a dead worker's live-gauge files (gunicorn child_exit, Celery worker_process_shutdown)."""
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        mark_process_dead(pid, path)
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:11
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_alter_idempotencyrecord_id_alter_merchant_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CreditHold',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('pool_stripe', models.IntegerField(default=1)),
+                ('status', models.CharField(choices=[('HELD', 'HELD'), ('CAPTURED', 'CAPTURED'), ('RELEASED', 'RELEASED')], default='HELD', max_length=8)),
+                ('tx_id', models.UUIDField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField()),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payments.walletaccount')),
+                ('merchant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payments.merchant')),
+                ('withdrawal', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='hold', to='payments.withdrawalrequest')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'expires_at'], name='hold_status_expiry')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_credit_hold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='withdrawalrequest',
+            name='reservation_id',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:19
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_withdrawal_reservation_id'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apirequestlog',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
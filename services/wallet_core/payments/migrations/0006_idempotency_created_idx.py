@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_request_log_created_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='idempotencyrecord',
+            index=models.Index(fields=['created_at'], name='idem_created_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0006_idempotency_created_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='merchant',
+            name='rate_tier',
+            field=models.CharField(default='standard', max_length=16),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0007_merchant_rate_tier'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('full', models.BooleanField(default=False)),
+                ('cursor_created_at', models.DateTimeField(blank=True, null=True)),
+                ('cursor_id', models.UUIDField(blank=True, null=True)),
+                ('entries_scanned', models.BigIntegerField(default=0)),
+                ('merchant_totals', models.JSONField(default=dict)),
+                ('open_entries', models.JSONField(default=list)),
+                ('pool_funding_minor', models.BigIntegerField(default=0)),
+                ('discrepancy_count', models.IntegerField(default=0)),
+                ('discrepancies', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['created_at', 'id'], name='ledger_created_id_idx'),
+        ),
+    ]
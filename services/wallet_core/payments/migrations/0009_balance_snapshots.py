@@ -0,0 +1,54 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0008_ledger_reconciliation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('through', models.DateTimeField(unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('pool_consumed_minor', models.BigIntegerField(default=0)),
+                ('merchants_written', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BalanceSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('through', models.DateTimeField()),
+                ('utilized_minor', models.BigIntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['merchant', 'created_at'], name='ledger_merchant_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='balancesnapshot',
+            name='checkpoint',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='payments.balancecheckpoint'),
+        ),
+        migrations.AddField(
+            model_name='balancesnapshot',
+            name='merchant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='payments.merchant'),
+        ),
+        migrations.AddIndex(
+            model_name='balancesnapshot',
+            index=models.Index(fields=['merchant', 'through'], name='snap_merchant_through_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancesnapshot',
+            constraint=models.UniqueConstraint(fields=('checkpoint', 'merchant'), name='snap_checkpoint_merchant_uniq'),
+        ),
+    ]
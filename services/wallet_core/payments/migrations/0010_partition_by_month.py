@@ -0,0 +1,174 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:36
+
+from datetime import date, datetime, timezone as dt_timezone
+
+import django.contrib.postgres.indexes
+import django.db.models.deletion
+import payments.utils.ids
+from django.conf import settings
+from django.db import migrations, models
+
+TABLES = ('payments_ledgerentry', 'payments_withdrawalrequest', 'payments_apirequestlog')
+
+# The DDL below is frozen here on purpose: later edits to payments.partitions must not change this migration
+
+
+def _month_start(d: date | datetime) -> date:
+    return date(d.year, d.month, 1)
+
+
+def _add_months(d: date, n: int) -> date:
+    y, m = divmod(d.month - 1 + n, 12)
+    return date(d.year + y, m + 1, 1)
+
+
+def _bound(month: date) -> str:
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc).isoformat()
+
+
+def is_partitioned(cur, table: str) -> bool:
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cur.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def create_partition(cur, table: str, month: date) -> None:
+    cur.execute(
+        f'CREATE TABLE IF NOT EXISTS "{table}_p{month:%Y_%m}" PARTITION OF "{table}"'
+        f" FOR VALUES FROM ('{_bound(month)}') TO ('{_bound(_add_months(month, 1))}')")
+
+
+def _constraints(cur, table: str, kinds: str) -> list[tuple[str, str]]:
+    cur.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint"
+        " WHERE conrelid = to_regclass(%s) AND contype = ANY(%s) ORDER BY conname", [table, list(kinds)])
+    return cur.fetchall()
+
+
+def _indexes(cur, table: str) -> list[tuple[str, str]]:
+    cur.execute(
+        "SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid"
+        " WHERE x.indrelid = to_regclass(%s) AND NOT x.indisprimary ORDER BY i.relname", [table])
+    return cur.fetchall()
+
+
+def _triggers(cur, table: str) -> list[str]:
+    # Own row triggers only; partitions carry internal clones of the parent's
+    cur.execute(
+        "SELECT pg_get_triggerdef(oid) FROM pg_trigger"
+        " WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal AND tgparentid = 0 ORDER BY tgname", [table])
+    return [ddl for (ddl,) in cur.fetchall()]
+
+
+def _rebuild(cur, table: str, partition_by: str | None, pk: str, months: list[date]) -> None:
+    """Recreate `table` (optionally partitioned) with the same columns, indexes, FKs and triggers, copying the rows."""
+    legacy = f"{table}_legacy"
+    indexes = _indexes(cur, table)
+    triggers = _triggers(cur, table)
+    fks = _constraints(cur, table, 'f')
+    (pk_name, _), = _constraints(cur, table, 'p')
+    cur.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy}"')
+    for name, _ in indexes:
+        cur.execute(f'DROP INDEX "{name}"')
+    for name, _ in fks:
+        cur.execute(f'ALTER TABLE "{legacy}" DROP CONSTRAINT "{name}"')
+    cur.execute(f'ALTER TABLE "{legacy}" DROP CONSTRAINT "{pk_name}"')
+    cur.execute(
+        f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS INCLUDING CONSTRAINTS INCLUDING STORAGE)'
+        + (f" PARTITION BY {partition_by}" if partition_by else ""))
+    cur.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{pk_name}" PRIMARY KEY ({pk})')
+    for month in months:
+        create_partition(cur, table, month)
+    cur.execute(f'INSERT INTO "{table}" SELECT * FROM "{legacy}"')
+    cur.execute(f'DROP TABLE "{legacy}"')
+    for _, ddl in indexes:
+        cur.execute(ddl)
+    for name, ddl in fks:
+        cur.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" {ddl}')
+    for ddl in triggers:
+        cur.execute(ddl)
+
+
+def partition_table(cur, table: str, months_ahead: int) -> None:
+    """Convert a plain table into monthly partitions covering its rows through `months_ahead` months from now."""
+    if is_partitioned(cur, table):
+        return
+    cur.execute(f'SELECT min(created_at) FROM "{table}"')
+    oldest = cur.fetchone()[0]
+    current = _month_start(datetime.now(dt_timezone.utc))
+    # The previous month too, for rows stamped just before a month boundary
+    first = min(_month_start(oldest), _add_months(current, -1)) if oldest else _add_months(current, -1)
+    last = _add_months(current, months_ahead)
+    months = [first]
+    while months[-1] < last:
+        months.append(_add_months(months[-1], 1))
+    _rebuild(cur, table, 'RANGE (created_at)', 'id, created_at', months)
+
+
+def unpartition_table(cur, table: str) -> None:
+    if is_partitioned(cur, table):
+        _rebuild(cur, table, None, 'id', [])
+
+
+def partition(apps, schema_editor):
+    # Copies the rows in this migration's transaction; schedule large tables for a quiet window
+    with schema_editor.connection.cursor() as cur:
+        for table in TABLES:
+            partition_table(cur, table, getattr(settings, 'PARTITION_MONTHS_AHEAD', 3))
+
+
+def unpartition(apps, schema_editor):
+    with schema_editor.connection.cursor() as cur:
+        for table in TABLES:
+            unpartition_table(cur, table)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0009_balance_snapshots'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='apirequestlog',
+            name='id',
+            field=models.UUIDField(default=payments.utils.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='credithold',
+            name='withdrawal',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='hold', to='payments.withdrawalrequest'),
+        ),
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='id',
+            field=models.UUIDField(default=payments.utils.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='withdrawalrequest',
+            name='id',
+            field=models.UUIDField(default=payments.utils.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AddIndex(
+            model_name='apirequestlog',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created_at'], name='reqlog_created_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='apirequestlog',
+            index=models.Index(fields=['actor', 'created_at'], name='reqlog_actor_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created_at'], name='ledger_created_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawalrequest',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created_at'], name='wr_created_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawalrequest',
+            index=models.Index(fields=['merchant', 'created_at'], name='wr_merchant_created_idx'),
+        ),
+        migrations.RunPython(partition, unpartition),
+    ]
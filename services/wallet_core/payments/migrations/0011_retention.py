@@ -0,0 +1,30 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0010_partition_by_month'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('policy', models.CharField(max_length=40, unique=True)),
+                ('cutoff', models.DateTimeField(blank=True, null=True)),
+                ('last_ts', models.DateTimeField(blank=True, null=True)),
+                ('last_pk', models.CharField(blank=True, default='', max_length=64)),
+                ('rows_done', models.BigIntegerField(default=0)),
+                ('last_finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='apirequestlog',
+            index=models.Index(fields=['created_at', 'id'], name='reqlog_created_id_idx'),
+        ),
+    ]
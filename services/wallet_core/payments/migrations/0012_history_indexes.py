@@ -0,0 +1,29 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0011_retention'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ledgerentry',
+            name='ledger_merchant_created_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='withdrawalrequest',
+            name='wr_merchant_created_idx',
+        ),
+        migrations.AddIndex(
+            model_name='ledgerentry',
+            index=models.Index(fields=['merchant', 'created_at', 'id'], name='ledger_merchant_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawalrequest',
+            index=models.Index(fields=['merchant', 'created_at', 'id'], name='wr_merchant_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0012_history_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='withdrawalrequest',
+            index=models.Index(fields=['created_at', 'id'], name='wr_created_id_idx'),
+        ),
+    ]
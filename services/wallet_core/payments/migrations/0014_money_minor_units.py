@@ -0,0 +1,104 @@
+# Generated by Django 5.0.7 on 2026-10-18 16:48
+
+from django.db import migrations, models
+
+# Nullable columns, so adding them rewrites nothing; `backfill_minor_units` fills existing rows
+# Trigger SQL is spelled out rather than generated from payments.money, so later code changes cannot alter it
+TRIGGERS = [
+    (
+        """
+CREATE OR REPLACE FUNCTION payments_merchantcredit_minor_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    IF NEW.credit_limit_minor IS NULL THEN NEW.credit_limit_minor := round(NEW.credit_limit * 100); ELSE NEW.credit_limit := NEW.credit_limit_minor::numeric / 100; END IF;
+    IF NEW.utilized_amount_minor IS NULL THEN NEW.utilized_amount_minor := round(NEW.utilized_amount * 100); ELSE NEW.utilized_amount := NEW.utilized_amount_minor::numeric / 100; END IF;
+  ELSE
+    IF NEW.credit_limit_minor IS DISTINCT FROM OLD.credit_limit_minor AND NEW.credit_limit_minor IS NOT NULL THEN NEW.credit_limit := NEW.credit_limit_minor::numeric / 100; ELSIF NEW.credit_limit IS DISTINCT FROM OLD.credit_limit OR NEW.credit_limit_minor IS NULL THEN NEW.credit_limit_minor := round(NEW.credit_limit * 100); END IF;
+    IF NEW.utilized_amount_minor IS DISTINCT FROM OLD.utilized_amount_minor AND NEW.utilized_amount_minor IS NOT NULL THEN NEW.utilized_amount := NEW.utilized_amount_minor::numeric / 100; ELSIF NEW.utilized_amount IS DISTINCT FROM OLD.utilized_amount OR NEW.utilized_amount_minor IS NULL THEN NEW.utilized_amount_minor := round(NEW.utilized_amount * 100); END IF;
+  END IF;
+  RETURN NEW;
+END $$;
+CREATE TRIGGER payments_merchantcredit_minor_sync BEFORE INSERT OR UPDATE ON "payments_merchantcredit" FOR EACH ROW EXECUTE FUNCTION payments_merchantcredit_minor_sync();
+""",
+        'DROP TRIGGER IF EXISTS payments_merchantcredit_minor_sync ON "payments_merchantcredit"; DROP FUNCTION IF EXISTS payments_merchantcredit_minor_sync();',
+    ),
+    (
+        """
+CREATE OR REPLACE FUNCTION payments_creditpool_minor_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    IF NEW.available_amount_minor IS NULL THEN NEW.available_amount_minor := round(NEW.available_amount * 100); ELSE NEW.available_amount := NEW.available_amount_minor::numeric / 100; END IF;
+  ELSE
+    IF NEW.available_amount_minor IS DISTINCT FROM OLD.available_amount_minor AND NEW.available_amount_minor IS NOT NULL THEN NEW.available_amount := NEW.available_amount_minor::numeric / 100; ELSIF NEW.available_amount IS DISTINCT FROM OLD.available_amount OR NEW.available_amount_minor IS NULL THEN NEW.available_amount_minor := round(NEW.available_amount * 100); END IF;
+  END IF;
+  RETURN NEW;
+END $$;
+CREATE TRIGGER payments_creditpool_minor_sync BEFORE INSERT OR UPDATE ON "payments_creditpool" FOR EACH ROW EXECUTE FUNCTION payments_creditpool_minor_sync();
+""",
+        'DROP TRIGGER IF EXISTS payments_creditpool_minor_sync ON "payments_creditpool"; DROP FUNCTION IF EXISTS payments_creditpool_minor_sync();',
+    ),
+    (
+        """
+CREATE OR REPLACE FUNCTION payments_ledgerentry_minor_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    IF NEW.amount_minor IS NULL THEN NEW.amount_minor := round(NEW.amount * 100); ELSE NEW.amount := NEW.amount_minor::numeric / 100; END IF;
+  ELSE
+    IF NEW.amount_minor IS DISTINCT FROM OLD.amount_minor AND NEW.amount_minor IS NOT NULL THEN NEW.amount := NEW.amount_minor::numeric / 100; ELSIF NEW.amount IS DISTINCT FROM OLD.amount OR NEW.amount_minor IS NULL THEN NEW.amount_minor := round(NEW.amount * 100); END IF;
+  END IF;
+  RETURN NEW;
+END $$;
+CREATE TRIGGER payments_ledgerentry_minor_sync BEFORE INSERT OR UPDATE ON "payments_ledgerentry" FOR EACH ROW EXECUTE FUNCTION payments_ledgerentry_minor_sync();
+""",
+        'DROP TRIGGER IF EXISTS payments_ledgerentry_minor_sync ON "payments_ledgerentry"; DROP FUNCTION IF EXISTS payments_ledgerentry_minor_sync();',
+    ),
+    (
+        """
+CREATE OR REPLACE FUNCTION payments_withdrawalrequest_minor_sync() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    IF NEW.amount_minor IS NULL THEN NEW.amount_minor := round(NEW.amount * 100); ELSE NEW.amount := NEW.amount_minor::numeric / 100; END IF;
+  ELSE
+    IF NEW.amount_minor IS DISTINCT FROM OLD.amount_minor AND NEW.amount_minor IS NOT NULL THEN NEW.amount := NEW.amount_minor::numeric / 100; ELSIF NEW.amount IS DISTINCT FROM OLD.amount OR NEW.amount_minor IS NULL THEN NEW.amount_minor := round(NEW.amount * 100); END IF;
+  END IF;
+  RETURN NEW;
+END $$;
+CREATE TRIGGER payments_withdrawalrequest_minor_sync BEFORE INSERT OR UPDATE ON "payments_withdrawalrequest" FOR EACH ROW EXECUTE FUNCTION payments_withdrawalrequest_minor_sync();
+""",
+        'DROP TRIGGER IF EXISTS payments_withdrawalrequest_minor_sync ON "payments_withdrawalrequest"; DROP FUNCTION IF EXISTS payments_withdrawalrequest_minor_sync();',
+    ),
+]
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0013_export_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='creditpool',
+            name='available_amount_minor',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='ledgerentry',
+            name='amount_minor',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='merchantcredit',
+            name='credit_limit_minor',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='merchantcredit',
+            name='utilized_amount_minor',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='withdrawalrequest',
+            name='amount_minor',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ] + [migrations.RunSQL(create, drop) for create, drop in TRIGGERS]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.7 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0014_money_minor_units'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='withdrawalrequest',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawalrequest',
+            index=models.Index(condition=models.Q(('status__in', ['QUEUED', 'SETTLING'])), fields=['created_at'], name='wr_open_created_idx'),
+        ),
+    ]
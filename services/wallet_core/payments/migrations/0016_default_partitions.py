@@ -0,0 +1,23 @@
+from django.db import migrations
+
+TABLES = ('payments_ledgerentry', 'payments_withdrawalrequest', 'payments_apirequestlog')
+
+
+def _sql(table: str) -> tuple[str, str]:
+    default = f'{table}_pdefault'
+    create = f'CREATE TABLE IF NOT EXISTS "{default}" PARTITION OF "{table}" DEFAULT'
+    # Rows parked in the default partition go back to the parent; this fails, rather than drops them, if no month covers them
+    drop = (f'ALTER TABLE "{table}" DETACH PARTITION "{default}";'
+            f' INSERT INTO "{table}" SELECT * FROM "{default}";'
+            f' DROP TABLE "{default}"')
+    return create, drop
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0015_withdrawal_claims'),
+    ]
+
+    # Inserts outside every monthly partition land here instead of failing (payments.partitions)
+    operations = [migrations.RunSQL(*_sql(table)) for table in TABLES]
@@ -1,21 +1,44 @@
 from __future__ import annotations
 from django.db import models, transaction
+from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from decimal import Decimal, ROUND_HALF_UP
 import uuid
-from django.db.models import Q, F
-from decimal import Decimal
+from django.db.models import Q, F, Sum
+from django.contrib.postgres.indexes import BrinIndex
+from .utils.ids import uuid7
+from . import lockprof, metrics, money
+from .money import minor_of
 
 def q(x) -> Decimal:
     d = x if isinstance(x, Decimal) else Decimal(str(x))
     return d.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
+def profile_changed(*merchant_ids) -> None:
+    """Invalidate cached /me profiles of these merchants once the current transaction commits."""
+    from . import profile_cache
+    ids = [mid for mid in merchant_ids if mid is not None]
+    if ids:
+        transaction.on_commit(lambda: profile_cache.bump(ids))
+
+def pool_stripes() -> int:
+    """Number of CreditPool sub-pool rows (CREDIT_POOL_STRIPES, 1 = single row)."""
+    return max(1, int(getattr(settings, 'CREDIT_POOL_STRIPES', 1)))
+
+def pool_stripe_for(merchant_id: int, stripes: int | None = None) -> int:
+    """Home stripe id (1..N) for a merchant."""
+    stripes = stripes or pool_stripes()
+    return (int(merchant_id) % stripes) + 1
+
 class Merchant(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='merchant')
     is_approved = models.BooleanField(default=False)
     requested_credit = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
     bank_account = models.CharField(max_length=64, blank=True, default='')
+    # Key into settings.RATE_LIMIT_TIERS
+    rate_tier = models.CharField(max_length=16, default='standard')
 
 class WalletAccount(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -25,13 +48,60 @@ class WalletAccount(models.Model):
 class CreditPool(models.Model):
     id = models.IntegerField(primary_key=True, default=1, editable=False)
     available_amount = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    # Cents mirror of available_amount, kept equal by a trigger (payments.money)
+    available_amount_minor = models.BigIntegerField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     @classmethod
     def get_solo(cls) -> "CreditPool":
-        obj, _ = cls.objects.get_or_create(id=1, defaults={'available_amount': Decimal('0.00')})
+        """
+        Return the global pool. With CREDIT_POOL_STRIPES > 1 the pool is split
+        into rows 1..N and this returns an unsaved aggregate view; write through
+        `topup()` / `rebalance_credit_pool()` instead of saving it.
+        """
+        stripes = pool_stripes()
+        if stripes == 1:
+            obj, _ = cls.objects.get_or_create(id=1, defaults={'available_amount': Decimal('0.00')})
+            return obj
+        cls.ensure_stripes(stripes)
+        obj = cls(id=1, available_amount=cls.total_available())
+        obj.is_aggregate = True
         return obj
 
+    @classmethod
+    def ensure_stripes(cls, stripes: int) -> None:
+        cls.objects.bulk_create(
+            [cls(id=i, available_amount=Decimal('0.00')) for i in range(1, stripes + 1)],
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def total_available(cls) -> Decimal:
+        return q(cls.objects.aggregate(total=Sum('available_amount'))['total'] or 0)
+
+    @classmethod
+    def topup(cls, amount: Decimal) -> Decimal:
+        """Add funds to the pool, spread evenly over the stripes. Returns the new total."""
+        amount = q(amount)
+        stripes = pool_stripes()
+        if stripes == 1:
+            cls.get_solo()
+        else:
+            cls.ensure_stripes(stripes)
+        with transaction.atomic():
+            with lockprof.acquire('creditpool.topup'):
+                rows = list(cls.objects.select_for_update().filter(id__lte=stripes).order_by('id'))
+            shares = _split_cents(amount, len(rows))
+            for row, share in zip(rows, shares):
+                row.available_amount = q(row.available_amount) + share
+                row.save(update_fields=['available_amount', 'updated_at'])
+            return cls.total_available()
+
+    def save(self, *args, **kwargs):
+        if getattr(self, 'is_aggregate', False):
+            raise ValueError('AGGREGATE_POOL_READ_ONLY')
+        super().save(*args, **kwargs)
+
     class Meta:
             constraints = [
                 models.CheckConstraint(
@@ -44,6 +114,9 @@ class MerchantCredit(models.Model):
     merchant = models.OneToOneField(Merchant, on_delete=models.CASCADE, related_name='credit')
     credit_limit = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
     utilized_amount = models.DecimalField(max_digits=18, decimal_places=2, default=Decimal('0.00'))
+    # Cents mirrors of the decimal columns, kept equal by a trigger (payments.money)
+    credit_limit_minor = models.BigIntegerField(null=True, blank=True)
+    utilized_amount_minor = models.BigIntegerField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
     class Meta:
             constraints = [
@@ -61,62 +134,327 @@ class MerchantCredit(models.Model):
     def available(self) -> Decimal:
         return q(self.credit_limit) - q(self.utilized_amount)
 
+    @property
+    def available_minor(self) -> int:
+        return minor_of(self, 'credit_limit') - minor_of(self, 'utilized_amount')
+
 class IdempotencyRecord(models.Model):
     key = models.CharField(max_length=80, unique=True)
     request_hash = models.CharField(max_length=64)
     response_json = models.JSONField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Purge job scans by age (payments.idempotency.purge_expired)
+        indexes = [models.Index(fields=['created_at'], name='idem_created_idx')]
+
 class ApiRequestLog(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Partitioned by month on created_at (payments.partitions); primary key is (id, created_at)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     path = models.CharField(max_length=200)
     method = models.CharField(max_length=10)
     status = models.IntegerField()
     actor = models.CharField(max_length=80, blank=True, default='')
     payload = models.JSONField(default=dict)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Set when the request is logged, not when the buffered writer flushes it
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            BrinIndex(fields=['created_at'], name='reqlog_created_brin'),
+            models.Index(fields=['actor', 'created_at'], name='reqlog_actor_created_idx'),
+            # Retention walks expired rows in (created_at, id) order
+            models.Index(fields=['created_at', 'id'], name='reqlog_created_id_idx'),
+        ]
+
+class RetentionCheckpoint(models.Model):
+    """Progress of the current pass of one payments.retention policy."""
+    policy = models.CharField(max_length=40, unique=True)
+    # Fixed for the whole pass so a resumed pass still ends
+    cutoff = models.DateTimeField(null=True, blank=True)
+    last_ts = models.DateTimeField(null=True, blank=True)
+    last_pk = models.CharField(max_length=64, blank=True, default='')
+    rows_done = models.BigIntegerField(default=0)
+    last_finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
 class WithdrawalRequest(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Partitioned by month on created_at (payments.partitions); primary key is (id, created_at)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE)
     account = models.ForeignKey(WalletAccount, on_delete=models.CASCADE)
     amount = models.DecimalField(max_digits=18, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
-    status = models.CharField(max_length=12, default='PENDING')  # PENDING, SUCCESS, FAILED
+    amount_minor = models.BigIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=12, default='PENDING')  # PENDING, QUEUED, SETTLING, SUCCESS, FAILED, REVIEW
     bank_reference = models.CharField(max_length=64, blank=True, default='')
+    # Redis credit front reservation, kept for the dispatcher (or a re-dispatch) to commit/release
+    reservation_id = models.CharField(max_length=32, blank=True, default='')
+    # When the row was claimed SETTLING; stale claims are requeued (payments.batch_dispatch.reap_stale_claims)
+    claimed_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            BrinIndex(fields=['created_at'], name='wr_created_brin'),
+            # The batcher and the reaper only look at open rows, a sliver of every partition
+            models.Index(fields=['created_at'], name='wr_open_created_idx',
+                         condition=models.Q(status__in=['QUEUED', 'SETTLING'])),
+            # Exports walk all merchants in (created_at, id) order (payments.export)
+            models.Index(fields=['created_at', 'id'], name='wr_created_id_idx'),
+            # Merchant history pages (payments.history): keyset on (created_at, id) per merchant
+            models.Index(fields=['merchant', 'created_at', 'id'], name='wr_merchant_created_id_idx'),
+        ]
+
 class LedgerEntry(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # Partitioned by month on created_at (payments.partitions); primary key is (id, created_at)
+    id = models.UUIDField(primary_key=True, default=uuid7, editable=False)
     tx_id = models.UUIDField(default=uuid.uuid4, editable=False)
     merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE)
     account = models.ForeignKey(WalletAccount, on_delete=models.CASCADE)
     direction = models.CharField(max_length=6, choices=[('DEBIT','DEBIT'),('CREDIT','CREDIT')])
     source = models.CharField(max_length=24, choices=[('CREDIT_POOL','CREDIT_POOL'),('MERCHANT_CREDIT','MERCHANT_CREDIT')])
     amount = models.DecimalField(max_digits=18, decimal_places=2)
+    amount_minor = models.BigIntegerField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Reconciliation scans forward from a (created_at, id) checkpoint
+            models.Index(fields=['created_at', 'id'], name='ledger_created_id_idx'),
+            # Point-in-time balance deltas and keyset history pages (payments.history) per merchant
+            models.Index(fields=['merchant', 'created_at', 'id'], name='ledger_merchant_created_id_idx'),
+            BrinIndex(fields=['created_at'], name='ledger_created_brin'),
+        ]
 
-def atomic_consume_credit(merchant: Merchant, account: WalletAccount, amount: Decimal):
-    amount = q(amount)
-    pool = CreditPool.get_solo()
+
+class BalanceCheckpoint(models.Model):
+    """Ledger totals through `through` (payments.balances); pool total on the checkpoint itself."""
+    through = models.DateTimeField(unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Cumulative DEBIT/CREDIT_POOL entries up to `through`, in minor units
+    pool_consumed_minor = models.BigIntegerField(default=0)
+    merchants_written = models.IntegerField(default=0)
+
+
+class BalanceSnapshot(models.Model):
+    """
+    A merchant's cumulative CREDIT/MERCHANT_CREDIT total at a checkpoint. Written
+    only when it changed since the previous checkpoint, so the merchant's latest
+    snapshot at or before a time is its total at that checkpoint.
+    """
+    checkpoint = models.ForeignKey(BalanceCheckpoint, on_delete=models.CASCADE, related_name='snapshots')
+    merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE)
+    through = models.DateTimeField()
+    utilized_minor = models.BigIntegerField()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['checkpoint', 'merchant'], name='snap_checkpoint_merchant_uniq')]
+        indexes = [models.Index(fields=['merchant', 'through'], name='snap_merchant_through_idx')]
+
+
+class ReconciliationRun(models.Model):
+    """Checkpoint and discrepancy report of one payments.reconciliation run."""
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    full = models.BooleanField(default=False)
+    # Last LedgerEntry scanned; the next incremental run starts after it
+    cursor_created_at = models.DateTimeField(null=True, blank=True)
+    cursor_id = models.UUIDField(null=True, blank=True)
+    entries_scanned = models.BigIntegerField(default=0)
+    # Cumulative {merchant_id: [pool_debit_minor, merchant_credit_minor]} up to the cursor
+    merchant_totals = models.JSONField(default=dict)
+    # Entries whose tx pair continues past the cursor: [tx_id, merchant_id, is_debit, is_pool, minor]
+    open_entries = models.JSONField(default=list)
+    pool_funding_minor = models.BigIntegerField(default=0)
+    discrepancy_count = models.IntegerField(default=0)
+    discrepancies = models.JSONField(default=list)
+
+
+class CreditHold(models.Model):
+    """
+    Credit taken for a withdrawal before the settlement call. HELD balances are
+    already debited from MerchantCredit/CreditPool; capture writes the ledger
+    pair, release gives the amount back.
+    """
+    STATUS_CHOICES = [('HELD','HELD'),('CAPTURED','CAPTURED'),('RELEASED','RELEASED')]
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    # No database FK: the partitioned withdrawal table has no unique key on id alone
+    withdrawal = models.OneToOneField(WithdrawalRequest, on_delete=models.CASCADE, related_name='hold', db_constraint=False)
+    merchant = models.ForeignKey(Merchant, on_delete=models.CASCADE)
+    account = models.ForeignKey(WalletAccount, on_delete=models.CASCADE)
+    amount = models.DecimalField(max_digits=18, decimal_places=2)
+    pool_stripe = models.IntegerField(default=1)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default='HELD')
+    tx_id = models.UUIDField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'expires_at'], name='hold_status_expiry')]
+
+
+def _split_cents(amount: Decimal, parts: int) -> list[Decimal]:
+    """Split `amount` into `parts` cent-exact shares (remainder goes to the first shares)."""
+    cents = int(q(amount) * 100)
+    base, rem = divmod(cents, parts)
+    return [q(Decimal(base + (1 if i < rem else 0)) / 100) for i in range(parts)]
+
+
+def rebalance_credit_pool(prefer: int | None = None, need: Decimal = Decimal('0.00')) -> Decimal:
+    """
+    Redistribute pool funds evenly across stripes 1..N (draining any stripe
+    above N left over from a larger configuration). If `prefer` is given it
+    receives at least `need` when the total allows. Locks every stripe in id
+    order, so it is only used off the hot path when a stripe runs dry.
+    """
+    stripes = pool_stripes()
+    CreditPool.ensure_stripes(stripes)
     with transaction.atomic():
-        pool = CreditPool.objects.select_for_update().get(id=1)
-        mc = MerchantCredit.objects.select_for_update().get(merchant=merchant)
-        if mc.available < amount:
-            raise ValueError('INSUFFICIENT_MERCHANT_CREDIT')
-        if pool.available_amount < amount:
-            raise ValueError('INSUFFICIENT_POOL')
+        with lockprof.acquire('creditpool.rebalance'):
+            rows = list(CreditPool.objects.select_for_update().order_by('id'))
+        total = q(sum((r.available_amount for r in rows), Decimal('0.00')))
+        active = [r for r in rows if r.id <= stripes]
+        targets = dict(zip((r.id for r in active), _split_cents(total, len(active))))
+        need = q(need)
+        if prefer in targets and targets[prefer] < need <= total:
+            others = [r.id for r in active if r.id != prefer]
+            targets[prefer] = need
+            targets.update(zip(others, _split_cents(total - need, len(others))))
+        for r in rows:
+            target = targets.get(r.id, Decimal('0.00'))
+            if q(r.available_amount) != target:
+                r.available_amount = target
+                r.save(update_fields=['available_amount', 'updated_at'])
+        return total
+
+
+class _StripeExhausted(Exception):
+    """No single stripe can cover the amount although the pool total can."""
+
+
+def _write_ledger_pair(merchant: Merchant, account: WalletAccount, amount: Decimal) -> uuid.UUID:
+    tx_id = uuid.uuid4()
+    cents = money.to_minor(amount) if money.enabled() else None
+    LedgerEntry.objects.create(
+        tx_id=tx_id, merchant=merchant, account=account,
+        direction='DEBIT', source='CREDIT_POOL', amount=amount, amount_minor=cents
+    )
+    LedgerEntry.objects.create(
+        tx_id=tx_id, merchant=merchant, account=account,
+        direction='CREDIT', source='MERCHANT_CREDIT', amount=amount, amount_minor=cents
+    )
+    return tx_id
+
+
+def _merchant_short(mc: MerchantCredit, amount: Decimal, cents: int | None) -> bool:
+    return mc.available < amount if cents is None else mc.available_minor < cents
+
+
+def _move_credit(mc: MerchantCredit, pool: CreditPool, amount: Decimal, cents: int | None) -> None:
+    """Add `amount` to the merchant's utilization, take it from the pool row and save both (negative gives it back)."""
+    if cents is None:
         mc.utilized_amount = q(mc.utilized_amount) + amount
         pool.available_amount = q(pool.available_amount) - amount
-        mc.save(update_fields=['utilized_amount','updated_at'])
-        pool.save(update_fields=['available_amount','updated_at'])
-        tx_id = uuid.uuid4()
-        LedgerEntry.objects.create(
-            tx_id=tx_id, merchant=merchant, account=account,
-            direction='DEBIT', source='CREDIT_POOL', amount=amount
-        )
-        LedgerEntry.objects.create(
-            tx_id=tx_id, merchant=merchant, account=account,
-            direction='CREDIT', source='MERCHANT_CREDIT', amount=amount
-        )
-        return tx_id
+        mc_field, pool_field = 'utilized_amount', 'available_amount'
+    else:
+        mc.utilized_amount_minor = minor_of(mc, 'utilized_amount') + cents
+        pool.available_amount_minor = minor_of(pool, 'available_amount') - cents
+        mc_field, pool_field = 'utilized_amount_minor', 'available_amount_minor'
+    mc.save(update_fields=[mc_field, 'updated_at'])
+    pool.save(update_fields=[pool_field, 'updated_at'])
+
+
+def _debit_striped(merchant: Merchant, amount: Decimal, stripes: int, cents: int | None = None) -> int:
+    """
+    Striped variant: lock the merchant row, then its home stripe; if that one is
+    short, grab any other stripe that can cover the amount without waiting on
+    it (SKIP LOCKED keeps lock ordering deadlock-free). Returns the stripe id.
+    """
+    home = pool_stripe_for(merchant.id, stripes)
+    with lockprof.acquire('merchantcredit.debit'):
+        mc = MerchantCredit.objects.select_for_update().get(merchant=merchant)
+    if _merchant_short(mc, amount, cents):
+        raise ValueError('INSUFFICIENT_MERCHANT_CREDIT')
+    with lockprof.acquire('creditpool.debit'):
+        stripe = CreditPool.objects.select_for_update().filter(id=home, available_amount__gte=amount).first()
+    if stripe is None:
+        with lockprof.acquire('creditpool.debit_spill'):
+            stripe = (CreditPool.objects.select_for_update(skip_locked=True)
+                      .filter(available_amount__gte=amount).exclude(id=home)
+                      .order_by('-available_amount').first())
+    if stripe is None:
+        if CreditPool.total_available() >= amount:
+            raise _StripeExhausted(home)
+        raise ValueError('INSUFFICIENT_POOL')
+    _move_credit(mc, stripe, amount, cents)
+    return stripe.id
+
+
+def _debit_single(merchant: Merchant, amount: Decimal, cents: int | None = None) -> int:
+    with lockprof.acquire('creditpool.debit'):
+        pool = CreditPool.objects.select_for_update().get(id=1)
+    with lockprof.acquire('merchantcredit.debit'):
+        mc = MerchantCredit.objects.select_for_update().get(merchant=merchant)
+    if _merchant_short(mc, amount, cents):
+        raise ValueError('INSUFFICIENT_MERCHANT_CREDIT')
+    if (pool.available_amount < amount) if cents is None else (minor_of(pool, 'available_amount') < cents):
+        raise ValueError('INSUFFICIENT_POOL')
+    _move_credit(mc, pool, amount, cents)
+    return pool.id
+
+
+def locked_debit(merchant: Merchant, amount: Decimal, then):
+    """
+    Lock and debit the merchant credit and the pool (or one stripe), then call
+    `then(stripe_id)` in the same transaction and return its result. Shared by
+    the locking engine (which writes the ledger pair) and credit holds.
+    With MONEY_MINOR_UNITS the balances are checked and updated in cents.
+    """
+    cents = money.to_minor(amount) if money.enabled() else None
+    stripes = pool_stripes()
+    if stripes == 1:
+        CreditPool.get_solo()
+        with transaction.atomic():
+            with metrics.phase('credit.lock_debit'):
+                stripe_id = _debit_single(merchant, amount, cents)
+            with metrics.phase('credit.write'):
+                result = then(stripe_id)
+            profile_changed(merchant.id)
+            return result
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                with metrics.phase('credit.lock_debit'):
+                    stripe_id = _debit_striped(merchant, amount, stripes, cents)
+                with metrics.phase('credit.write'):
+                    result = then(stripe_id)
+                profile_changed(merchant.id)
+                return result
+        except _StripeExhausted as exc:
+            if attempt:
+                raise ValueError('INSUFFICIENT_POOL')
+            rebalance_credit_pool(prefer=exc.args[0], need=amount)
+
+
+@metrics.timed('credit.consume')
+def atomic_consume_credit(merchant: Merchant, account: WalletAccount, amount: Decimal):
+    """
+    Debit `amount` from the merchant's credit and the pool and write the ledger
+    pair. Returns the ledger tx_id or raises ValueError('INSUFFICIENT_*').
+    CREDIT_ENGINE selects the implementation; 'group' coalesces concurrent
+    callers into one transaction unless the caller already holds one open,
+    'sql' does the whole debit in a single CTE statement.
+    """
+    amount = q(amount)
+    engine = getattr(settings, 'CREDIT_ENGINE', 'locking')
+    if engine == 'group' and not transaction.get_connection().in_atomic_block:
+        from .group_commit import consume_grouped
+        return consume_grouped(merchant, account, amount)
+    if engine == 'sql':
+        from .sql_engine import consume_sql
+        return consume_sql(merchant, account, amount)
+    return _consume_locking(merchant, account, amount)
+
+
+def _consume_locking(merchant: Merchant, account: WalletAccount, amount: Decimal):
+    return locked_debit(merchant, amount, lambda stripe_id: _write_ledger_pair(merchant, account, amount))
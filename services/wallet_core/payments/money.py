@@ -0,0 +1,147 @@
+"""
+Integer minor-unit money (MONEY_MINOR_UNITS=1).
+
+Each DecimalField(18, 2) money column of MerchantCredit, CreditPool,
+LedgerEntry and WithdrawalRequest has a BIGINT companion `<field>_minor`
+that holds the same amount in cents. With the setting on, the locking engine
+and credit holds do their balance checks and updates in ints and write the
+`_minor` columns. There is no q()/Decimal arithmetic per withdrawal.
+
+The switch needs no downtime:
+1. Migration 0014 adds the `_minor` columns as nullable (a catalog-only
+   change) and installs a BEFORE INSERT OR UPDATE trigger per table. The
+   trigger fills whichever side of each pair the writer did not set. Old and
+   new code, in either mode, keep both columns equal.
+2. `backfill_minor_units` fills rows written before the migration, in short
+   keyset batches. `--check` reports what is left.
+3. Once nothing is left, set MONEY_MINOR_UNITS=1. Setting it back is safe at
+   any time.
+Dropping the decimal columns is a later migration, once nothing reads them.
+
+The API keeps rendering amounts as "12.34" strings (format_minor).
+"""
+
+from __future__ import annotations
+import time
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+
+# model label -> decimal money fields; each has a `<field>_minor` BigIntegerField
+MINOR_FIELDS = {
+    'payments.MerchantCredit': ('credit_limit', 'utilized_amount'),
+    'payments.CreditPool': ('available_amount',),
+    'payments.LedgerEntry': ('amount',),
+    'payments.WithdrawalRequest': ('amount',),
+}
+
+_CENT = Decimal('0.01')
+
+
+def enabled() -> bool:
+    return bool(getattr(settings, 'MONEY_MINOR_UNITS', False))
+
+
+def to_minor(x) -> int:
+    """Amount (Decimal, str, int) -> cents, rounded half up like models.q()."""
+    d = x if isinstance(x, Decimal) else Decimal(str(x))
+    return int(d.quantize(_CENT, rounding=ROUND_HALF_UP).scaleb(2))
+
+
+def from_minor(n: int) -> Decimal:
+    return Decimal(n).scaleb(-2)
+
+
+def format_minor(n: int) -> str:
+    """Cents -> the API's decimal string ("12.34", "-0.05"), without going through Decimal."""
+    sign = '-' if n < 0 else ''
+    whole, cents = divmod(abs(n), 100)
+    return f"{sign}{whole}.{cents:02d}"
+
+
+def minor_of(obj, field: str) -> int:
+    """`obj.<field>_minor`, falling back to the decimal value for a row the backfill has not reached."""
+    value = getattr(obj, f'{field}_minor')
+    return to_minor(getattr(obj, field)) if value is None else value
+
+
+def sync_trigger_sql(table: str, fields) -> tuple[str, str]:
+    """(create, drop) SQL for the trigger keeping `table`'s decimal and `_minor` columns equal (0014 holds a frozen copy)."""
+    insert, update = [], []
+    for f in fields:
+        m = f'{f}_minor'
+        insert.append(f"IF NEW.{m} IS NULL THEN NEW.{m} := round(NEW.{f} * 100);"
+                      f" ELSE NEW.{f} := NEW.{m}::numeric / 100; END IF;")
+        # The side the writer changed wins; a NULL _minor is simply filled in
+        update.append(f"IF NEW.{m} IS DISTINCT FROM OLD.{m} AND NEW.{m} IS NOT NULL THEN NEW.{f} := NEW.{m}::numeric / 100;"
+                      f" ELSIF NEW.{f} IS DISTINCT FROM OLD.{f} OR NEW.{m} IS NULL THEN NEW.{m} := round(NEW.{f} * 100); END IF;")
+    fn = f'{table}_minor_sync'
+    create = (
+        f"CREATE OR REPLACE FUNCTION {fn}() RETURNS trigger LANGUAGE plpgsql AS $$\n"
+        f"BEGIN\n"
+        f"  IF TG_OP = 'INSERT' THEN\n" + ''.join(f"    {s}\n" for s in insert) +
+        "  ELSE\n" + ''.join(f"    {s}\n" for s in update) +
+        f"  END IF;\n  RETURN NEW;\nEND $$;\n"
+        f'CREATE TRIGGER {fn} BEFORE INSERT OR UPDATE ON "{table}" FOR EACH ROW EXECUTE FUNCTION {fn}();'
+    )
+    drop = f'DROP TRIGGER IF EXISTS {fn} ON "{table}"; DROP FUNCTION IF EXISTS {fn}();'
+    return create, drop
+
+
+def _keys(model) -> list[str]:
+    from .partitions import partitioned_models
+    if model in partitioned_models().values():
+        return ['created_at', 'id']
+    return [model._meta.pk.column]
+
+
+def _missing(fields) -> str:
+    return ' OR '.join(f'{f}_minor IS NULL' for f in fields)
+
+
+def pending() -> dict[str, int]:
+    """Rows per model whose `_minor` columns are still NULL."""
+    out = {}
+    with connection.cursor() as cur:
+        for label, fields in MINOR_FIELDS.items():
+            cur.execute(f'SELECT count(*) FROM "{apps.get_model(label)._meta.db_table}" WHERE {_missing(fields)}')
+            out[label] = cur.fetchone()[0]
+    return out
+
+
+def backfill(batch_size: int = 5000, sleep_s: float = 0.05, models=None) -> dict[str, int]:
+    """
+    Fill NULL `_minor` columns, walking each table in key order one batch per
+    autocommit statement so no lock is held for long. Returns rows filled per model.
+    """
+    done = {}
+    with connection.cursor() as cur:
+        for label in models or MINOR_FIELDS:
+            fields = MINOR_FIELDS[label]
+            table = apps.get_model(label)._meta.db_table
+            keys = _keys(apps.get_model(label))
+            cols = ', '.join(keys)
+            sets = ', '.join(f'{f}_minor = round({f} * 100)' for f in fields)
+            marks = ', '.join(['%s'] * len(keys))
+            last, done[label] = None, 0
+            while True:
+                bounds, params = [], []
+                if last:
+                    bounds.append(f'({cols}) > ({marks})'); params += list(last)
+                # Key of the batch's last row; None once fewer than batch_size rows remain
+                cur.execute(f'SELECT {cols} FROM "{table}"{" WHERE " + bounds[0] if bounds else ""}'
+                            f' ORDER BY {cols} OFFSET %s LIMIT 1', params + [batch_size - 1])
+                end = cur.fetchone()
+                if end:
+                    bounds.append(f'({cols}) <= ({marks})'); params += list(end)
+                cur.execute(f'UPDATE "{table}" SET {sets} WHERE {" AND ".join(bounds + [f"({_missing(fields)})"])}',
+                            params)
+                done[label] += cur.rowcount
+                if end is None:
+                    break
+                last = end
+                if sleep_s:
+                    time.sleep(sleep_s)
+    return done
@@ -0,0 +1,150 @@
+"""
+Monthly range partitioning on created_at for the append-only tables.
+
+Migration 0010 converts LedgerEntry, WithdrawalRequest and ApiRequestLog into
+partitioned tables with one partition per month, named `<table>_pYYYY_MM`.
+Postgres requires the partition key in every unique constraint, so the
+primary key becomes (id, created_at). `id` stays the Django pk; ids are
+UUIDv7 (utils.ids.uuid7), so they stay unique and arrive in insert order.
+For the same reason CreditHold.withdrawal has no database FK.
+
+`maintain()` keeps PARTITION_MONTHS_AHEAD months pre-created. It runs from
+the `maintain_partitions` command and a daily beat task. It also detaches
+partitions older than PARTITION_RETENTION_MONTHS[model] (absent or 0 keeps
+everything). A detached partition stays as a plain table until it is
+archived or dropped.
+
+Each table also has a DEFAULT partition, `<table>_pdefault` (migration 0016),
+so inserts keep working if maintenance falls behind. Rows landing there are
+logged as errors by `maintain()`, which then creates their months'
+partitions; `create_partition` moves such rows out of the default partition.
+"""
+
+from __future__ import annotations
+import logging
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+_SUFFIX = re.compile(r'_p(\d{4})_(\d{2})$')
+
+
+def partitioned_models() -> dict:
+    from .models import ApiRequestLog, LedgerEntry, WithdrawalRequest
+    return {m.__name__: m for m in (LedgerEntry, WithdrawalRequest, ApiRequestLog)}
+
+
+def month_start(d: date | datetime) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, n: int) -> date:
+    y, m = divmod(d.month - 1 + n, 12)
+    return date(d.year + y, m + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_pdefault"
+
+
+def _bound(month: date) -> str:
+    return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc).isoformat()
+
+
+def is_partitioned(cur, table: str) -> bool:
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+    row = cur.fetchone()
+    return bool(row) and row[0] == 'p'
+
+
+def list_partitions(cur, table: str) -> dict[date, str]:
+    """Month -> partition name for the attached partitions of `table`."""
+    cur.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+        " WHERE i.inhparent = to_regclass(%s)", [table])
+    out = {}
+    for (name,) in cur.fetchall():
+        m = _SUFFIX.search(name)
+        if m:
+            out[date(int(m.group(1)), int(m.group(2)), 1)] = name
+    return out
+
+
+def create_partition(cur, table: str, month: date) -> str:
+    """Create the partition for `month`, moving any of its rows out of the default partition first."""
+    name = partition_name(table, month)
+    lo, hi = _bound(month), _bound(add_months(month, 1))
+    default = default_partition_name(table)
+    cur.execute("SELECT to_regclass(%s) IS NULL", [name])
+    missing = cur.fetchone()[0]
+    stranded = False
+    if missing and default in _attached(cur, table):
+        cur.execute(f'SELECT EXISTS (SELECT 1 FROM "{default}" WHERE created_at >= %s AND created_at < %s)', [lo, hi])
+        stranded = cur.fetchone()[0]
+    if stranded:
+        # Postgres rejects a new partition whose range still has rows in the default one
+        cur.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"')
+    cur.execute(
+        f'CREATE TABLE IF NOT EXISTS "{name}" PARTITION OF "{table}"'
+        f" FOR VALUES FROM ('{lo}') TO ('{hi}')")
+    if stranded:
+        cur.execute(f'INSERT INTO "{table}" SELECT * FROM "{default}" WHERE created_at >= %s AND created_at < %s', [lo, hi])
+        cur.execute(f'DELETE FROM "{default}" WHERE created_at >= %s AND created_at < %s', [lo, hi])
+        cur.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT')
+    return name
+
+
+def _attached(cur, table: str) -> set[str]:
+    cur.execute(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+        " WHERE i.inhparent = to_regclass(%s)", [table])
+    return {name for (name,) in cur.fetchall()}
+
+
+def _default_months(cur, table: str) -> list[date]:
+    """Months of the rows sitting in the default partition (empty while maintenance keeps up)."""
+    default = default_partition_name(table)
+    if default not in _attached(cur, table):
+        return []
+    cur.execute(f"SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC') FROM \"{default}\"")
+    return sorted(month_start(m) for (m,) in cur.fetchall())
+
+
+def maintain(today: date | None = None, months_ahead: int | None = None, retention: dict | None = None) -> dict:
+    """Create upcoming monthly partitions and detach expired ones. Returns {model: {'created': [...], 'detached': [...]}}."""
+    today = today or datetime.now(dt_timezone.utc).date()
+    months_ahead = int(getattr(settings, 'PARTITION_MONTHS_AHEAD', 3) if months_ahead is None else months_ahead)
+    retention = getattr(settings, 'PARTITION_RETENTION_MONTHS', {}) if retention is None else retention
+    current = month_start(today)
+    report = {}
+    for label, model in partitioned_models().items():
+        table = model._meta.db_table
+        created, detached = [], []
+        with transaction.atomic(), connection.cursor() as cur:
+            if not is_partitioned(cur, table):
+                continue
+            existing = list_partitions(cur, table)
+            stranded = _default_months(cur, table)
+            if stranded:
+                logger.error("%s: rows for %s landed in the default partition; partition maintenance fell behind",
+                             table, ', '.join(f'{m:%Y-%m}' for m in stranded))
+            for month in sorted(set(stranded) | {add_months(current, n) for n in range(months_ahead + 1)}):
+                if month not in existing:
+                    created.append(create_partition(cur, table, month))
+            keep = int(retention.get(label, 0) or 0)
+            if keep:
+                cutoff = add_months(current, -keep)
+                for month, name in sorted(existing.items()):
+                    if month < cutoff:
+                        cur.execute(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"')
+                        detached.append(name)
+        report[label] = {'created': created, 'detached': detached}
+    return report
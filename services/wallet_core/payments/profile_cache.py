@@ -0,0 +1,158 @@
+"""
+Two-tier cache for the /me merchant profile.
+
+Tier 1 is an in-process LRU (PROFILE_LOCAL_MAX entries). An entry is served
+without any I/O for PROFILE_LOCAL_TTL_S. After that, one Redis GET of the
+merchant's version counter either renews it or drops it. Tier 2 is Redis
+(`profile:m:<merchant_id>`, PROFILE_CACHE_TTL_S), stamped with the version
+read before the rows were loaded. A miss in both tiers loads the profile with
+one select_related query.
+
+Every writer of profile data calls `models.profile_changed()`. After commit,
+that INCRs `profile:ver:<merchant_id>`, so other processes see the change
+within PROFILE_LOCAL_TTL_S. It also evicts the local entry, so the writing
+process sees it immediately.
+"""
+
+from __future__ import annotations
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .models import Merchant
+from .utils.cache import redis_client
+
+
+# user -> merchant never changes; the mapping only expires to bound memory
+OWNER_TTL_S = 86400
+
+
+def _version_key(merchant_id: int) -> str:
+    return f"profile:ver:{merchant_id}"
+
+
+def _profile_key(merchant_id) -> str:
+    return f"profile:m:{merchant_id}"
+
+
+def _owner_key(user_id: int) -> str:
+    return f"profile:owner:{user_id}"
+
+
+class _LocalLRU:
+    """user_id -> [merchant_id, version, data, fresh_until]; thread-safe, bounded."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items: OrderedDict[int, list] = OrderedDict()
+        self._by_merchant: dict[int, int] = {}
+
+    def get(self, user_id: int):
+        with self._lock:
+            entry = self._items.get(user_id)
+            if entry is not None:
+                self._items.move_to_end(user_id)
+            return entry
+
+    def put(self, user_id: int, merchant_id: int, version: int, data: dict) -> None:
+        ttl = float(getattr(settings, 'PROFILE_LOCAL_TTL_S', 2.0))
+        limit = int(getattr(settings, 'PROFILE_LOCAL_MAX', 10000))
+        with self._lock:
+            self._items[user_id] = [merchant_id, version, data, time.monotonic() + ttl]
+            self._items.move_to_end(user_id)
+            self._by_merchant[merchant_id] = user_id
+            while len(self._items) > limit:
+                _, (mid, *_rest) = self._items.popitem(last=False)
+                self._by_merchant.pop(mid, None)
+
+    def renew(self, user_id: int) -> None:
+        ttl = float(getattr(settings, 'PROFILE_LOCAL_TTL_S', 2.0))
+        with self._lock:
+            entry = self._items.get(user_id)
+            if entry is not None:
+                entry[3] = time.monotonic() + ttl
+
+    def evict_merchant(self, merchant_id: int) -> None:
+        with self._lock:
+            user_id = self._by_merchant.pop(merchant_id, None)
+            if user_id is not None:
+                self._items.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+            self._by_merchant.clear()
+
+
+_local = _LocalLRU()
+
+
+def _load(user_id: int) -> dict:
+    m = Merchant.objects.select_related('user', 'credit', 'account').get(user_id=user_id)
+    mc = m.credit
+    return {
+        'merchant_id': m.id,
+        'username': m.user.username,
+        'is_approved': m.is_approved,
+        'account_id': str(m.account.id),
+        'bank_account': m.bank_account,
+        'credit_limit': str(mc.credit_limit),
+        'utilized_amount': str(mc.utilized_amount),
+        'available_credit': str(mc.available),
+    }
+
+
+def get_profile(user_id: int) -> dict:
+    """Profile for the merchant owned by `user_id`. Raises Merchant.DoesNotExist."""
+    entry = _local.get(user_id)
+    if entry is not None and entry[3] > time.monotonic():
+        return entry[2]
+    r = redis_client()
+    if entry is not None:
+        merchant_id, version, data, _ = entry
+        if int(r.get(_version_key(merchant_id)) or 0) == version:
+            _local.renew(user_id)
+            return data
+    else:
+        merchant_id = r.get(_owner_key(user_id))
+
+    if merchant_id is not None:
+        version, cached = r.mget(_version_key(merchant_id), _profile_key(merchant_id))
+        version = int(version or 0)
+        if cached:
+            stored = json.loads(cached)
+            if stored['v'] == version and stored['u'] == user_id:
+                _local.put(user_id, int(merchant_id), version, stored['d'])
+                return stored['d']
+
+    data = _load(user_id)
+    if merchant_id is None or int(merchant_id) != data['merchant_id']:
+        # First sight of this user (or a stale mapping): serve uncached and record the
+        # merchant id, so later loads can read the version before the rows
+        r.set(_owner_key(user_id), data['merchant_id'], ex=OWNER_TTL_S)
+        return data
+    # `version` was read before the rows: a concurrent bump makes this copy stale, never the reverse
+    r.set(_profile_key(merchant_id), json.dumps({'v': version, 'u': user_id, 'd': data}, cls=DjangoJSONEncoder),
+          ex=int(getattr(settings, 'PROFILE_CACHE_TTL_S', 300)))
+    _local.put(user_id, data['merchant_id'], version, data)
+    return data
+
+
+def bump(merchant_ids) -> None:
+    """Invalidate cached profiles of `merchant_ids` in every process."""
+    merchant_ids = list(merchant_ids)
+    if not merchant_ids:
+        return
+    pipe = redis_client().pipeline(transaction=False)
+    for mid in merchant_ids:
+        pipe.incr(_version_key(mid))
+        _local.evict_merchant(mid)
+    pipe.execute()
+
+
+def clear_local() -> None:
+    _local.clear()
@@ -0,0 +1,111 @@
+"""
+Per-merchant withdrawal rate limits.
+
+Limits come from RATE_LIMIT_TIERS ({tier: {'limit', 'period_s', 'burst'}}),
+which is read once at settings load, and from each merchant's `rate_tier`.
+Tiers are cached in-process for RATE_LIMIT_TIER_CACHE_S. Enforcement is GCRA
+(`utils.cache.gcra_take`): one Lua call per decision.
+
+With RATE_LIMIT_LEASE_SIZE > 1, a worker takes that many tokens from Redis in
+one call and spends them locally until they run out or
+RATE_LIMIT_LEASE_TTL_S passes. Leased tokens are already counted in Redis, so
+the global limit holds. Tokens that expire unused are lost, which makes the
+limiter stricter, never looser. Most calls then skip Redis entirely.
+"""
+
+from __future__ import annotations
+import math
+import threading
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from .models import Merchant
+from .utils.cache import gcra_take
+
+DEFAULT_TIER = 'standard'
+
+
+@dataclass(frozen=True)
+class Decision:
+    allowed: bool
+    remaining: int
+    retry_after_s: int = 0
+
+
+class _Leases:
+    """Per-process token leases: subject -> [tokens, expires_at (monotonic)]."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._leases: dict[str, list] = {}
+
+    def take(self, subject: str) -> int | None:
+        """Spend one leased token; returns tokens left or None if no live lease."""
+        with self._lock:
+            lease = self._leases.get(subject)
+            if lease is None or lease[0] < 1 or lease[1] < time.monotonic():
+                self._leases.pop(subject, None)
+                return None
+            lease[0] -= 1
+            return lease[0]
+
+    def put(self, subject: str, tokens: int, ttl_s: float) -> None:
+        with self._lock:
+            self._leases[subject] = [tokens, time.monotonic() + ttl_s]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._leases.clear()
+
+
+_leases = _Leases()
+_tiers: dict[int, tuple[str, float]] = {}
+_tiers_lock = threading.Lock()
+
+
+def tier_config(tier: str) -> dict:
+    tiers = settings.RATE_LIMIT_TIERS
+    return tiers.get(tier) or tiers[DEFAULT_TIER]
+
+
+def tier_for_user(user_id: int) -> str:
+    now = time.monotonic()
+    with _tiers_lock:
+        hit = _tiers.get(user_id)
+    if hit and hit[1] > now:
+        return hit[0]
+    tier = Merchant.objects.filter(user_id=user_id).values_list('rate_tier', flat=True).first() or DEFAULT_TIER
+    with _tiers_lock:
+        _tiers[user_id] = (tier, now + float(getattr(settings, 'RATE_LIMIT_TIER_CACHE_S', 60)))
+    return tier
+
+
+def allow(subject: str, tier: str = DEFAULT_TIER) -> Decision:
+    cfg = tier_config(tier)
+    emission_ms = cfg['period_s'] * 1000.0 / cfg['limit']
+    burst = max(int(cfg.get('burst', 1)), 1)
+    lease_size = min(int(getattr(settings, 'RATE_LIMIT_LEASE_SIZE', 0)), burst)
+    if lease_size > 1:
+        left = _leases.take(subject)
+        if left is not None:
+            return Decision(True, left)
+    granted, retry_ms, remaining = gcra_take(subject, emission_ms, burst, max(lease_size, 1))
+    if not granted:
+        return Decision(False, 0, max(math.ceil(retry_ms / 1000), 1))
+    if granted > 1:
+        _leases.put(subject, granted - 1, float(getattr(settings, 'RATE_LIMIT_LEASE_TTL_S', 1.0)))
+    return Decision(True, remaining + granted - 1)
+
+
+def allow_withdrawal(user_id: int, tier: str | None = None) -> Decision:
+    """`tier` comes from the token claims when present; otherwise it is looked up."""
+    return allow(f"merchant:{user_id}:withdrawals", tier or tier_for_user(user_id))
+
+
+def reset_local_state() -> None:
+    """Drop leases and cached tiers (tests, or after changing a merchant's tier)."""
+    _leases.clear()
+    with _tiers_lock:
+        _tiers.clear()
@@ -0,0 +1,254 @@
+"""
+Streaming ledger reconciliation.
+
+`reconcile()` checks MerchantCredit and CreditPool against LedgerEntry.
+Entries are read in (created_at, id) order through a server-side cursor,
+RECON_CHUNK_SIZE rows at a time, as integer minor units in NumPy arrays.
+Each chunk is aggregated per merchant and per tx_id, and these checks run:
+
+- every tx_id has exactly one DEBIT/CREDIT_POOL and one CREDIT/MERCHANT_CREDIT
+  entry, of the same merchant and amount;
+- per merchant, ledger credits plus HELD credit holds equal utilized_amount;
+- pool funding implied by the rows (available + consumed by the ledger + held)
+  never drops between runs. Top-ups only raise it, so a drop means money left
+  the pool without a ledger entry.
+
+Runs are incremental. Each ReconciliationRun stores the scan cursor and the
+cumulative per-merchant totals, and the next run scans only newer entries.
+`full=True` rescans from the start. Entries newer than RECON_LAG_S are left to
+the next run. Balances are compared in one snapshot, together with the ledger
+tail past the cursor. A ledger write that commits more than RECON_LAG_S after
+its created_at is not seen by incremental runs; a full run catches it.
+"""
+
+from __future__ import annotations
+import uuid
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import CreditHold, CreditPool, LedgerEntry, MerchantCredit, ReconciliationRun
+
+_LEDGER = LedgerEntry._meta.db_table
+
+_SCAN_SQL = (
+    f"SELECT created_at, id, tx_id, merchant_id, direction = 'DEBIT', source = 'CREDIT_POOL',"
+    f"       (amount * 100)::bigint"
+    f"  FROM {_LEDGER} WHERE (created_at, id) > (%s, %s) AND created_at < %s"
+    f" ORDER BY created_at, id"
+)
+
+# Sorts before every real (created_at, id)
+_START = (datetime(1970, 1, 1, tzinfo=dt_timezone.utc), uuid.UUID(int=0))
+
+
+class _Report:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.count = 0
+        self.items: list[dict] = []
+
+    def add(self, kind: str, **detail) -> None:
+        self.count += 1
+        if len(self.items) < self.limit:
+            self.items.append({'kind': kind, **detail})
+
+
+def _chunk_arrays(rows) -> dict[str, np.ndarray]:
+    _, _, txs, mids, is_debit, is_pool, minor = zip(*rows)
+    raw = b''.join(t.bytes if isinstance(t, uuid.UUID) else uuid.UUID(t).bytes for t in txs)
+    tx = np.frombuffer(raw, dtype='>u8').reshape(-1, 2)
+    return {
+        'tx_hi': tx[:, 0].astype(np.uint64), 'tx_lo': tx[:, 1].astype(np.uint64),
+        'merchant': np.array(mids, dtype=np.int64),
+        'is_debit': np.array(is_debit, dtype=bool), 'is_pool': np.array(is_pool, dtype=bool),
+        'minor': np.array(minor, dtype=np.int64),
+    }
+
+
+def _open_arrays(entries: list) -> dict[str, np.ndarray]:
+    return _chunk_arrays([(None, None, uuid.UUID(t), m, d, p, a) for t, m, d, p, a in entries])
+
+
+def _concat(a: dict, b: dict) -> dict:
+    return {k: np.concatenate([a[k], b[k]]) for k in a}
+
+
+def _add_merchant_totals(totals: dict, arr: dict) -> None:
+    pool_debit = np.where(arr['is_debit'] & arr['is_pool'], arr['minor'], 0)
+    mc_credit = np.where(~arr['is_debit'] & ~arr['is_pool'], arr['minor'], 0)
+    order = np.argsort(arr['merchant'], kind='stable')
+    ids, starts = np.unique(arr['merchant'][order], return_index=True)
+    pool_sums = np.add.reduceat(pool_debit[order], starts)
+    mc_sums = np.add.reduceat(mc_credit[order], starts)
+    for mid, p, c in zip(ids.tolist(), pool_sums.tolist(), mc_sums.tolist()):
+        t = totals.setdefault(str(mid), [0, 0])
+        t[0] += p
+        t[1] += c
+
+
+def _check_txs(arr: dict, report: _Report) -> list:
+    """Check every tx with two or more entries; return the entries of the rest (still open)."""
+    order = np.lexsort((arr['tx_lo'], arr['tx_hi']))
+    s = {k: v[order] for k, v in arr.items()}
+    n = len(order)
+    new_tx = np.ones(n, dtype=bool)
+    new_tx[1:] = (s['tx_hi'][1:] != s['tx_hi'][:-1]) | (s['tx_lo'][1:] != s['tx_lo'][:-1])
+    starts = np.flatnonzero(new_tx)
+    counts = np.diff(np.append(starts, n))
+
+    debit_pool = s['is_debit'] & s['is_pool']
+    credit_mc = ~s['is_debit'] & ~s['is_pool']
+    n_debit = np.add.reduceat(debit_pool.astype(np.int64), starts)
+    n_credit = np.add.reduceat(credit_mc.astype(np.int64), starts)
+    net = np.add.reduceat(np.where(debit_pool, s['minor'], 0) - np.where(credit_mc, s['minor'], 0), starts)
+    same_merchant = np.minimum.reduceat(s['merchant'], starts) == np.maximum.reduceat(s['merchant'], starts)
+
+    complete = counts >= 2
+    balanced = (counts == 2) & (n_debit == 1) & (n_credit == 1) & (net == 0) & same_merchant
+    for i in np.flatnonzero(complete & ~balanced).tolist():
+        report.add('UNBALANCED_TX', tx_id=str(_tx_at(s, starts[i])), entries=int(counts[i]),
+                   net_minor=int(net[i]), merchant_id=int(s['merchant'][starts[i]]))
+
+    still_open = np.repeat(~complete, counts)
+    return [[str(_tx_at(s, i)), int(s['merchant'][i]), bool(s['is_debit'][i]), bool(s['is_pool'][i]),
+             int(s['minor'][i])] for i in np.flatnonzero(still_open).tolist()]
+
+
+def _tx_at(s: dict, i: int) -> uuid.UUID:
+    return uuid.UUID(int=(int(s['tx_hi'][i]) << 64) | int(s['tx_lo'][i]))
+
+
+def _scan(cursor_at, horizon, totals: dict, open_entries: list, report: _Report, chunk_size: int):
+    """Stream entries after `cursor_at` up to `horizon`. Returns (new cursor, entries scanned, open entries)."""
+    scanned = 0
+    # Inside a transaction the cursor is not WITH HOLD: Postgres streams it instead of materializing
+    # the range, and every FETCH stays on one server connection behind PgBouncer in transaction mode
+    with transaction.atomic(), connection.chunked_cursor() as cur:
+        cur.execute(_SCAN_SQL, [cursor_at[0], cursor_at[1], horizon])
+        while True:
+            rows = cur.fetchmany(chunk_size)
+            if not rows:
+                break
+            arr = _chunk_arrays(rows)
+            _add_merchant_totals(totals, arr)
+            if open_entries:
+                arr = _concat(_open_arrays(open_entries), arr)
+            open_entries = _check_txs(arr, report)
+            cursor_at = (rows[-1][0], rows[-1][1])
+            scanned += len(rows)
+    return cursor_at, scanned, open_entries
+
+
+def _settle_open(open_entries: list, cursor_at, report: _Report) -> list:
+    """Keep open entries whose tx continues past the cursor; report the others as missing their pair."""
+    if not open_entries:
+        return []
+    with connection.cursor() as cur:
+        cur.execute(f"SELECT DISTINCT tx_id::text FROM {_LEDGER}"
+                    f" WHERE (created_at, id) > (%s, %s) AND tx_id = ANY(%s::uuid[])",
+                    [cursor_at[0], cursor_at[1], sorted({e[0] for e in open_entries})])
+        continued = {r[0] for r in cur.fetchall()}
+    for e in open_entries:
+        if e[0] not in continued:
+            report.add('UNBALANCED_TX', tx_id=e[0], entries=1, net_minor=e[4] if e[2] else -e[4], merchant_id=e[1])
+    return [e for e in open_entries if e[0] in continued]
+
+
+def _group_minor(sql: str, params=()) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    with connection.cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    if not rows:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    cols = [np.array(c, dtype=np.int64) for c in zip(*rows)]
+    return cols[0], cols[1], cols[2] if len(cols) > 2 else np.zeros_like(cols[0])
+
+
+def _scatter(ids: np.ndarray, sub_ids: np.ndarray, values: np.ndarray) -> np.ndarray:
+    out = np.zeros(len(ids), dtype=np.int64)
+    out[np.searchsorted(ids, sub_ids)] = values
+    return out
+
+
+def _compare_balances(totals: dict, cursor_at, report: _Report) -> int:
+    """Compare credit rows with ledger totals in one snapshot. Returns the implied pool funding."""
+    mc_table, hold_table, pool_table = (MerchantCredit._meta.db_table, CreditHold._meta.db_table,
+                                        CreditPool._meta.db_table)
+    own_snapshot = not connection.in_atomic_block
+    with transaction.atomic():
+        if own_snapshot:
+            with connection.cursor() as cur:
+                cur.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        util_ids, util, _ = _group_minor(f"SELECT merchant_id, (utilized_amount * 100)::bigint FROM {mc_table}")
+        held_ids, held, _ = _group_minor(
+            f"SELECT merchant_id, (SUM(amount) * 100)::bigint FROM {hold_table} WHERE status = 'HELD' GROUP BY merchant_id")
+        tail_ids, tail_pool, tail_mc = _group_minor(
+            f"SELECT merchant_id,"
+            f"       (COALESCE(SUM(amount) FILTER (WHERE direction = 'DEBIT' AND source = 'CREDIT_POOL'), 0) * 100)::bigint,"
+            f"       (COALESCE(SUM(amount) FILTER (WHERE direction = 'CREDIT' AND source = 'MERCHANT_CREDIT'), 0) * 100)::bigint"
+            f"  FROM {_LEDGER} WHERE (created_at, id) > (%s, %s) GROUP BY merchant_id", list(cursor_at))
+        with connection.cursor() as cur:
+            cur.execute(f"SELECT (COALESCE(SUM(available_amount), 0) * 100)::bigint FROM {pool_table}")
+            pool_available = int(cur.fetchone()[0])
+
+    led_ids = np.array([int(k) for k in totals], dtype=np.int64)
+    led = np.array(list(totals.values()), dtype=np.int64).reshape(-1, 2)
+    ids = np.union1d(np.union1d(led_ids, util_ids), np.union1d(held_ids, tail_ids))
+    has_row = np.zeros(len(ids), dtype=bool)
+    has_row[np.searchsorted(ids, util_ids)] = True
+    expected = (_scatter(ids, led_ids, led[:, 1]) + _scatter(ids, tail_ids, tail_mc)
+                + _scatter(ids, held_ids, held))
+    actual = _scatter(ids, util_ids, util)
+    for i in np.flatnonzero((expected != actual) | ~has_row).tolist():
+        report.add('UTILIZED_MISMATCH' if has_row[i] else 'MISSING_CREDIT_ROW', merchant_id=int(ids[i]),
+                   expected_minor=int(expected[i]), utilized_minor=int(actual[i]))
+
+    consumed = int(led[:, 0].sum()) + int(tail_pool.sum()) + int(held.sum())
+    return pool_available + consumed
+
+
+def reconcile(full: bool = False, chunk_size: int | None = None) -> ReconciliationRun:
+    """Scan new ledger entries (all of them with `full`), check them, and store the run."""
+    chunk_size = chunk_size or int(getattr(settings, 'RECON_CHUNK_SIZE', 50000))
+    report = _Report(int(getattr(settings, 'RECON_MAX_REPORTED', 1000)))
+    prev = None if full else ReconciliationRun.objects.filter(finished_at__isnull=False).order_by('-id').first()
+    base = prev or ReconciliationRun.objects.filter(finished_at__isnull=False).order_by('-id').first()
+
+    run = ReconciliationRun.objects.create(full=prev is None)
+    totals = dict(prev.merchant_totals) if prev else {}
+    open_entries = list(prev.open_entries) if prev else []
+    cursor_at = (prev.cursor_created_at, prev.cursor_id) if prev and prev.cursor_id else _START
+    horizon = run.started_at - timedelta(seconds=float(getattr(settings, 'RECON_LAG_S', 60)))
+
+    cursor_at, scanned, open_entries = _scan(cursor_at, horizon, totals, open_entries, report, chunk_size)
+    open_entries = _settle_open(open_entries, cursor_at, report)
+    funding = _compare_balances(totals, cursor_at, report)
+    if base is not None and funding < base.pool_funding_minor:
+        report.add('POOL_FUNDING_DECREASED', previous_minor=base.pool_funding_minor, current_minor=funding)
+
+    if cursor_at is not _START:
+        run.cursor_created_at, run.cursor_id = cursor_at
+    run.entries_scanned = scanned
+    run.merchant_totals = totals
+    run.open_entries = open_entries
+    run.pool_funding_minor = funding
+    run.discrepancy_count = report.count
+    run.discrepancies = report.items
+    run.finished_at = timezone.now()
+    run.save()
+    return run
+
+
+def summary(run: ReconciliationRun) -> dict:
+    return {
+        'run_id': run.id, 'full': run.full, 'entries_scanned': run.entries_scanned,
+        'merchants': len(run.merchant_totals), 'open_entries': len(run.open_entries),
+        'pool_funding_minor': run.pool_funding_minor, 'discrepancy_count': run.discrepancy_count,
+        'cursor': [run.cursor_created_at.isoformat() if run.cursor_created_at else None,
+                   str(run.cursor_id) if run.cursor_id else None],
+    }
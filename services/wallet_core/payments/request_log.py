@@ -0,0 +1,164 @@
+"""
+Buffered writer for ApiRequestLog (REQUEST_LOG_MODE=buffered).
+
+Request handlers append log records to a bounded in-process buffer and
+return. A daemon flusher thread writes them with `bulk_create` in batches of
+REQUEST_LOG_BATCH_SIZE, either when that many are waiting or every
+REQUEST_LOG_FLUSH_INTERVAL_S. The buffer holds at most REQUEST_LOG_CAPACITY
+records. When it is full, new records are dropped and counted; requests never
+wait on the audit log. If the database is unreachable, a failed flush puts
+its batch back at the head of the buffer, within the same capacity limit.
+
+Whatever is still buffered is flushed at interpreter exit. A hard kill loses
+it; `stats()['dropped']` and `['pending']` show how much audit coverage is
+being traded for latency. REQUEST_LOG_MODE=sync keeps the old one INSERT per
+request.
+"""
+
+from __future__ import annotations
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import connection, InterfaceError, OperationalError
+from django.utils import timezone
+
+from .models import ApiRequestLog
+
+logger = logging.getLogger(__name__)
+
+
+class RequestLogBuffer:
+    def __init__(self, capacity: int = 10000, batch_size: int = 500, flush_interval_s: float = 0.5):
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._items: deque[dict] = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.enqueued = self.written = self.dropped = self.flush_errors = 0
+
+    def put(self, record: dict) -> bool:
+        """Buffer one record; returns False (and counts a drop) when full."""
+        with self._lock:
+            if len(self._items) >= self.capacity:
+                self.dropped += 1
+                return False
+            self._items.append(record)
+            self.enqueued += 1
+            full_batch = len(self._items) >= self.batch_size
+        if full_batch:
+            self._wake.set()
+        return True
+
+    def flush(self) -> int:
+        """Write everything buffered so far in batches; returns rows written."""
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._items.popleft() for _ in range(min(self.batch_size, len(self._items)))]
+                if not batch:
+                    return written
+                try:
+                    ApiRequestLog.objects.bulk_create([ApiRequestLog(**r) for r in batch])
+                except (OperationalError, InterfaceError):
+                    # Database unreachable: keep the batch and retry on the next tick
+                    logger.exception("request log flush of %d records failed", len(batch))
+                    self._requeue(batch)
+                    return written
+                except Exception:
+                    # Bad records would fail every retry; drop and count them
+                    logger.exception("request log batch of %d records dropped", len(batch))
+                    with self._lock:
+                        self.flush_errors += 1
+                        self.dropped += len(batch)
+                    continue
+                written += len(batch)
+                with self._lock:
+                    self.written += len(batch)
+
+    def _requeue(self, batch: list[dict]) -> None:
+        with self._lock:
+            self.flush_errors += 1
+            room = max(self.capacity - len(self._items), 0)
+            self.dropped += max(len(batch) - room, 0)
+            self._items.extendleft(reversed(batch[:room]))
+
+    def start(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='request-log-flusher', daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        """Stop the flusher and write whatever is left (flush-on-shutdown)."""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval_s)
+            self._wake.clear()
+            try:
+                self.flush()
+            finally:
+                # Do not pin a server connection between ticks (PgBouncer, CONN_MAX_AGE=0)
+                connection.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'enqueued': self.enqueued, 'written': self.written, 'dropped': self.dropped,
+                'flush_errors': self.flush_errors, 'pending': len(self._items), 'capacity': self.capacity,
+            }
+
+
+_buffer: RequestLogBuffer | None = None
+_buffer_pid: int | None = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer() -> RequestLogBuffer:
+    """Per-process buffer with a running flusher (re-created after fork)."""
+    global _buffer, _buffer_pid
+    with _buffer_lock:
+        if _buffer is None or _buffer_pid != os.getpid():
+            _buffer = RequestLogBuffer(
+                capacity=int(getattr(settings, 'REQUEST_LOG_CAPACITY', 10000)),
+                batch_size=int(getattr(settings, 'REQUEST_LOG_BATCH_SIZE', 500)),
+                flush_interval_s=float(getattr(settings, 'REQUEST_LOG_FLUSH_INTERVAL_S', 0.5)),
+            )
+            _buffer_pid = os.getpid()
+            _buffer.start()
+            atexit.register(_buffer.close)
+        return _buffer
+
+
+def buffered() -> bool:
+    return getattr(settings, 'REQUEST_LOG_MODE', 'buffered') == 'buffered'
+
+
+def log(path: str, method: str, status: int, actor: str, payload: dict) -> None:
+    record = {'path': path, 'method': method, 'status': status, 'actor': actor,
+              'payload': payload, 'created_at': timezone.now()}
+    if buffered():
+        get_buffer().put(record)
+    else:
+        ApiRequestLog.objects.create(**record)
+
+
+def stats() -> dict:
+    out = {'mode': getattr(settings, 'REQUEST_LOG_MODE', 'buffered')}
+    if _buffer is not None and _buffer_pid == os.getpid():
+        out.update(_buffer.stats())
+    return out
@@ -0,0 +1,158 @@
+"""
+Batched retention for append-only tables.
+
+Each policy in RETENTION_POLICIES names a table from POLICY_TABLES, an age in
+days, and an action:
+- 'delete' removes expired rows;
+- 'archive' first appends them to a gzip-compressed NDJSON file under
+  RETENTION_ARCHIVE_DIR/<table>/.
+
+Expired rows are walked in (timestamp, pk) order with keyset pagination,
+RETENTION_BATCH_SIZE rows at a time. Each batch is deleted in its own short
+transaction, with a pause of RETENTION_SLEEP_S between batches, so the job
+never holds long locks or leaves a large bloat spike. The cursor is saved in
+RetentionCheckpoint in the same transaction as each delete. A pass cut short
+by RETENTION_MAX_SECONDS, or by a crash, resumes where it stopped, with the
+same cutoff.
+
+Archive rows are written before their batch is deleted. A batch whose delete
+failed is archived again by the next pass (at-least-once). `dry_run` walks
+the same batches without writing anything.
+"""
+
+from __future__ import annotations
+import gzip
+import json
+import os
+import time
+from dataclasses import dataclass, asdict
+from datetime import timedelta
+
+from django.apps import apps
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from .models import RetentionCheckpoint
+
+# policy name -> (model label, timestamp field)
+POLICY_TABLES = {
+    'request_log': ('payments.ApiRequestLog', 'created_at'),
+    'idempotency': ('payments.IdempotencyRecord', 'created_at'),
+    'celery_task_results': ('django_celery_results.TaskResult', 'date_done'),
+    'celery_group_results': ('django_celery_results.GroupResult', 'date_done'),
+}
+
+
+@dataclass
+class Outcome:
+    policy: str
+    action: str
+    dry_run: bool
+    rows: int = 0
+    batches: int = 0
+    finished: bool = False
+    archive: str | None = None
+
+
+def _archive_path(table: str, policy: str) -> str:
+    folder = os.path.join(getattr(settings, 'RETENTION_ARCHIVE_DIR', 'archive'), table)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, f"{policy}-{timezone.now():%Y%m%dT%H%M%S%fZ}.ndjson.gz")
+
+
+def run_policy(name: str, *, dry_run: bool = False, batch_size: int | None = None, max_batches: int | None = None,
+               max_seconds: float | None = None, sleep_s: float | None = None) -> Outcome:
+    cfg = settings.RETENTION_POLICIES[name]
+    label, ts_field = POLICY_TABLES[name]
+    model = apps.get_model(label)
+    table, pk = model._meta.db_table, model._meta.pk
+    ts = model._meta.get_field(ts_field).column
+    action = cfg.get('action', 'delete')
+    batch_size = batch_size or int(getattr(settings, 'RETENTION_BATCH_SIZE', 1000))
+    sleep_s = float(getattr(settings, 'RETENTION_SLEEP_S', 0.05) if sleep_s is None else sleep_s)
+    max_seconds = float(getattr(settings, 'RETENTION_MAX_SECONDS', 45) if max_seconds is None else max_seconds)
+    json_cols = {f.column for f in model._meta.concrete_fields if isinstance(f, models.JSONField)}
+
+    cp = RetentionCheckpoint.objects.filter(policy=name).first() or RetentionCheckpoint(policy=name)
+    cutoff = cp.cutoff or timezone.now() - timedelta(days=float(cfg['days']))
+    cursor = (cp.last_ts, pk.to_python(cp.last_pk)) if cp.last_ts else None
+    if not dry_run and cp.cutoff is None:
+        cp.cutoff = cutoff
+        cp.save()
+
+    outcome = Outcome(name, action, dry_run)
+    archive = None
+    cols = '*' if action == 'archive' and not dry_run else f'"{ts}", "{pk.column}"'
+    deadline = time.monotonic() + max_seconds
+    try:
+        while True:
+            where, params = [f'"{ts}" < %s'], [cutoff]
+            if cursor:
+                where.append(f'("{ts}", "{pk.column}") > (%s, %s)')
+                params += list(cursor)
+            with connection.cursor() as cur:
+                cur.execute(f'SELECT {cols} FROM "{table}" WHERE {" AND ".join(where)}'
+                            f' ORDER BY "{ts}", "{pk.column}" LIMIT %s', params + [batch_size])
+                names = [c[0] for c in cur.description]
+                rows = cur.fetchall()
+            if not rows:
+                outcome.finished = True
+                break
+            records = [dict(zip(names, r)) for r in rows]
+            keys = [r[pk.column] for r in records]
+            first_ts, cursor = records[0][ts], (records[-1][ts], keys[-1])
+
+            if not dry_run:
+                if action == 'archive':
+                    if archive is None:
+                        outcome.archive = _archive_path(table, name)
+                        archive = gzip.open(outcome.archive, 'at', encoding='utf-8')
+                    for rec in records:
+                        for c in json_cols:
+                            if isinstance(rec.get(c), str):
+                                rec[c] = json.loads(rec[c])
+                        archive.write(json.dumps(rec, cls=DjangoJSONEncoder) + '\n')
+                    archive.flush()
+                with transaction.atomic(), connection.cursor() as cur:
+                    cur.execute(f'DELETE FROM "{table}" WHERE "{ts}" BETWEEN %s AND %s AND "{pk.column}" = ANY(%s)',
+                                [first_ts, cursor[0], keys])
+                    cp.last_ts, cp.last_pk = cursor[0], str(cursor[1])
+                    cp.rows_done += len(keys)
+                    cp.save(update_fields=['last_ts', 'last_pk', 'rows_done', 'updated_at'])
+
+            outcome.rows += len(keys)
+            outcome.batches += 1
+            if len(rows) < batch_size:
+                outcome.finished = True
+                break
+            if (max_batches and outcome.batches >= max_batches) or time.monotonic() >= deadline:
+                break
+            if sleep_s:
+                time.sleep(sleep_s)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    if outcome.finished and not dry_run:
+        cp.cutoff = cp.last_ts = None
+        cp.last_pk, cp.rows_done = '', 0
+        cp.last_finished_at = timezone.now()
+        cp.save()
+    return outcome
+
+
+def run_all(dry_run: bool = False, max_seconds: float | None = None, **options) -> list[dict]:
+    """Apply every configured policy within one shared RETENTION_MAX_SECONDS budget."""
+    budget = float(getattr(settings, 'RETENTION_MAX_SECONDS', 45) if max_seconds is None else max_seconds)
+    deadline = time.monotonic() + budget
+    out = []
+    for name in settings.RETENTION_POLICIES:
+        if name not in POLICY_TABLES:
+            continue
+        left = deadline - time.monotonic()
+        if left <= 0:
+            break
+        out.append(asdict(run_policy(name, dry_run=dry_run, max_seconds=left, **options)))
+    return out
@@ -1,6 +1,24 @@
 from rest_framework import serializers
+from . import money
 from .models import Merchant, WalletAccount, MerchantCredit
 
+class MoneyField(serializers.DecimalField):
+    """Amount as a "12.34" string; with MONEY_MINOR_UNITS it renders the `<source>_minor` cents without Decimal."""
+    def __init__(self, **kwargs):
+        super().__init__(max_digits=18, decimal_places=2, **kwargs)
+
+    def get_attribute(self, instance):
+        if money.enabled():
+            cents = getattr(instance, f'{self.source}_minor', None)
+            if cents is not None:
+                return cents
+        return super().get_attribute(instance)
+
+    def to_representation(self, value):
+        if isinstance(value, int):
+            return money.format_minor(value)
+        return super().to_representation(value)
+
 class RegisterSerializer(serializers.Serializer):
     username = serializers.CharField()
     password = serializers.CharField(write_only=True)
@@ -26,3 +44,52 @@ class TopupPoolSerializer(serializers.Serializer):
 
 class WithdrawalCreateSerializer(serializers.Serializer):
     amount = serializers.DecimalField(max_digits=18, decimal_places=2)
+
+class BalanceAtQuerySerializer(serializers.Serializer):
+    at = serializers.DateTimeField()
+    merchant_id = serializers.IntegerField(required=False)
+
+class HistoryQuerySerializer(serializers.Serializer):
+    cursor = serializers.CharField(required=False)
+    limit = serializers.IntegerField(required=False, min_value=1)
+    created_from = serializers.DateTimeField(required=False)
+    created_to = serializers.DateTimeField(required=False)
+
+class WithdrawalListQuerySerializer(HistoryQuerySerializer):
+    status = serializers.ChoiceField(required=False, choices=['PENDING', 'QUEUED', 'SETTLING', 'SUCCESS', 'FAILED', 'REVIEW'])
+
+class LedgerListQuerySerializer(HistoryQuerySerializer):
+    direction = serializers.ChoiceField(required=False, choices=['DEBIT', 'CREDIT'])
+    source = serializers.ChoiceField(required=False, choices=['CREDIT_POOL', 'MERCHANT_CREDIT'])
+    tx_id = serializers.UUIDField(required=False)
+
+class WithdrawalSerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    amount = MoneyField()
+    status = serializers.CharField()
+    bank_reference = serializers.CharField()
+    created_at = serializers.DateTimeField()
+
+class LedgerEntrySerializer(serializers.Serializer):
+    id = serializers.UUIDField()
+    tx_id = serializers.UUIDField()
+    direction = serializers.CharField()
+    source = serializers.CharField()
+    amount = MoneyField()
+    created_at = serializers.DateTimeField()
+
+class ExportQuerySerializer(serializers.Serializer):
+    # Not `format`: DRF reserves that query parameter for renderer selection
+    fmt = serializers.ChoiceField(choices=['ndjson', 'csv'], default='ndjson')
+    gzip = serializers.BooleanField(default=False)
+    created_from = serializers.DateTimeField(required=False)
+    created_to = serializers.DateTimeField(required=False)
+    merchant_id = serializers.IntegerField(required=False)
+    # Resume strictly after this row (created_at and id of the last row received)
+    after_created_at = serializers.DateTimeField(required=False)
+    after_id = serializers.UUIDField(required=False)
+
+    def validate(self, attrs):
+        if ('after_created_at' in attrs) != ('after_id' in attrs):
+            raise serializers.ValidationError('after_created_at and after_id go together')
+        return attrs
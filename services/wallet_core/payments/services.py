@@ -1,6 +1,7 @@
 from django.contrib.auth.models import User
 from django.db import transaction
-from .models import Merchant, WalletAccount, MerchantCredit
+from .models import Merchant, WalletAccount, MerchantCredit, profile_changed
+from . import authentication, credit_front
 
 
 def create_merchant(username: str, password: str, requested_credit, bank_account='') -> Merchant:
@@ -20,4 +21,9 @@ def approve_merchant(merchant_id: int, credit_limit) -> Merchant:
         mc.credit_limit = credit_limit
         m.save(update_fields=['is_approved'])
         mc.save(update_fields=['credit_limit','updated_at'])
+        if credit_front.enabled():
+            transaction.on_commit(lambda: credit_front.invalidate_merchant(m.id))
+        profile_changed(m.id)
+        # Tokens carry is_approved: make clients refresh to pick up the new state
+        transaction.on_commit(lambda: authentication.revoke_user(m.user_id))
         return m
@@ -0,0 +1,82 @@
+"""
+Shared HTTP client for the settlement service.
+
+One keep-alive `requests.Session` per process (recreated after fork) with a
+connection pool sized by SETTLEMENT_POOL_SIZE, so withdrawals reuse TCP
+connections instead of paying a connect per call. The sync view and the
+Celery task both go through `settle()`, which applies the same timeouts
+(SETTLEMENT_CONNECT_TIMEOUT and SETTLEMENT_TIMEOUT, overridable per call) and
+times each call into wallet_settlement_call_seconds{outcome} (`payments.metrics`).
+
+The timeouts are requests' socket timeouts, not a total deadline: the read
+timeout bounds each wait for bytes from the service, so a response that keeps
+trickling in can take longer. The settlement service answers with one small
+JSON body, which makes the read timeout the effective bound in practice.
+"""
+
+from __future__ import annotations
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from . import metrics
+
+_session: requests.Session | None = None
+_session_pid: int | None = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            size = int(getattr(settings, 'SETTLEMENT_POOL_SIZE', 10))
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=size, max_retries=0)
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+            s.headers.update({'Content-Type': 'application/json', 'Connection': 'keep-alive'})
+            _session, _session_pid = s, os.getpid()
+        return _session
+
+
+def settle(body: dict, timeout: float | None = None) -> requests.Response:
+    """
+    POST one withdrawal to SETTLEMENT_URL. `timeout` is the read timeout in
+    seconds (the longest wait for response bytes, not for the whole call);
+    connecting is bounded by SETTLEMENT_CONNECT_TIMEOUT, capped at `timeout`.
+    Raises requests.RequestException on transport errors, like requests.post.
+    """
+    return _post(settings.SETTLEMENT_URL, body, timeout if timeout is not None else getattr(settings, 'SETTLEMENT_TIMEOUT', 2.5))
+
+
+def settle_batch(items: list[dict], timeout: float | None = None) -> requests.Response:
+    """
+    POST many withdrawals to SETTLEMENT_BATCH_URL in one call. Each item is a
+    `settle()` body plus a `ref` the service echoes back in `results`.
+    """
+    return _post(settings.SETTLEMENT_BATCH_URL, {'items': items},
+                 timeout if timeout is not None else getattr(settings, 'SETTLEMENT_BATCH_TIMEOUT', 10.0))
+
+
+def _post(url: str, body: dict, timeout: float) -> requests.Response:
+    read = float(timeout)
+    connect = min(float(getattr(settings, 'SETTLEMENT_CONNECT_TIMEOUT', 1.0)), read)
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        resp = get_session().post(
+            url, json=body, timeout=(connect, read),
+            headers={'Authorization': f"Bearer {settings.INTERNAL_TOKEN}"},
+        )
+        outcome = f"{resp.status_code // 100}xx"
+        return resp
+    except requests.Timeout:
+        outcome = 'timeout'
+        raise
+    finally:
+        metrics.settlement_call(outcome, time.perf_counter() - started)
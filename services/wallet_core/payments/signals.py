@@ -0,0 +1,35 @@
+"""
+Model signal handlers (connected in PaymentsConfig.ready).
+
+Access tokens carry `is_staff` and are trusted without loading the User row,
+so a change to `is_active` or `is_staff` revokes the user's tokens once the
+change commits. `QuerySet.update()` sends no signals; call
+`authentication.revoke_user` yourself after a bulk update.
+"""
+
+from __future__ import annotations
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from . import authentication
+
+_ACCESS_FLAGS = ('is_active', 'is_staff')
+
+
+@receiver(pre_save, sender=User)
+def _remember_access_flags(sender, instance, update_fields=None, **kwargs):
+    # Saves that cannot touch the flags (login's last_login update) cost no query
+    if instance.pk is None or (update_fields is not None and not set(_ACCESS_FLAGS) & set(update_fields)):
+        return
+    instance._access_flags = User.objects.filter(pk=instance.pk).values_list(*_ACCESS_FLAGS).first()
+
+
+@receiver(post_save, sender=User)
+def _revoke_on_access_change(sender, instance, created, **kwargs):
+    before = instance.__dict__.pop('_access_flags', None)
+    if before is not None and before != tuple(getattr(instance, f) for f in _ACCESS_FLAGS):
+        user_id = instance.pk
+        transaction.on_commit(lambda: authentication.revoke_user(user_id))
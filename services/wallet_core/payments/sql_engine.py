@@ -0,0 +1,110 @@
+"""
+Single-statement credit consumption (CREDIT_ENGINE=sql).
+
+One CTE locks the pool and merchant rows, applies both guarded decrements and
+inserts the ledger pair, so a withdrawal costs one round trip instead of the
+get_or_create + lock/read/modify/write sequence of the locking engine. The
+statement returns the balances it saw so the caller can still tell
+INSUFFICIENT_MERCHANT_CREDIT from INSUFFICIENT_POOL.
+"""
+
+from __future__ import annotations
+import uuid
+from decimal import Decimal
+
+from django.db import connection
+
+from . import lockprof
+from .models import MerchantCredit, pool_stripes, pool_stripe_for, profile_changed, _consume_locking
+from .utils.ids import uuid7
+
+# The scalar subquery in each *_lock CTE is evaluated before the row it filters
+# is locked, which fixes the lock order: pool -> merchant in single-row mode
+# (as in the locking engine) and merchant -> stripe in striped mode.
+_POOL_FIRST = """
+    pool_lock AS (
+        SELECT available_amount FROM payments_creditpool WHERE id = %(pool_id)s FOR UPDATE
+    ),
+    mc_lock AS (
+        SELECT credit_limit - utilized_amount AS available FROM payments_merchantcredit
+        WHERE merchant_id = %(merchant_id)s AND (SELECT count(*) FROM pool_lock) >= 0
+        FOR UPDATE
+    ),"""
+
+_MERCHANT_FIRST = """
+    mc_lock AS (
+        SELECT credit_limit - utilized_amount AS available FROM payments_merchantcredit
+        WHERE merchant_id = %(merchant_id)s FOR UPDATE
+    ),
+    pool_lock AS (
+        SELECT available_amount FROM payments_creditpool
+        WHERE id = %(pool_id)s AND (SELECT count(*) FROM mc_lock) >= 0
+        FOR UPDATE
+    ),"""
+
+_CONSUME_SQL = """
+WITH {locks}
+    ok AS (
+        SELECT 1 WHERE (SELECT available FROM mc_lock) >= %(amount)s
+                   AND (SELECT available_amount FROM pool_lock) >= %(amount)s
+    ),
+    mc_upd AS (
+        UPDATE payments_merchantcredit
+           SET utilized_amount = utilized_amount + %(amount)s, updated_at = now()
+         WHERE merchant_id = %(merchant_id)s AND EXISTS (SELECT 1 FROM ok)
+        RETURNING 1
+    ),
+    pool_upd AS (
+        UPDATE payments_creditpool
+           SET available_amount = available_amount - %(amount)s, updated_at = now()
+         WHERE id = %(pool_id)s AND EXISTS (SELECT 1 FROM ok)
+        RETURNING 1
+    ),
+    ledger AS (
+        INSERT INTO payments_ledgerentry (id, tx_id, merchant_id, account_id, direction, source, amount, created_at)
+        SELECT v.id, %(tx_id)s::uuid, %(merchant_id)s, %(account_id)s::uuid, v.direction, v.source, %(amount)s, now()
+          FROM ok CROSS JOIN (VALUES (%(debit_id)s::uuid, 'DEBIT', 'CREDIT_POOL'),
+                                     (%(credit_id)s::uuid, 'CREDIT', 'MERCHANT_CREDIT')) AS v(id, direction, source)
+        RETURNING 1
+    )
+SELECT (SELECT available FROM mc_lock),
+       (SELECT available_amount FROM pool_lock),
+       (SELECT count(*) FROM mc_upd) + (SELECT count(*) FROM pool_upd) + (SELECT count(*) FROM ledger)
+"""
+
+CONSUME_SQL_POOL_FIRST = _CONSUME_SQL.format(locks=_POOL_FIRST)
+CONSUME_SQL_MERCHANT_FIRST = _CONSUME_SQL.format(locks=_MERCHANT_FIRST)
+
+
+def consume_sql(merchant, account, amount: Decimal) -> uuid.UUID:
+    """
+    Consume `amount` in one statement. In striped mode only the home stripe is
+    tried here; a short stripe falls back to the locking engine, which knows
+    how to borrow from other stripes and rebalance.
+    """
+    stripes = pool_stripes()
+    tx_id = uuid.uuid4()
+    params = {
+        'merchant_id': merchant.id,
+        'account_id': str(account.id),
+        'pool_id': pool_stripe_for(merchant.id, stripes) if stripes > 1 else 1,
+        'amount': amount,
+        'tx_id': str(tx_id),
+        'debit_id': str(uuid7()),
+        'credit_id': str(uuid7()),
+    }
+    sql = CONSUME_SQL_MERCHANT_FIRST if stripes > 1 else CONSUME_SQL_POOL_FIRST
+    # One statement takes the pool and merchant locks together; profiled as one site
+    with connection.cursor() as cur, lockprof.acquire('creditpool.sql'):
+        cur.execute(sql, params)
+        mc_available, pool_available, written = cur.fetchone()
+    if written:
+        profile_changed(merchant.id)
+        return tx_id
+    if mc_available is None:
+        raise MerchantCredit.DoesNotExist('MerchantCredit matching query does not exist.')
+    if mc_available < amount:
+        raise ValueError('INSUFFICIENT_MERCHANT_CREDIT')
+    if stripes > 1:
+        return _consume_locking(merchant, account, amount)
+    raise ValueError('INSUFFICIENT_POOL')
@@ -1,24 +1,35 @@
 from __future__ import annotations
-import os
+import logging
 import requests
 import json
 from celery import shared_task
-from django.conf import settings
 from django.db import transaction
-from .models import WithdrawalRequest
+from django.utils import timezone
+from .models import WithdrawalRequest, CreditHold
 from .models import atomic_consume_credit
+from . import balances, batch_dispatch, credit_front, holds, metrics, partitions, reconciliation, retention, settlement_client, withdrawals
 
-SESSION_TIMEOUT = float(os.getenv('SETTLEMENT_TIMEOUT', '2.5'))
+logger = logging.getLogger(__name__)
 
 @shared_task(bind=True, autoretry_for=(requests.RequestException,), retry_backoff=True, retry_jitter=True, retry_kwargs={'max_retries': 5})
-def dispatch_settlement(self, withdrawal_id: str):
+@metrics.timed('settlement.task')
+def dispatch_settlement(self, withdrawal_id: str, reservation_id: str | None = None):
     """
     Celery task to perform settlement with the external FastAPI service.
     Adds exponential backoff and jitter for retries. Idempotent: checks WithdrawalRequest status.
+    `reservation_id` is the Redis credit front hold taken by the view, if any.
     """
-    wr = WithdrawalRequest.objects.select_for_update().get(id=withdrawal_id)
-    if wr.status in ('SUCCESS', 'FAILED'):
+    wr = WithdrawalRequest.objects.get(id=withdrawal_id)
+    if wr.status in withdrawals.FINAL:
         return {'status': wr.status, 'bank_reference': wr.bank_reference}
+    if wr.status == 'QUEUED':
+        # Claim the row before the call: the hold sweeper leaves SETTLING rows alone
+        try:
+            withdrawals.transition(wr, 'SETTLING', claimed_at=timezone.now())
+        except withdrawals.IllegalTransition:
+            wr.refresh_from_db(fields=['status', 'bank_reference'])
+            if wr.status in withdrawals.FINAL:
+                return {'status': wr.status, 'bank_reference': wr.bank_reference}
 
     m = wr.merchant
     acc = wr.account
@@ -31,37 +42,115 @@ def dispatch_settlement(self, withdrawal_id: str):
         'amount': str(amt),
         'bank_account': m.bank_account,
     }
-    headers = {
-        'Authorization': f"Bearer {settings.INTERNAL_TOKEN}",
-        'Content-Type': 'application/json',
-    }
 
     # Call settlement service with retries on transient errors
     try:
-        resp = requests.post(settings.SETTLEMENT_URL, json=body, headers=headers, timeout=SESSION_TIMEOUT)
+        with metrics.phase('settlement.call'):
+            resp = settlement_client.settle(body)
         # For server errors, raise exception to trigger retry
         if resp.status_code >= 500:
             raise requests.RequestException(f"Upstream 5xx: {resp.status_code}")
         if resp.status_code != 200:
             # Client error: mark failed and return
-            wr.status = 'FAILED'
-            wr.save(update_fields=['status'])
+            _fail(wr, reservation_id)
             return {'status': 'FAILED', 'detail': 'Upstream error', 'code': resp.status_code}
         data = resp.json()
     except requests.RequestException:
         # When retries exhausted, mark as failed
         if self.request.retries >= self.max_retries:
-            wr.status = 'FAILED'
-            wr.save(update_fields=['status'])
+            _fail(wr, reservation_id)
         raise
 
     # Perform credit consumption and finalize transaction in a DB transaction
-    with transaction.atomic():
+    with metrics.phase('settlement.finalize'), transaction.atomic():
         wr = WithdrawalRequest.objects.select_for_update().get(id=withdrawal_id)
         if wr.status == 'SUCCESS':
             return {'status': 'SUCCESS', 'bank_reference': wr.bank_reference}
-        tx_id = atomic_consume_credit(m, acc, amt)
-        wr.status = 'SUCCESS'
-        wr.bank_reference = data.get('bank_reference', '')
+        hold_status = CreditHold.objects.filter(withdrawal_id=wr.id).values_list('status', flat=True).first()
+        settled = True
+        if reservation_id:
+            credit_front.commit(reservation_id, m, acc, amt)
+        elif hold_status in ('HELD', 'CAPTURED'):
+            holds.capture_hold(wr.id)
+        else:
+            # No hold, or the bank paid after the hold was released: take the credit again
+            try:
+                with transaction.atomic():
+                    atomic_consume_credit(m, acc, amt)
+            except ValueError:
+                settled = False
+        to = 'SUCCESS' if settled and wr.status not in withdrawals.FINAL else 'REVIEW'
+        if to == 'REVIEW':
+            logger.error("withdrawal %s paid by the bank but was %s (hold %s, credit retaken: %s); flagged for review",
+                         wr.id, wr.status, hold_status, settled)
+        withdrawals.advance(wr, to, bank_reference=data.get('bank_reference', ''))
         wr.save(update_fields=['status', 'bank_reference'])
-    return {'status': 'SUCCESS', 'bank_reference': wr.bank_reference}
\ No newline at end of file
+    return {'status': wr.status, 'bank_reference': wr.bank_reference}
+
+
+def _fail(wr: WithdrawalRequest, reservation_id: str | None) -> None:
+    # Status and hold release in one transaction; a row already final is left alone
+    with transaction.atomic():
+        withdrawals.transition_many([wr.id], 'FAILED')
+        holds.release_hold(wr.id)
+    if reservation_id:
+        credit_front.release(reservation_id, wr.merchant_id)
+
+
+@shared_task
+def apply_credit_reservations():
+    """Batched writer for the Redis credit front: persist settled reservations."""
+    return {'written': credit_front.apply_reservations()}
+
+
+@shared_task
+def reconcile_credit_front():
+    """Rebuild the Redis credit counters from Postgres (after restarts or drift)."""
+    return credit_front.rebuild_counters()
+
+
+@shared_task
+def release_expired_holds():
+    """Sweeper: release credit holds whose withdrawal never finished settlement."""
+    return {'released': holds.release_expired_holds()}
+
+
+@shared_task
+def dispatch_settlement_batches():
+    """Batching dispatcher: drain QUEUED withdrawals into the batch settlement endpoint."""
+    return batch_dispatch.drain()
+
+
+@shared_task
+def reap_stale_settlements():
+    """Requeue withdrawals stuck in SETTLING after their worker died; task mode re-dispatches them."""
+    stale = batch_dispatch.reap_stale_claims()
+    if not batch_dispatch.enabled():
+        for withdrawal_id, reservation_id in stale:
+            dispatch_settlement.delay(str(withdrawal_id), reservation_id=reservation_id or None)
+    return {'requeued': len(stale)}
+
+
+@shared_task
+def apply_retention():
+    """Delete or archive expired rows of every RETENTION_POLICIES table, in throttled batches."""
+    return retention.run_all()
+
+
+@shared_task
+def reconcile_ledger(full: bool = False):
+    """Incremental ledger reconciliation; the run and its discrepancy report are stored in ReconciliationRun."""
+    return reconciliation.summary(reconciliation.reconcile(full=full))
+
+
+@shared_task
+def take_balance_checkpoint():
+    """Checkpoint per-merchant and pool ledger totals for point-in-time balance lookups."""
+    cp = balances.take_checkpoint()
+    return {'through': cp.through.isoformat(), 'merchants': cp.merchants_written} if cp else {'through': None}
+
+
+@shared_task
+def maintain_partitions():
+    """Pre-create upcoming monthly partitions and detach those past PARTITION_RETENTION_MONTHS."""
+    return partitions.maintain()
@@ -0,0 +1,106 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from decimal import Decimal
+from unittest import mock
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from payments import authentication
+from payments.services import create_merchant, approve_merchant
+from payments.models import CreditPool, WithdrawalRequest
+from payments.views import MyTokenObtainPairSerializer
+from payments.utils.cache import redis_client
+
+
+def _flush_auth():
+    authentication._forget_checks()
+    r = redis_client()
+    keys = list(r.scan_iter('auth:deny:*'))
+    if keys:
+        r.delete(*keys)
+
+
+class ClaimsAuthenticationTests(TestCase):
+    def setUp(self):
+        _flush_auth()
+        self.addCleanup(_flush_auth)
+        self.m = create_merchant('jwt1', 'p', Decimal('50.00'), 'IRJ')
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('100.00'); pool.save()
+        self.client = APIClient()
+
+    def _login(self):
+        r = self.client.post('/api/v1/auth/token', {'username': 'jwt1', 'password': 'p'}, format='json')
+        self.assertEqual(r.status_code, 200)
+        return r.data
+
+    def _use(self, access):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_withdrawal_without_user_or_merchant_lookup(self):
+        approve_merchant(self.m.id, Decimal('50.00'))
+        self._use(self._login()['access'])
+        with mock.patch('payments.settlement_client.settle') as post, CaptureQueriesContext(connection) as ctx:
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = {'status': 'SUCCESS', 'bank_reference': 'BNK-J'}
+            r = self.client.post('/api/v1/withdrawals', {'amount': '5.00'}, format='json')
+        self.assertEqual(r.status_code, 200)
+        sql = ' '.join(q['sql'] for q in ctx.captured_queries)
+        self.assertNotIn('"auth_user"', sql)
+        self.assertNotIn('FROM "payments_merchant"', sql)
+        wr = WithdrawalRequest.objects.get()
+        self.assertEqual((wr.merchant_id, wr.account_id), (self.m.id, self.m.account.id))
+        self.assertEqual(post.call_args[0][0]['bank_account'], 'IRJ')
+
+    def test_logout_revokes_token(self):
+        self._use(self._login()['access'])
+        self.assertEqual(self.client.get('/api/v1/me').status_code, 200)
+        self.assertEqual(self.client.post('/api/v1/auth/logout').status_code, 204)
+        self.assertEqual(self.client.get('/api/v1/me').status_code, 401)
+
+    def test_logout_revokes_refresh_token(self):
+        tokens = self._login()
+        self._use(tokens['access'])
+        self.assertEqual(self.client.post('/api/v1/auth/logout').status_code, 204)
+        self.client.credentials()
+        r = self.client.post('/api/v1/auth/token/refresh', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(r.status_code, 401)
+
+    def test_approval_revokes_stale_claims_and_refresh_reissues(self):
+        # Issued a little while before the approval (iat has one-second resolution)
+        refresh = MyTokenObtainPairSerializer.get_token(self.m.user)
+        refresh['iat'] -= 10
+        tokens = {'refresh': str(refresh), 'access': str(refresh.access_token)}
+        self._use(tokens['access'])
+        r = self.client.post('/api/v1/withdrawals', {'amount': '5.00'}, format='json')
+        self.assertEqual(r.data['detail'], 'MERCHANT_NOT_APPROVED')
+        with self.captureOnCommitCallbacks(execute=True):
+            approve_merchant(self.m.id, Decimal('50.00'))
+        self.assertEqual(self.client.get('/api/v1/me').status_code, 401)
+
+        self.client.credentials()
+        r = self.client.post('/api/v1/auth/token/refresh', {'refresh': tokens['refresh']}, format='json')
+        self.assertEqual(r.status_code, 200)
+        self._use(r.data['access'])
+        with mock.patch('payments.settlement_client.settle') as post:
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = {'status': 'SUCCESS', 'bank_reference': 'BNK-J'}
+            self.assertEqual(self.client.post('/api/v1/withdrawals', {'amount': '5.00'}, format='json').status_code, 200)
+
+    def test_deactivating_user_revokes_tokens(self):
+        refresh = MyTokenObtainPairSerializer.get_token(self.m.user)
+        refresh['iat'] -= 10
+        self._use(str(refresh.access_token))
+        self.assertEqual(self.client.get('/api/v1/me').status_code, 200)
+        user = User.objects.get(username='jwt1')
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(self.client.get('/api/v1/me').status_code, 401)
+
+    def test_token_without_claims_uses_database_user(self):
+        user = User.objects.get(username='jwt1')
+        self._use(str(RefreshToken.for_user(user).access_token))
+        self.assertEqual(self.client.get('/api/v1/me').status_code, 200)
@@ -0,0 +1,66 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+from rest_framework.test import APIClient
+
+from payments import balances
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, LedgerEntry, atomic_consume_credit
+
+
+@override_settings(BALANCE_CHECKPOINT_LAG_S=0)
+class BalanceCheckpointTests(TestCase):
+    def setUp(self):
+        self.t0 = timezone.now() - timedelta(hours=3)
+        self.ms = []
+        for name in ('bal1', 'bal2'):
+            m = Merchant.objects.create(user=User.objects.create_user(username=name, password='p'), is_approved=True)
+            WalletAccount.objects.create(merchant=m)
+            MerchantCredit.objects.create(merchant=m, credit_limit=Decimal('100.00'))
+            self.ms.append(m)
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('100.00'); pool.save()
+        self._consume(0, '10.00', 10)
+        self._consume(0, '5.00', 70); self._consume(1, '2.00', 70)
+        self._consume(0, '1.00', 130)
+
+    def _at(self, minutes):
+        return self.t0 + timedelta(minutes=minutes)
+
+    def _consume(self, i, amount, minute):
+        m = self.ms[i]
+        tx_id = atomic_consume_credit(m, m.account, Decimal(amount))
+        LedgerEntry.objects.filter(tx_id=tx_id).update(created_at=self._at(minute))
+
+    def test_checkpoints_write_changed_merchants_only(self):
+        counts = [balances.take_checkpoint(now=self._at(m)).merchants_written for m in (60, 120, 125)]
+        self.assertEqual(counts, [1, 2, 0])
+        self.assertIsNone(balances.take_checkpoint(now=self._at(125)))
+
+    def test_point_in_time_from_nearest_checkpoint(self):
+        for m in (60, 120, 125):
+            balances.take_checkpoint(now=self._at(m))
+        m1, m2 = self.ms
+        cases = [(m1, 30, '10.00', None, 1), (m1, 65, '10.00', 60, 0), (m1, 75, '15.00', 60, 1),
+                 (m1, 140, '16.00', 120, 1), (m2, 140, '2.00', 120, 0)]
+        for m, minute, amount, through, entries in cases:
+            got = balances.merchant_balance_at(m.id, self._at(minute))
+            expected_through = self._at(through) if through is not None else None
+            self.assertEqual((got['utilized_amount'], got['checkpoint_through'], got['delta_entries']),
+                             (amount, expected_through, entries), (m.id, minute))
+        pool = balances.pool_balance_at(self._at(140))
+        self.assertEqual((pool['consumed_amount'], pool['delta_entries']), ('18.00', 1))
+
+    def test_admin_endpoint(self):
+        balances.take_checkpoint(now=self._at(60))
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username='auditor', password='p', is_staff=True))
+        r = client.get('/api/v1/admin/balances/at', {'at': self._at(75).isoformat(), 'merchant_id': self.ms[0].id})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual((r.data['merchant']['utilized_amount'], r.data['pool']['consumed_amount']), ('15.00', '17.00'))
+        self.assertEqual(client.get('/api/v1/admin/balances/at', {'at': 'noon'}).status_code, 400)
+        r = client.get('/api/v1/admin/balances/at', {'at': self._at(75).isoformat(), 'merchant_id': 999999})
+        self.assertEqual(r.status_code, 404)
+        client.force_authenticate(self.ms[0].user)
+        self.assertEqual(client.get('/api/v1/admin/balances/at', {'at': self._at(75).isoformat()}).status_code, 403)
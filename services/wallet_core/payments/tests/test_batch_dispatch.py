@@ -0,0 +1,132 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+import os
+from rest_framework.test import APIClient
+
+from payments import batch_dispatch, holds
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, CreditHold, LedgerEntry, WithdrawalRequest
+
+
+def _ok(items, timeout=None):
+    resp = mock.Mock(status_code=200)
+    resp.json.return_value = {'results': [
+        {'ref': i['ref'], 'status': 'SUCCESS', 'bank_reference': f"BNK-{i['amount']}"} for i in items
+    ]}
+    return resp
+
+
+@override_settings(SETTLEMENT_DISPATCH='batch')
+class BatchDispatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='b1', password='p')
+        self.m = Merchant.objects.create(user=self.user, is_approved=True, requested_credit=Decimal('100.00'), bank_account='IRB')
+        self.acc = WalletAccount.objects.create(merchant=self.m)
+        MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('100.00'))
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('100.00'); pool.save()
+
+    def _queued(self, *amounts):
+        out = []
+        for a in amounts:
+            wr = WithdrawalRequest.objects.create(merchant=self.m, account=self.acc, amount=Decimal(a), status='QUEUED')
+            holds.hold_credit(wr)
+            out.append(wr)
+        return out
+
+    def _balances(self):
+        return MerchantCredit.objects.get(merchant=self.m).utilized_amount, CreditPool.get_solo().available_amount
+
+    def test_one_call_per_batch_and_all_captured(self):
+        self._queued('1.00', '2.00', '3.00', '4.00', '5.00')
+        with mock.patch('payments.settlement_client.settle_batch', side_effect=_ok) as call:
+            totals = batch_dispatch.drain(batch_size=2, max_seconds=60)
+        self.assertEqual(call.call_count, 3)
+        self.assertEqual(totals, {'batches': 3, 'success': 5, 'failed': 0, 'review': 0, 'requeued': 0})
+        self.assertEqual(set(WithdrawalRequest.objects.values_list('status', flat=True)), {'SUCCESS'})
+        self.assertEqual(WithdrawalRequest.objects.get(amount=Decimal('3.00')).bank_reference, 'BNK-3.00')
+        self.assertEqual(set(CreditHold.objects.values_list('status', flat=True)), {'CAPTURED'})
+        self.assertEqual(LedgerEntry.objects.count(), 10)
+        self.assertEqual(self._balances(), (Decimal('15.00'), Decimal('85.00')))
+
+    def test_rejected_item_releases_its_hold(self):
+        good, bad = self._queued('10.00', '20.00')
+
+        def partial(items, timeout=None):
+            resp = _ok(items)
+            for r in resp.json.return_value['results']:
+                if r['ref'] == str(bad.id):
+                    r.update(status='REJECTED', bank_reference='')
+            return resp
+
+        with mock.patch('payments.settlement_client.settle_batch', side_effect=partial):
+            self.assertEqual(batch_dispatch.drain(), {'batches': 1, 'success': 1, 'failed': 1, 'review': 0, 'requeued': 0})
+        self.assertEqual(WithdrawalRequest.objects.get(id=bad.id).status, 'FAILED')
+        self.assertEqual(CreditHold.objects.get(withdrawal=bad).status, 'RELEASED')
+        self.assertEqual(self._balances(), (Decimal('10.00'), Decimal('90.00')))
+
+    def test_upstream_5xx_requeues_batch(self):
+        self._queued('1.00', '2.00')
+        with mock.patch('payments.settlement_client.settle_batch') as call:
+            call.return_value.status_code = 503
+            self.assertEqual(batch_dispatch.drain()['requeued'], 2)
+        self.assertEqual(set(WithdrawalRequest.objects.values_list('status', flat=True)), {'QUEUED'})
+        self.assertEqual(set(CreditHold.objects.values_list('status', flat=True)), {'HELD'})
+
+    def test_4xx_fails_only_the_items_it_names(self):
+        good, bad = self._queued('10.00', '20.00')
+        with mock.patch('payments.settlement_client.settle_batch') as call:
+            call.return_value.status_code = 422
+            call.return_value.json.return_value = {'detail': [{'loc': ['body', 'items', 1, 'amount'], 'msg': 'bad'}]}
+            self.assertEqual(batch_dispatch.drain(), {'batches': 1, 'success': 0, 'failed': 1, 'review': 0, 'requeued': 1})
+        self.assertEqual(WithdrawalRequest.objects.get(id=bad.id).status, 'FAILED')
+        self.assertEqual(CreditHold.objects.get(withdrawal=bad).status, 'RELEASED')
+        self.assertEqual(WithdrawalRequest.objects.get(id=good.id).status, 'QUEUED')
+        self.assertEqual(CreditHold.objects.get(withdrawal=good).status, 'HELD')
+
+    def test_items_missing_from_the_answer_are_requeued(self):
+        answered, missing = self._queued('10.00', '20.00')
+
+        def partial(items, timeout=None):
+            return _ok([i for i in items if i['ref'] == str(answered.id)])
+
+        with mock.patch('payments.settlement_client.settle_batch', side_effect=partial):
+            self.assertEqual(batch_dispatch.drain(), {'batches': 1, 'success': 1, 'failed': 0, 'review': 0, 'requeued': 1})
+        wr = WithdrawalRequest.objects.get(id=missing.id)
+        self.assertEqual((wr.status, wr.claimed_at), ('QUEUED', None))
+        self.assertEqual(CreditHold.objects.get(withdrawal=missing).status, 'HELD')
+
+    def test_success_without_credit_goes_to_review(self):
+        wr = WithdrawalRequest.objects.create(merchant=self.m, account=self.acc, amount=Decimal('50.00'), status='QUEUED')
+        MerchantCredit.objects.filter(merchant=self.m).update(utilized_amount=Decimal('80.00'))
+        with mock.patch('payments.settlement_client.settle_batch', side_effect=_ok):
+            self.assertEqual(batch_dispatch.drain(), {'batches': 1, 'success': 0, 'failed': 0, 'review': 1, 'requeued': 0})
+        wr.refresh_from_db()
+        self.assertEqual((wr.status, wr.bank_reference), ('REVIEW', 'BNK-50.00'))
+        self.assertEqual(LedgerEntry.objects.count(), 0)
+
+    def test_reaper_requeues_stale_claims(self):
+        stale, fresh = self._queued('1.00', '2.00')
+        batch_dispatch.claim(10)
+        WithdrawalRequest.objects.filter(id=stale.id).update(claimed_at=timezone.now() - timedelta(hours=1))
+        reaped = batch_dispatch.reap_stale_claims(max_age_s=60)
+        self.assertEqual([wid for wid, _ in reaped], [stale.id])
+        self.assertEqual(WithdrawalRequest.objects.get(id=stale.id).status, 'QUEUED')
+        self.assertIsNone(WithdrawalRequest.objects.get(id=stale.id).claimed_at)
+        self.assertEqual(WithdrawalRequest.objects.get(id=fresh.id).status, 'SETTLING')
+
+    def test_view_queues_without_task_message(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch.dict(os.environ, {'ASYNC_SETTLEMENT': '1'}), \
+                mock.patch('payments.views.dispatch_settlement.delay') as delay:
+            r = client.post('/api/v1/withdrawals', {'amount': '7.00'}, format='json')
+        self.assertEqual(r.status_code, 202)
+        delay.assert_not_called()
+        self.assertEqual(WithdrawalRequest.objects.get(id=r.data['withdrawal_id']).status, 'QUEUED')
+        with mock.patch('payments.settlement_client.settle_batch', side_effect=_ok):
+            batch_dispatch.drain()
+        self.assertEqual(WithdrawalRequest.objects.get(id=r.data['withdrawal_id']).status, 'SUCCESS')
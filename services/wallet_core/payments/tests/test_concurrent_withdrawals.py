@@ -1,4 +1,4 @@
-from django.test import TransactionTestCase
+from django.test import TransactionTestCase, override_settings
 from django.contrib.auth import get_user_model
 from decimal import Decimal
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -78,3 +78,69 @@ class ConcurrentWithdrawalTests(TransactionTestCase):
         self.assertEqual(self.credit.utilized_amount, Decimal("10.00"))
         self.assertEqual(self.pool.available_amount, Decimal("990.00"))
         self.assertGreaterEqual(self.credit.credit_limit - self.credit.utilized_amount, Decimal("0.00"))
+
+
+class StripedPoolThroughputTests(TransactionTestCase):
+    """
+    چند پذیرنده به‌صورت همزمان از استخر برداشت می‌کنند؛ یک بار با یک ردیف
+    و یک بار با استخر چندبخشی (striped). مجموع استخر و سهم هر بخش نباید
+    منفی شود. مقایسهٔ توان عملیاتی در tests/bench/bench_consume_engines.py است.
+    """
+    reset_sequences = True
+    merchants = 8
+    per_merchant = 10
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            connections.close_all()
+        finally:
+            super().tearDownClass()
+
+    def setUp(self):
+        User = get_user_model()
+        self.pairs = []
+        for i in range(self.merchants):
+            u = User.objects.create_user(username=f"stripe_{i}", password="p", is_active=True)
+            m = Merchant.objects.create(user=u, is_approved=True, requested_credit=Decimal("100.00"))
+            acc = WalletAccount.objects.create(merchant=m)
+            MerchantCredit.objects.create(merchant=m, credit_limit=Decimal("100.00"))
+            self.pairs.append((m, acc))
+
+    def _worker(self, merchant, account, barrier: threading.Barrier):
+        close_old_connections()
+        barrier.wait()
+        ok = 0
+        try:
+            for _ in range(self.per_merchant):
+                atomic_consume_credit(merchant, account, Decimal("1.00"))
+                ok += 1
+            return ok
+        finally:
+            try: connection.close()
+            except Exception: pass
+
+    def _run(self, stripes: int) -> None:
+        with override_settings(CREDIT_POOL_STRIPES=stripes):
+            CreditPool.objects.all().delete()
+            CreditPool.topup(Decimal("1000.00"))
+            barrier = threading.Barrier(self.merchants)
+            with ThreadPoolExecutor(max_workers=self.merchants) as ex:
+                futs = [ex.submit(self._worker, m, acc, barrier) for m, acc in self.pairs]
+                done = sum(f.result() for f in as_completed(futs))
+
+            total = self.merchants * self.per_merchant
+            self.assertEqual(done, total)
+            self.assertEqual(CreditPool.total_available(), Decimal("1000.00") - total)
+            self.assertFalse(CreditPool.objects.filter(available_amount__lt=0).exists())
+        MerchantCredit.objects.update(utilized_amount=Decimal("0.00"))
+
+    def test_pool_never_overdraws_by_stripe_count(self):
+        for stripes in (1, 4, 8):
+            with self.subTest(stripes=stripes):
+                self._run(stripes)
+
+
+@override_settings(CREDIT_ENGINE='sql')
+class SqlEngineConcurrentWithdrawalTests(ConcurrentWithdrawalTests):
+    """همان سناریوی ۲۰ برداشت همزمان با موتور تک‌دستوری (CTE)."""
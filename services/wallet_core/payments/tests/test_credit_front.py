@@ -0,0 +1,93 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from decimal import Decimal
+from unittest import mock
+from rest_framework.test import APIClient
+
+from payments import credit_front
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, LedgerEntry
+from payments.utils.cache import redis_client, credit_avail_key, CREDIT_POOL_KEY
+
+
+def _flush_front():
+    r = redis_client()
+    keys = list(r.scan_iter('credit:*'))
+    if keys:
+        r.delete(*keys)
+
+
+@override_settings(CREDIT_RESERVATION_FRONT=True)
+class CreditFrontTests(TestCase):
+    def setUp(self):
+        _flush_front()
+        self.addCleanup(_flush_front)
+        self.user = User.objects.create_user(username='f1', password='p')
+        self.m = Merchant.objects.create(user=self.user, is_approved=True, requested_credit=Decimal('10.00'), bank_account='IRF')
+        self.acc = WalletAccount.objects.create(merchant=self.m)
+        MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('10.00'))
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('100.00'); pool.save()
+
+    def test_bypass_until_counters_built(self):
+        self.assertEqual(credit_front.reserve(self.m, Decimal('1.00')), ('BYPASS', None))
+
+    def test_reserve_rejects_without_touching_db(self):
+        credit_front.rebuild_counters()
+        with self.assertNumQueries(0):
+            verdict, rid = credit_front.reserve(self.m, Decimal('6.00'))
+            self.assertEqual(verdict, 'OK')
+            self.assertEqual(credit_front.reserve(self.m, Decimal('6.00')), ('INSUFFICIENT_MERCHANT_CREDIT', None))
+        redis_client().set(CREDIT_POOL_KEY, 100)
+        self.assertEqual(credit_front.reserve(self.m, Decimal('2.00'))[0], 'INSUFFICIENT_POOL')
+
+    def test_release_restores_counters(self):
+        credit_front.rebuild_counters()
+        _, rid = credit_front.reserve(self.m, Decimal('6.00'))
+        credit_front.release(rid, self.m.id)
+        self.assertEqual(int(redis_client().get(credit_avail_key(self.m.id))), 1000)
+        self.assertEqual(credit_front.reserve(self.m, Decimal('10.00'))[0], 'OK')
+
+    def test_writer_applies_committed_reservations_in_batch(self):
+        credit_front.rebuild_counters()
+        tx_ids = []
+        for _ in range(3):
+            _, rid = credit_front.reserve(self.m, Decimal('2.00'))
+            tx_ids.append(credit_front.commit(rid, self.m, self.acc, Decimal('2.00')))
+        self.assertEqual(credit_front.apply_reservations(), 3)
+        self.assertEqual(MerchantCredit.objects.get(merchant=self.m).utilized_amount, Decimal('6.00'))
+        self.assertEqual(CreditPool.get_solo().available_amount, Decimal('94.00'))
+        self.assertEqual(set(LedgerEntry.objects.values_list('tx_id', flat=True)), set(tx_ids))
+        # Re-running (e.g. after a crash mid-ack) must not double-apply
+        self.assertEqual(credit_front.apply_reservations(), 0)
+
+    def test_rebuild_accounts_for_unapplied_reservations(self):
+        credit_front.rebuild_counters()
+        _, rid = credit_front.reserve(self.m, Decimal('4.00'))
+        redis_client().delete(credit_avail_key(self.m.id), CREDIT_POOL_KEY)
+        stats = credit_front.rebuild_counters()
+        self.assertEqual(stats['pending_cents'], 400)
+        self.assertEqual(int(redis_client().get(credit_avail_key(self.m.id))), 600)
+        self.assertEqual(int(redis_client().get(CREDIT_POOL_KEY)), 9600)
+
+    def test_view_rejects_over_limit_before_settlement(self):
+        credit_front.rebuild_counters()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch('payments.settlement_client.settle') as post:
+            r = client.post('/api/v1/withdrawals', {'amount': '11.00'}, format='json')
+        self.assertEqual(r.status_code, 409)
+        self.assertEqual(r.data['detail'], 'INSUFFICIENT_MERCHANT_CREDIT')
+        post.assert_not_called()
+
+    def test_view_success_is_persisted_by_writer(self):
+        credit_front.rebuild_counters()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch('payments.settlement_client.settle') as post:
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = {'status': 'SUCCESS', 'bank_reference': 'BNK-1'}
+            r = client.post('/api/v1/withdrawals', {'amount': '3.00'}, format='json')
+        self.assertEqual(r.status_code, 200)
+        self.assertFalse(LedgerEntry.objects.exists())
+        credit_front.apply_reservations()
+        self.assertEqual(LedgerEntry.objects.filter(tx_id=r.data['tx_id']).count(), 2)
@@ -0,0 +1,67 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from decimal import Decimal
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+from rest_framework.test import APIClient
+
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, WithdrawalRequest, atomic_consume_credit
+
+
+@override_settings(EXPORT_CHUNK_SIZE=2)
+class ExportTests(TestCase):
+    def setUp(self):
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('100.00'); pool.save()
+        self.ms = []
+        for name in ('exp1', 'exp2'):
+            m = Merchant.objects.create(user=User.objects.create_user(username=name, password='p'), is_approved=True)
+            WalletAccount.objects.create(merchant=m)
+            MerchantCredit.objects.create(merchant=m, credit_limit=Decimal('50.00'))
+            self.ms.append(m)
+        for m, amount in ((self.ms[0], '1.00'), (self.ms[1], '2.00'), (self.ms[0], '3.00')):
+            atomic_consume_credit(m, m.account, Decimal(amount))
+            WithdrawalRequest.objects.create(merchant=m, account=m.account, amount=Decimal(amount), status='SUCCESS')
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username='finance', password='p', is_staff=True))
+
+    def _get(self, kind, **params):
+        r = self.client.get(f'/api/v1/admin/export/{kind}', params)
+        self.assertEqual(r.status_code, 200)
+        return r, b''.join(r.streaming_content)
+
+    def test_ndjson_in_order_and_resumable(self):
+        r, body = self._get('ledger')
+        self.assertEqual(r['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual([x['amount'] for x in rows[::2]], ['1.00', '2.00', '3.00'])
+        self.assertEqual(rows, sorted(rows, key=lambda x: (x['created_at'], x['id'])))
+        _, rest = self._get('ledger', after_created_at=rows[2]['created_at'], after_id=rows[2]['id'])
+        self.assertEqual([json.loads(line) for line in rest.decode().splitlines()], rows[3:])
+        _, mine = self._get('ledger', merchant_id=self.ms[1].id)
+        self.assertEqual(len(mine.decode().splitlines()), 2)
+
+    def test_gzipped_csv(self):
+        r, body = self._get('withdrawals', fmt='csv', gzip='true')
+        self.assertEqual((r['Content-Type'], r['Content-Disposition']), ('application/gzip', 'attachment; filename="withdrawals.csv.gz"'))
+        rows = list(csv.DictReader(io.StringIO(gzip.decompress(body).decode())))
+        self.assertEqual([x['amount'] for x in rows], ['1.00', '2.00', '3.00'])
+        self.assertEqual(rows[1]['merchant_id'], str(self.ms[1].id))
+
+    def test_access_and_command(self):
+        self.assertEqual(self.client.get('/api/v1/admin/export/users').status_code, 404)
+        self.assertEqual(self.client.get('/api/v1/admin/export/ledger', {'after_id': self.ms[0].account.id}).status_code, 400)
+        self.client.force_authenticate(self.ms[0].user)
+        self.assertEqual(self.client.get('/api/v1/admin/export/ledger').status_code, 403)
+        fd, path = tempfile.mkstemp(suffix='.ndjson.gz')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        call_command('export_rows', 'withdrawals', '--gzip', '--output', path)
+        with gzip.open(path, 'rt') as f:
+            self.assertEqual(len(f.readlines()), 3)
@@ -0,0 +1,144 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.db import connections, close_old_connections, connection
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, LedgerEntry, atomic_consume_credit
+from payments.group_commit import ConsumeRequest, apply_batch, get_committer, serve_group_commit
+from payments.utils.cache import redis_client
+
+
+def _merchant(username, limit):
+    u = get_user_model().objects.create_user(username=username, password='x')
+    m = Merchant.objects.create(user=u, is_approved=True, requested_credit=limit)
+    acc = WalletAccount.objects.create(merchant=m)
+    MerchantCredit.objects.create(merchant=m, credit_limit=limit)
+    return m, acc
+
+
+class ApplyBatchTests(TestCase):
+    def setUp(self):
+        self.m1, self.a1 = _merchant('g1', Decimal('10.00'))
+        self.m2, self.a2 = _merchant('g2', Decimal('100.00'))
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('50.00'); pool.save()
+
+    def test_per_request_results_match_locking_semantics(self):
+        batch = [
+            ConsumeRequest(self.m1.id, self.a1.id, Decimal('6.00')),
+            ConsumeRequest(self.m1.id, self.a1.id, Decimal('6.00')),   # merchant limit
+            ConsumeRequest(self.m2.id, self.a2.id, Decimal('40.00')),
+            ConsumeRequest(self.m2.id, self.a2.id, Decimal('10.00')),  # pool has 4.00 left
+            ConsumeRequest(self.m1.id, self.a1.id, Decimal('4.00')),
+        ]
+        apply_batch(batch)
+        self.assertIsNotNone(batch[0].tx_id)
+        self.assertEqual(str(batch[1].error), 'INSUFFICIENT_MERCHANT_CREDIT')
+        self.assertIsNotNone(batch[2].tx_id)
+        self.assertEqual(str(batch[3].error), 'INSUFFICIENT_POOL')
+        self.assertIsNotNone(batch[4].tx_id)
+        self.assertEqual(CreditPool.get_solo().available_amount, Decimal('0.00'))
+        self.assertEqual(MerchantCredit.objects.get(merchant=self.m1).utilized_amount, Decimal('10.00'))
+        self.assertEqual(LedgerEntry.objects.count(), 6)
+
+    @override_settings(CREDIT_POOL_STRIPES=2)
+    def test_striped_pool_debits_across_stripes(self):
+        CreditPool.objects.all().delete()
+        CreditPool.topup(Decimal('50.00'))
+        batch = [ConsumeRequest(self.m2.id, self.a2.id, Decimal('40.00'))]
+        apply_batch(batch)
+        self.assertIsNone(batch[0].error)
+        self.assertEqual(CreditPool.total_available(), Decimal('10.00'))
+        self.assertFalse(CreditPool.objects.filter(available_amount__lt=0).exists())
+
+
+    def test_expired_request_is_dropped_and_peers_commit(self):
+        batch = [
+            ConsumeRequest(self.m2.id, self.a2.id, Decimal('5.00'), deadline=time.time() - 1),
+            ConsumeRequest(self.m2.id, self.a2.id, Decimal('7.00'), deadline=time.time() + 60),
+        ]
+        apply_batch(batch)
+        self.assertEqual(str(batch[0].error), 'GROUP_COMMIT_TIMEOUT')
+        self.assertIsNone(batch[0].tx_id)
+        self.assertIsNotNone(batch[1].tx_id)
+        self.assertEqual(CreditPool.get_solo().available_amount, Decimal('43.00'))
+        self.assertEqual(LedgerEntry.objects.count(), 2)
+
+    def test_unexpected_error_fails_only_its_request(self):
+        batch = [
+            ConsumeRequest(self.m1.id, self.a1.id, Decimal('1.00')),
+            ConsumeRequest(self.m2.id, 'not-a-uuid', Decimal('2.00')),
+        ]
+        apply_batch(batch)
+        self.assertIsNotNone(batch[0].tx_id)
+        self.assertIsNone(batch[0].error)
+        self.assertIsNotNone(batch[1].error)
+        self.assertEqual(CreditPool.get_solo().available_amount, Decimal('49.00'))
+
+@override_settings(CREDIT_ENGINE='group', GROUP_COMMIT_WINDOW_MS=20.0)
+class GroupCommitConcurrencyTests(TransactionTestCase):
+    reset_sequences = True
+
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            connections.close_all()
+        finally:
+            super().tearDownClass()
+
+    def setUp(self):
+        self.merchant, self.account = _merchant('gc_race', Decimal('10.00'))
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('1000.00'); pool.save()
+
+    def _worker(self, barrier):
+        close_old_connections()
+        barrier.wait()
+        try:
+            atomic_consume_credit(self.merchant, self.account, Decimal('1.00'))
+            return 'ok'
+        except ValueError as e:
+            return str(e)
+        finally:
+            try: connection.close()
+            except Exception: pass
+
+    def test_concurrent_callers_share_transactions(self):
+        committer = get_committer()
+        batches_before = committer.batches
+        attempts = 20
+        barrier = threading.Barrier(attempts)
+        with ThreadPoolExecutor(max_workers=attempts) as ex:
+            results = list(ex.map(lambda _: self._worker(barrier), range(attempts)))
+
+        self.assertEqual(results.count('ok'), 10)
+        self.assertEqual(results.count('INSUFFICIENT_MERCHANT_CREDIT'), 10)
+        self.assertLess(committer.batches - batches_before, attempts)
+        self.assertEqual(MerchantCredit.objects.get(merchant=self.merchant).utilized_amount, Decimal('10.00'))
+        self.assertEqual(CreditPool.get_solo().available_amount, Decimal('990.00'))
+        self.assertEqual(LedgerEntry.objects.count(), 20)
+
+    @override_settings(GROUP_COMMIT_TRANSPORT='redis', GROUP_COMMIT_QUEUE_KEY='gc:test')
+    def test_redis_transport_round_trip(self):
+        redis_client().delete('gc:test')
+        stop = threading.Event()
+
+        def serve():
+            try:
+                serve_group_commit(stop)
+            finally:
+                connection.close()
+
+        server = threading.Thread(target=serve, daemon=True)
+        server.start()
+        try:
+            atomic_consume_credit(self.merchant, self.account, Decimal('4.00'))
+            with self.assertRaisesMessage(ValueError, 'INSUFFICIENT_MERCHANT_CREDIT'):
+                atomic_consume_credit(self.merchant, self.account, Decimal('7.00'))
+        finally:
+            stop.set()
+            server.join(timeout=5)
+        self.assertEqual(MerchantCredit.objects.get(merchant=self.merchant).utilized_amount, Decimal('4.00'))
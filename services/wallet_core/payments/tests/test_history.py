@@ -0,0 +1,114 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+import json
+from rest_framework.test import APIClient
+
+from payments.history import encode_cursor
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, WithdrawalRequest, atomic_consume_credit
+from payments.partitions import month_start, partition_name
+
+
+def _plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from _plan_nodes(child)
+
+
+class HistoryApiTests(TestCase):
+    def setUp(self):
+        self.t0 = timezone.now() - timedelta(hours=1)
+        self.m = self._merchant('hist1')
+        self.other = self._merchant('hist2')
+        self.client = APIClient()
+        self.client.force_authenticate(self.m.user)
+
+    def _merchant(self, name):
+        m = Merchant.objects.create(user=User.objects.create_user(username=name, password='p'), is_approved=True)
+        WalletAccount.objects.create(merchant=m)
+        MerchantCredit.objects.create(merchant=m, credit_limit=Decimal('100.00'))
+        return m
+
+    def _withdrawals(self, m, n, status='SUCCESS', minute=0):
+        out = []
+        for i in range(n):
+            wr = WithdrawalRequest.objects.create(merchant=m, account=m.account, amount=Decimal('1.00') + i, status=status)
+            WithdrawalRequest.objects.filter(id=wr.id).update(created_at=self.t0 + timedelta(minutes=minute + i // 2))
+            out.append(wr.id)
+        return out
+
+    def _all_pages(self, path, **params):
+        ids, cursor, pages = [], None, 0
+        while True:
+            r = self.client.get(path, {**params, **({'cursor': cursor} if cursor else {})})
+            self.assertEqual(r.status_code, 200, r.data)
+            ids += [row['id'] for row in r.data['results']]
+            pages += 1
+            cursor = r.data['next_cursor']
+            if not cursor:
+                return ids, pages
+
+    def test_pages_cover_every_row_once_newest_first(self):
+        # Pairs share created_at, so ordering relies on the id tie-breaker
+        self._withdrawals(self.m, 7)
+        self._withdrawals(self.other, 3)
+        ids, pages = self._all_pages('/api/v1/withdrawals', limit=3)
+        expected = [str(i) for i in WithdrawalRequest.objects.filter(merchant=self.m)
+                    .order_by('-created_at', '-id').values_list('id', flat=True)]
+        self.assertEqual((ids, pages), (expected, 3))
+
+    def test_filters_cap_and_errors(self):
+        self._withdrawals(self.m, 4)
+        failed = self._withdrawals(self.m, 2, status='FAILED', minute=10)
+        r = self.client.get('/api/v1/withdrawals', {'status': 'FAILED'})
+        self.assertEqual({row['id'] for row in r.data['results']}, {str(i) for i in failed})
+        r = self.client.get('/api/v1/withdrawals', {'created_from': self.t0.isoformat(),
+                                                     'created_to': (self.t0 + timedelta(minutes=1)).isoformat()})
+        self.assertEqual(len(r.data['results']), 2)
+        with override_settings(HISTORY_MAX_PAGE_SIZE=5):
+            r = self.client.get('/api/v1/withdrawals', {'limit': 10000})
+        self.assertEqual((len(r.data['results']), r.data['next_cursor'] is not None), (5, True))
+        self.assertEqual(self.client.get('/api/v1/withdrawals', {'cursor': 'nope'}).data['detail'], 'INVALID_CURSOR')
+        self.client.force_authenticate(User.objects.create_user(username='hist-staff', password='p', is_staff=True))
+        self.assertEqual(self.client.get('/api/v1/withdrawals').status_code, 404)
+
+    def test_ledger_history(self):
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('100.00'); pool.save()
+        for amount in ('1.00', '2.00', '3.00'):
+            atomic_consume_credit(self.m, self.m.account, Decimal(amount))
+        ids, pages = self._all_pages('/api/v1/ledger', limit=2, direction='CREDIT')
+        self.assertEqual((len(ids), pages), (3, 2))
+        r = self.client.get('/api/v1/ledger', {'limit': 1})
+        self.assertEqual(r.data['results'][0]['amount'], '3.00')
+
+    def test_deep_page_reads_only_one_page_of_index(self):
+        for m in (self.m, self.other):
+            WithdrawalRequest.objects.bulk_create(
+                [WithdrawalRequest(merchant=m, account=m.account, amount=Decimal('1.00')) for _ in range(1500)])
+        with connection.cursor() as cur:
+            cur.execute('ANALYZE payments_withdrawalrequest')
+        deep = WithdrawalRequest.objects.filter(merchant=self.m).order_by('-created_at', '-id')[1200]
+        with CaptureQueriesContext(connection) as ctx:
+            r = self.client.get('/api/v1/withdrawals', {'limit': 50, 'cursor': encode_cursor(deep.created_at, deep.id)})
+        self.assertEqual(len(r.data['results']), 50)
+        sql = next(q['sql'] for q in ctx.captured_queries if 'ORDER BY' in q['sql'])
+        with connection.cursor() as cur:
+            cur.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql)
+            plan = cur.fetchone()[0]
+        plan = plan if isinstance(plan, list) else json.loads(plan)
+        nodes = list(_plan_nodes(plan[0]['Plan']))
+        types = {n['Node Type'] for n in nodes}
+        self.assertNotIn('Seq Scan', types)
+        self.assertNotIn('Sort', types)
+        scans = [n for n in nodes if n['Node Type'] in ('Index Scan', 'Index Only Scan')]
+        # The populated partition seeks the merchant index; empty ones may pick any index
+        live = partition_name('payments_withdrawalrequest', month_start(deep.created_at))
+        self.assertTrue(scans and all('merchant_id' in n.get('Index Cond', '')
+                                      for n in scans if n['Relation Name'] == live), scans)
+        # Constant cost: the index yields one page (+1 look-ahead), not the 1200 rows before the cursor
+        self.assertLessEqual(sum(n['Actual Rows'] for n in scans), 51)
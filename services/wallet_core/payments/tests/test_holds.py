@@ -0,0 +1,144 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from rest_framework.test import APIClient
+
+from payments import holds, tasks, withdrawals
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, CreditHold, LedgerEntry, WithdrawalRequest
+
+
+class CreditHoldTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='h1', password='p')
+        self.m = Merchant.objects.create(user=self.user, is_approved=True, requested_credit=Decimal('50.00'), bank_account='IRH')
+        self.acc = WalletAccount.objects.create(merchant=self.m)
+        MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('50.00'))
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('100.00'); pool.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _wr(self, amount):
+        return WithdrawalRequest.objects.create(merchant=self.m, account=self.acc, amount=Decimal(amount))
+
+    def _balances(self):
+        return MerchantCredit.objects.get(merchant=self.m).utilized_amount, CreditPool.get_solo().available_amount
+
+    def test_hold_capture_release_cycle(self):
+        wr = self._wr('20.00')
+        holds.hold_credit(wr)
+        self.assertEqual(self._balances(), (Decimal('20.00'), Decimal('80.00')))
+        self.assertFalse(LedgerEntry.objects.exists())
+        tx_id = holds.capture_hold(wr.id)
+        self.assertEqual(holds.capture_hold(wr.id), tx_id)
+        self.assertEqual(LedgerEntry.objects.filter(tx_id=tx_id).count(), 2)
+        self.assertFalse(holds.release_hold(wr.id))
+
+        wr2 = self._wr('10.00')
+        holds.hold_credit(wr2)
+        self.assertTrue(holds.release_hold(wr2.id))
+        self.assertFalse(holds.release_hold(wr2.id))
+        self.assertEqual(self._balances(), (Decimal('20.00'), Decimal('80.00')))
+        with self.assertRaisesMessage(ValueError, 'HOLD_RELEASED'):
+            holds.capture_hold(wr2.id)
+
+    def test_over_limit_rejected_before_settlement(self):
+        with mock.patch('payments.settlement_client.settle') as post:
+            r = self.client.post('/api/v1/withdrawals', {'amount': '60.00'}, format='json')
+        self.assertEqual(r.status_code, 409)
+        self.assertEqual(r.data['detail'], 'INSUFFICIENT_MERCHANT_CREDIT')
+        post.assert_not_called()
+        self.assertEqual(WithdrawalRequest.objects.get().status, 'FAILED')
+
+    def test_settlement_failure_releases_hold(self):
+        with mock.patch('payments.settlement_client.settle') as post:
+            post.return_value.status_code = 503
+            post.return_value.text = 'unavailable'
+            r = self.client.post('/api/v1/withdrawals', {'amount': '15.00'}, format='json')
+        self.assertEqual(r.status_code, 502)
+        self.assertEqual(CreditHold.objects.get().status, 'RELEASED')
+        self.assertEqual(self._balances(), (Decimal('0.00'), Decimal('100.00')))
+
+    def test_settlement_failure_after_sweep_keeps_swept_state(self):
+        def swept(body):
+            # The sweeper fails the row while the bank call is in flight
+            wr = WithdrawalRequest.objects.get()
+            holds.release_hold(wr.id)
+            withdrawals.transition_many([wr.id], 'FAILED')
+            return mock.Mock(status_code=503, text='unavailable')
+
+        with mock.patch('payments.settlement_client.settle', side_effect=swept):
+            r = self.client.post('/api/v1/withdrawals', {'amount': '15.00'}, format='json')
+        self.assertEqual(r.status_code, 502)
+        self.assertEqual(WithdrawalRequest.objects.get().status, 'FAILED')
+        self.assertEqual(self._balances(), (Decimal('0.00'), Decimal('100.00')))
+
+    def test_settlement_success_captures_hold(self):
+        with mock.patch('payments.settlement_client.settle') as post:
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = {'status': 'SUCCESS', 'bank_reference': 'BNK-9'}
+            r = self.client.post('/api/v1/withdrawals', {'amount': '15.00'}, format='json')
+        self.assertEqual(r.status_code, 200)
+        hold = CreditHold.objects.get()
+        self.assertEqual((hold.status, str(hold.tx_id)), ('CAPTURED', r.data['tx_id']))
+        self.assertEqual(self._balances(), (Decimal('15.00'), Decimal('85.00')))
+
+    def test_sweeper_releases_expired_holds(self):
+        stale, fresh = self._wr('5.00'), self._wr('7.00')
+        holds.hold_credit(stale)
+        holds.hold_credit(fresh)
+        CreditHold.objects.filter(withdrawal=stale).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(holds.release_expired_holds(), 1)
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'FAILED')
+        self.assertEqual(self._balances(), (Decimal('7.00'), Decimal('93.00')))
+
+    def test_sweeper_skips_withdrawals_in_settlement(self):
+        wr = self._wr('5.00')
+        holds.hold_credit(wr)
+        WithdrawalRequest.objects.filter(id=wr.id).update(status='SETTLING')
+        CreditHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(holds.release_expired_holds(), 0)
+        self.assertEqual(CreditHold.objects.get().status, 'HELD')
+
+    def _settle_late(self, amount, meanwhile):
+        """Run dispatch_settlement for a held QUEUED withdrawal; `meanwhile(wr)` runs during the bank call."""
+        wr = WithdrawalRequest.objects.create(merchant=self.m, account=self.acc, amount=Decimal(amount), status='QUEUED')
+        holds.hold_credit(wr)
+
+        def bank(body):
+            self.assertEqual(WithdrawalRequest.objects.get(id=wr.id).status, 'SETTLING')
+            meanwhile(wr)
+            resp = mock.Mock(status_code=200)
+            resp.json.return_value = {'status': 'SUCCESS', 'bank_reference': 'BNK-L'}
+            return resp
+        with mock.patch('payments.settlement_client.settle', side_effect=bank):
+            out = tasks.dispatch_settlement.apply(args=[str(wr.id)]).get()
+        return out, WithdrawalRequest.objects.get(id=wr.id)
+
+    def test_payment_after_hold_release_retakes_credit(self):
+        out, wr = self._settle_late('5.00', lambda wr: holds.release_hold(wr.id))
+        self.assertEqual((out['status'], wr.status, wr.bank_reference), ('SUCCESS', 'SUCCESS', 'BNK-L'))
+        self.assertEqual(self._balances(), (Decimal('5.00'), Decimal('95.00')))
+        self.assertEqual(LedgerEntry.objects.count(), 2)
+
+    def test_payment_of_failed_withdrawal_is_flagged_for_review(self):
+        def fail(wr):
+            holds.release_hold(wr.id)
+            withdrawals.transition_many([wr.id], 'FAILED')
+        out, wr = self._settle_late('5.00', fail)
+        self.assertEqual((out['status'], wr.status, wr.bank_reference), ('REVIEW', 'REVIEW', 'BNK-L'))
+        self.assertEqual(self._balances(), (Decimal('5.00'), Decimal('95.00')))
+
+    @override_settings(CREDIT_POOL_STRIPES=3)
+    def test_release_returns_to_debited_stripe(self):
+        CreditPool.objects.all().delete()
+        CreditPool.topup(Decimal('90.00'))
+        wr = self._wr('10.00')
+        hold = holds.hold_credit(wr)
+        self.assertEqual(CreditPool.objects.get(id=hold.pool_stripe).available_amount, Decimal('20.00'))
+        holds.release_hold(wr.id)
+        self.assertEqual(CreditPool.objects.get(id=hold.pool_stripe).available_amount, Decimal('30.00'))
@@ -0,0 +1,95 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+import time
+from rest_framework.test import APIClient
+
+from payments import idempotency
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, IdempotencyRecord, WithdrawalRequest
+from payments.utils.cache import redis_client, IDEMPOTENCY_SINCE_KEY
+
+
+def _flush_idem():
+    r = redis_client()
+    keys = list(r.scan_iter('idem:*'))
+    if keys:
+        r.delete(*keys)
+
+
+class IdempotencyStoreTests(TestCase):
+    def setUp(self):
+        _flush_idem()
+        self.addCleanup(_flush_idem)
+
+    def test_concurrent_retry_sees_in_progress_until_released(self):
+        first = idempotency.begin('k1', 'h')
+        self.assertEqual(first.verdict, 'NEW')
+        self.assertEqual(idempotency.begin('k1', 'h').verdict, 'IN_PROGRESS')
+        self.assertEqual(idempotency.begin('k1', 'other').verdict, 'CONFLICT')
+        idempotency.release(first)
+        self.assertEqual(idempotency.begin('k1', 'h').verdict, 'NEW')
+
+    def test_replay_served_from_redis_without_queries(self):
+        # The Redis copy is published once the record commits
+        with self.captureOnCommitCallbacks(execute=True):
+            idempotency.finish(idempotency.begin('k2', 'h'), {'status': 'SUCCESS'})
+        self.assertEqual(IdempotencyRecord.objects.get(key='k2').response_json, {'status': 'SUCCESS'})
+        with self.assertNumQueries(0):
+            claim = idempotency.begin('k2', 'h')
+        self.assertEqual((claim.verdict, claim.response), ('REPLAY', {'status': 'SUCCESS'}))
+
+    def test_postgres_consulted_only_while_redis_may_miss_keys(self):
+        IdempotencyRecord.objects.create(key='k3', request_hash='h', response_json={'status': 'QUEUED'})
+        # Redis lost its data: the durable row still wins
+        self.assertEqual(idempotency.begin('k3', 'h').verdict, 'REPLAY')
+        redis_client().set(IDEMPOTENCY_SINCE_KEY, int(time.time()) - idempotency.ttl_seconds() - 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(idempotency.begin('k4', 'h').verdict, 'NEW')
+
+    def test_purge_removes_only_expired_rows(self):
+        for i in range(5):
+            IdempotencyRecord.objects.create(key=f'old{i}', request_hash='h', response_json={})
+        IdempotencyRecord.objects.create(key='fresh', request_hash='h', response_json={})
+        IdempotencyRecord.objects.filter(key__startswith='old').update(
+            created_at=timezone.now() - timedelta(seconds=idempotency.ttl_seconds() + 60))
+        self.assertEqual(idempotency.purge_expired(batch_size=2), 5)
+        self.assertEqual(list(IdempotencyRecord.objects.values_list('key', flat=True)), ['fresh'])
+
+
+class IdempotentWithdrawalTests(TestCase):
+    def setUp(self):
+        _flush_idem()
+        self.addCleanup(_flush_idem)
+        self.user = User.objects.create_user(username='i1', password='p')
+        self.m = Merchant.objects.create(user=self.user, is_approved=True, requested_credit=Decimal('50.00'), bank_account='IRI')
+        WalletAccount.objects.create(merchant=self.m)
+        MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('50.00'))
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('100.00'); pool.save()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _post(self, amount, key):
+        return self.client.post('/api/v1/withdrawals', {'amount': amount}, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_and_settles_once(self):
+        with mock.patch('payments.settlement_client.settle') as post:
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = {'status': 'SUCCESS', 'bank_reference': 'BNK-I'}
+            with self.captureOnCommitCallbacks(execute=True):
+                first = self._post('5.00', 'retry-1')
+            again = self._post('5.00', 'retry-1')
+            conflict = self._post('6.00', 'retry-1')
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(again.status_code, 200)
+        self.assertEqual(again.data, first.data)
+        self.assertEqual(conflict.status_code, 409)
+        self.assertEqual(WithdrawalRequest.objects.count(), 1)
+
+    def test_failed_attempt_frees_key(self):
+        with mock.patch('payments.settlement_client.settle', side_effect=Exception('down')):
+            self.assertEqual(self._post('5.00', 'retry-2').status_code, 502)
+        self.assertEqual(idempotency.begin('retry-2', 'x').verdict, 'NEW')
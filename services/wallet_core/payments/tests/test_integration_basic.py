@@ -19,7 +19,7 @@ class IntegrationFlowTests(TestCase):
         r = self.client.post('/api/v1/auth/register', {'username':'m1','password':'p','requested_credit':'500.00','bank_account':'IR123'}, format='json')
         self.assertEqual(r.status_code, 201)
         self.client.force_authenticate(self.admin)
-        m_id = 1
+        m_id = r.data['merchant_id']
         r = self.client.post('/api/v1/admin/approve', {'merchant_id': m_id, 'credit_limit':'500.00'}, format='json')
         self.assertEqual(r.status_code, 200)
         self.client.force_authenticate(None)
@@ -0,0 +1,145 @@
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.models import User
+from django.db import connection, connections, transaction
+from decimal import Decimal
+import threading
+import time
+from prometheus_client import REGISTRY
+
+from payments import lockprof
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, atomic_consume_credit
+
+
+def _count(name, site):
+    return REGISTRY.get_sample_value(f'{name}_count', {'site': site}) or 0
+
+
+class LockTimingTests(TestCase):
+    def setUp(self):
+        self.m = Merchant.objects.create(user=User.objects.create_user(username='lp1', password='p'), is_approved=True)
+        self.acc = WalletAccount.objects.create(merchant=self.m)
+        MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('10.00'))
+        CreditPool.topup(Decimal('10.00'))
+
+    def test_lock_sites_record_wait_and_hold_only_when_enabled(self):
+        sites = ('creditpool.debit', 'merchantcredit.debit', 'creditpool.topup')
+        before = {s: (_count('wallet_lock_wait_seconds', s), _count('wallet_lock_hold_seconds', s)) for s in sites}
+        atomic_consume_credit(self.m, self.acc, Decimal('1.00'))
+        self.assertEqual(_count('wallet_lock_wait_seconds', 'creditpool.debit'), before['creditpool.debit'][0])
+
+        with override_settings(LOCK_PROFILE=True), self.captureOnCommitCallbacks(execute=True):
+            atomic_consume_credit(self.m, self.acc, Decimal('1.00'))
+            CreditPool.topup(Decimal('1.00'))
+        for s in sites:
+            self.assertEqual(_count('wallet_lock_wait_seconds', s), before[s][0] + 1, s)
+            self.assertEqual(_count('wallet_lock_hold_seconds', s), before[s][1] + 1, s)
+
+
+    @override_settings(LOCK_PROFILE=True, CREDIT_ENGINE='sql')
+    def test_sql_engine_is_profiled(self):
+        before = _count('wallet_lock_wait_seconds', 'creditpool.sql')
+        with self.captureOnCommitCallbacks(execute=True):
+            atomic_consume_credit(self.m, self.acc, Decimal('1.00'))
+        self.assertEqual(_count('wallet_lock_wait_seconds', 'creditpool.sql'), before + 1)
+
+class BlockingChainTests(TransactionTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        try:
+            connections.close_all()
+        finally:
+            super().tearDownClass()
+
+    def setUp(self):
+        self.m = Merchant.objects.create(user=User.objects.create_user(username='lp2', password='p'), is_approved=True)
+        self.acc = WalletAccount.objects.create(merchant=self.m)
+        MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('10.00'))
+        CreditPool.topup(Decimal('10.00'))
+
+    def test_snapshot_sees_withdrawals_queued_behind_a_pool_lock_holder(self):
+        locked, release, holder = threading.Event(), threading.Event(), {}
+
+        def hold_pool():
+            try:
+                with transaction.atomic():
+                    list(CreditPool.objects.select_for_update().filter(id=1))
+                    with connection.cursor() as cur:
+                        cur.execute('SELECT pg_backend_pid()')
+                        holder['pid'] = cur.fetchone()[0]
+                    locked.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        def withdraw():
+            try:
+                atomic_consume_credit(self.m, self.acc, Decimal('1.00'))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=hold_pool)]
+        threads[0].start()
+        self.assertTrue(locked.wait(10))
+        threads += [threading.Thread(target=withdraw) for _ in range(2)]
+        for t in threads[1:]:
+            t.start()
+        try:
+            for _ in range(100):
+                snap = lockprof.snapshot()
+                if len(snap['waiters']) == 2:
+                    break
+                time.sleep(0.05)
+        finally:
+            release.set()
+            for t in threads:
+                t.join(10)
+
+        self.assertEqual(len(snap['waiters']), 2)
+        self.assertEqual({w['table'] for w in snap['waiters']}, {'payments_creditpool'})
+        self.assertIn(str(holder['pid']), snap['blockers'])
+        report = lockprof.summarize([snap])
+        self.assertEqual(report['lock_wait']['count'], 2)
+        self.assertEqual(report['top_blockers'][0]['waiters'], 2)
+        self.assertEqual(report['top_blockers'][0]['state'], 'idle in transaction')
+        self.assertEqual(report['hold_by_queue_depth']['2']['count'], 1)
+        self.assertEqual(CreditPool.total_available(), Decimal('8.00'))
+
+
+def _sample(ts, waiters, blockers):
+    return {'kind': 'sample', 'ts': ts, 'waiters': waiters, 'blockers': blockers}
+
+
+class ReportTests(SimpleTestCase):
+    def test_waits_are_counted_once_chains_measured_and_thresholds_checked(self):
+        w = {'locktype': 'transactionid', 'table': 'payments_creditpool', 'query': 'SELECT ... FOR UPDATE'}
+        blocker = {'1': {'xact_s': 0.2, 'state': 'idle in transaction', 'query': 'UPDATE "payments_creditpool" ...'}}
+        records = [
+            _sample(0.0, [dict(w, pid=2, blocked_by=[1], wait_s=0.01, wait_started=100.0)], blocker),
+            # Same wait seen again, and a third session queued behind the second
+            _sample(0.1, [dict(w, pid=2, blocked_by=[1], wait_s=0.11, wait_started=100.0),
+                          dict(w, pid=3, blocked_by=[2], wait_s=0.02, wait_started=100.09)], blocker),
+            _sample(0.2, [], {}),
+        ]
+        report = lockprof.summarize(records)
+        self.assertEqual(report['lock_wait']['count'], 2)
+        self.assertEqual(report['lock_wait']['max_ms'], 110.0)
+        self.assertEqual(report['longest_chain'], 2)
+        self.assertEqual(report['top_blockers'][0]['waiters'], 3)
+        self.assertEqual(set(report['hold_by_queue_depth']), {'1', '2'})
+        self.assertEqual(lockprof.violations(report, max_p95_wait_ms=200, max_chain=2), [])
+        self.assertEqual(len(lockprof.violations(report, max_p95_wait_ms=50, max_chain=1)), 2)
+
+    def test_app_histograms_are_diffed_between_scrapes(self):
+        def text(n_fast, n_slow):
+            total = n_fast + n_slow
+            return (f'wallet_lock_wait_seconds_bucket{{le="0.001",site="creditpool.debit"}} {n_fast}\n'
+                    f'wallet_lock_wait_seconds_bucket{{le="0.1",site="creditpool.debit"}} {total}\n'
+                    f'wallet_lock_wait_seconds_bucket{{le="+Inf",site="creditpool.debit"}} {total}\n')
+        before = lockprof.scrape('# TYPE wallet_lock_wait_seconds histogram\n' + text(100, 0))
+        after = lockprof.scrape('# TYPE wallet_lock_wait_seconds histogram\n' + text(100, 10))
+        site = lockprof.app_delta(before, after)['creditpool.debit']
+        self.assertEqual(site['acquired'], 10)
+        self.assertGreater(site['wait_p50_ms'], 1.0)
+        self.assertEqual(lockprof.violations({'lock_wait': {'p95_ms': 0}, 'longest_chain': 0,
+                                              'app': {'creditpool.debit': site}}, max_app_p95_wait_ms=5),
+                         [f"creditpool.debit lock wait p95 {site['wait_p95_ms']}ms > 5ms"])
@@ -0,0 +1,96 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.contrib.auth.models import User
+from decimal import Decimal
+from unittest import mock
+import os
+import subprocess
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+from prometheus_client import REGISTRY
+from rest_framework.test import APIClient
+
+from payments import metrics
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool
+
+ROUTE = 'api/v1/withdrawals'
+
+
+def _value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='met1', password='p')
+        self.m = Merchant.objects.create(user=self.user, is_approved=True, bank_account='IRM')
+        WalletAccount.objects.create(merchant=self.m)
+        MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('50.00'))
+        CreditPool.topup(Decimal('100.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _withdraw(self):
+        with mock.patch('payments.settlement_client.settle') as post:
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = {'status': 'SUCCESS', 'bank_reference': 'BNK-M'}
+            return self.client.post('/api/v1/withdrawals', {'amount': '5.00'}, format='json', HTTP_IDEMPOTENCY_KEY=uuid.uuid4().hex)
+
+    def test_disabled_timers_are_shared_no_ops_and_record_nothing(self):
+        before = _value('wallet_phase_seconds_count', phase='withdrawal.hold')
+        self.assertIs(metrics.phase('withdrawal.hold'), metrics.phase('test.other'))
+        self.assertEqual(self._withdraw().status_code, 200)
+        self.assertEqual(_value('wallet_phase_seconds_count', phase='withdrawal.hold'), before)
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    @override_settings(METRICS_ENABLED=True)
+    def test_withdrawal_records_phases_and_per_request_db_and_redis_counts(self):
+        phases = ('withdrawal.ratelimit', 'withdrawal.idempotency', 'withdrawal.hold', 'withdrawal.settlement',
+                  'withdrawal.finalize', 'credit.lock_debit', 'cache.gcra_take', 'cache.idempotency_claim')
+        before = {p: _value('wallet_phase_seconds_count', phase=p) for p in phases}
+        requests_before = _value('wallet_request_seconds_count', route=ROUTE, method='POST', status='200')
+        queries_before = _value('wallet_request_db_queries_sum', route=ROUTE)
+        redis_before = _value('wallet_request_redis_calls_sum', route=ROUTE)
+        evalsha_before = _value('wallet_redis_calls_total', command='EVALSHA')
+
+        self.assertEqual(self._withdraw().status_code, 200)
+        for p in phases:
+            self.assertEqual(_value('wallet_phase_seconds_count', phase=p), before[p] + 1, p)
+        self.assertEqual(_value('wallet_request_seconds_count', route=ROUTE, method='POST', status='200'),
+                         requests_before + 1)
+        self.assertGreater(_value('wallet_request_db_queries_sum', route=ROUTE), queries_before)
+        # Rate limit and idempotency claim are one Lua call each
+        self.assertGreaterEqual(_value('wallet_request_redis_calls_sum', route=ROUTE), redis_before + 2)
+        self.assertGreaterEqual(_value('wallet_redis_calls_total', command='EVALSHA'), evalsha_before + 2)
+
+    @override_settings(METRICS_ENABLED=True, METRICS_TOKEN='scrape')
+    def test_metrics_endpoint_requires_token_and_serves_prometheus_text(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        r = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape')
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue(r['Content-Type'].startswith('text/plain'))
+        self.assertIn(b'# TYPE wallet_phase_seconds histogram', r.content)
+
+
+_RECORD = """
+import django; django.setup()
+from payments import metrics
+with metrics.phase('test.cross_process'):
+    pass
+print(metrics.render().decode())
+"""
+
+
+class MultiprocessMetricsTests(SimpleTestCase):
+    def test_render_merges_samples_from_every_process_and_directory(self):
+        # Metrics pick their storage at import time, so each "worker" is a fresh interpreter
+        with tempfile.TemporaryDirectory() as web, tempfile.TemporaryDirectory() as worker:
+            env = dict(os.environ, METRICS_ENABLED='1', METRICS_COLLECT_DIRS=f'{web},{worker}')
+            cwd = Path(__file__).resolve().parents[2]
+            outputs = [
+                subprocess.run([sys.executable, '-c', _RECORD], cwd=cwd, env=dict(env, PROMETHEUS_MULTIPROC_DIR=d),
+                               capture_output=True, text=True, check=True).stdout
+                for d in (web, web, worker)
+            ]
+        self.assertIn('wallet_phase_seconds_count{phase="test.cross_process"} 3.0', outputs[-1])
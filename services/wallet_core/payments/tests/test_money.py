@@ -0,0 +1,77 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import F
+from decimal import Decimal
+from rest_framework.test import APIClient
+
+from payments import holds, money
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, LedgerEntry, WithdrawalRequest, atomic_consume_credit
+
+
+class MinorUnitsTests(TestCase):
+    def setUp(self):
+        self.m = Merchant.objects.create(user=User.objects.create_user(username='money1', password='p'), is_approved=True)
+        self.acc = WalletAccount.objects.create(merchant=self.m)
+        MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('100.00'))
+        CreditPool.topup(Decimal('50.00'))
+
+    def _credit(self):
+        return MerchantCredit.objects.get(merchant=self.m)
+
+    def test_conversions_match_decimal_quantization(self):
+        self.assertEqual(money.to_minor(Decimal('12.345')), 1235)
+        self.assertEqual(money.to_minor('0.1'), 10)
+        self.assertEqual(money.from_minor(1234), Decimal('12.34'))
+        self.assertEqual([money.format_minor(n) for n in (0, 5, -5, 123456)], ['0.00', '0.05', '-0.05', '1234.56'])
+
+    def test_trigger_keeps_both_columns_equal_whichever_side_is_written(self):
+        mc = self._credit()
+        self.assertEqual((mc.credit_limit_minor, mc.utilized_amount_minor), (10000, 0))
+        MerchantCredit.objects.filter(pk=mc.pk).update(utilized_amount=F('utilized_amount') + Decimal('2.50'))
+        self.assertEqual(self._credit().utilized_amount_minor, 250)
+        MerchantCredit.objects.filter(pk=mc.pk).update(utilized_amount_minor=F('utilized_amount_minor') + 125)
+        self.assertEqual(self._credit().utilized_amount, Decimal('3.75'))
+        wr = WithdrawalRequest.objects.create(merchant=self.m, account=self.acc, amount=Decimal('7.07'))
+        self.assertEqual(WithdrawalRequest.objects.get(id=wr.id).amount_minor, 707)
+
+    def test_backfill_fills_rows_written_before_the_columns(self):
+        for i in range(5):
+            atomic_consume_credit(self.m, self.acc, Decimal('1.01') + i)
+        with connection.cursor() as cur:
+            # Flush deferred FK checks; ALTER TABLE refuses to run with trigger events pending
+            cur.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            for table in ('payments_merchantcredit', 'payments_ledgerentry'):
+                cur.execute(f'ALTER TABLE {table} DISABLE TRIGGER {table}_minor_sync')
+            cur.execute('UPDATE payments_merchantcredit SET credit_limit_minor = NULL, utilized_amount_minor = NULL')
+            cur.execute('UPDATE payments_ledgerentry SET amount_minor = NULL')
+            for table in ('payments_merchantcredit', 'payments_ledgerentry'):
+                cur.execute(f'ALTER TABLE {table} ENABLE TRIGGER {table}_minor_sync')
+        self.assertEqual(money.pending()['payments.LedgerEntry'], 10)
+
+        filled = money.backfill(batch_size=3, sleep_s=0)
+        self.assertEqual(filled['payments.LedgerEntry'], 10)
+        self.assertEqual(filled['payments.MerchantCredit'], 1)
+        self.assertFalse(any(money.pending().values()))
+        self.assertFalse(LedgerEntry.objects.exclude(amount_minor=F('amount') * 100).exists())
+        self.assertEqual(self._credit().utilized_amount_minor, 1505)
+
+    @override_settings(MONEY_MINOR_UNITS=True)
+    def test_hot_path_in_cents_leaves_decimal_balances_and_api_format_unchanged(self):
+        atomic_consume_credit(self.m, self.acc, Decimal('3.00'))
+        wr = WithdrawalRequest.objects.create(merchant=self.m, account=self.acc, amount=Decimal('10.10'))
+        holds.hold_credit(wr)
+        self.assertEqual(self._credit().utilized_amount, Decimal('13.10'))
+        holds.release_hold(wr.id)
+        mc = self._credit()
+        self.assertEqual((mc.utilized_amount, mc.utilized_amount_minor), (Decimal('3.00'), 300))
+        self.assertEqual(CreditPool.total_available(), Decimal('47.00'))
+        with self.assertRaisesMessage(ValueError, 'INSUFFICIENT_POOL'):
+            atomic_consume_credit(self.m, self.acc, Decimal('47.01'))
+
+        client = APIClient()
+        client.force_authenticate(self.m.user)
+        r = client.get('/api/v1/ledger', {'limit': 1})
+        self.assertEqual(r.data['results'][0]['amount'], '3.00')
+        r = client.get('/api/v1/withdrawals', {'limit': 1})
+        self.assertEqual(r.data['results'][0]['amount'], '10.10')
@@ -0,0 +1,62 @@
+from django.test import TestCase
+from django.db import connection
+from datetime import date, datetime, timezone as dt_timezone
+import time
+
+from payments import partitions
+from payments.models import ApiRequestLog
+from payments.utils.ids import uuid7
+
+TABLE = ApiRequestLog._meta.db_table
+
+
+class PartitionTests(TestCase):
+    def test_tables_are_partitioned_with_upcoming_months(self):
+        this_month = partitions.month_start(datetime.now(dt_timezone.utc))
+        with connection.cursor() as cur:
+            for model in partitions.partitioned_models().values():
+                table = model._meta.db_table
+                self.assertTrue(partitions.is_partitioned(cur, table), table)
+                self.assertIn(partitions.add_months(this_month, 2), partitions.list_partitions(cur, table))
+
+    def test_maintain_creates_ahead_and_detaches_expired(self):
+        old = date(2020, 1, 1)
+        with connection.cursor() as cur:
+            partitions.create_partition(cur, TABLE, old)
+        ApiRequestLog.objects.create(path='/x', method='GET', status=200,
+                                     created_at=datetime(2020, 1, 15, tzinfo=dt_timezone.utc))
+        report = partitions.maintain(today=date(2031, 5, 10), months_ahead=1, retention={'ApiRequestLog': 12})
+        self.assertEqual(report['ApiRequestLog']['created'], [f'{TABLE}_p2031_05', f'{TABLE}_p2031_06'])
+        self.assertIn(f'{TABLE}_p2020_01', report['ApiRequestLog']['detached'])
+        self.assertEqual(report['LedgerEntry']['detached'], [])
+        self.assertFalse(ApiRequestLog.objects.filter(path='/x').exists())
+        with connection.cursor() as cur:
+            cur.execute(f'SELECT count(*) FROM "{TABLE}_p2020_01"')
+            self.assertEqual(cur.fetchone()[0], 1)
+            self.assertNotIn(date(2020, 1, 1), partitions.list_partitions(cur, TABLE))
+        # Idempotent
+        again = partitions.maintain(today=date(2031, 5, 10), months_ahead=1, retention={})
+        self.assertEqual(again['ApiRequestLog'], {'created': [], 'detached': []})
+
+    def test_rows_past_the_last_partition_land_in_default_and_move_out(self):
+        late = datetime(2033, 2, 3, tzinfo=dt_timezone.utc)
+        ApiRequestLog.objects.create(path='/late', method='GET', status=200, created_at=late)
+        default = partitions.default_partition_name(TABLE)
+        with self.assertLogs('payments.partitions', 'ERROR'):
+            report = partitions.maintain(today=date(2033, 2, 1), months_ahead=0, retention={})
+        self.assertEqual(report['ApiRequestLog']['created'], [f'{TABLE}_p2033_02'])
+        self.assertTrue(ApiRequestLog.objects.filter(path='/late').exists())
+        with connection.cursor() as cur:
+            cur.execute(f'SELECT count(*) FROM "{default}"')
+            self.assertEqual(cur.fetchone()[0], 0)
+            cur.execute(f'SELECT count(*) FROM "{TABLE}_p2033_02"')
+            self.assertEqual(cur.fetchone()[0], 1)
+
+    def test_uuid7_is_time_ordered(self):
+        ids = []
+        for _ in range(3):
+            ids.append(uuid7())
+            time.sleep(0.002)
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual({(u.version, u.variant) for u in ids}, {(7, 'specified in RFC 4122')})
+        self.assertAlmostEqual((ids[0].int >> 80) / 1000, time.time(), delta=5)
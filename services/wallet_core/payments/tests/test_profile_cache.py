@@ -0,0 +1,71 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from decimal import Decimal
+from unittest import mock
+from rest_framework.test import APIClient
+
+from payments import profile_cache
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, atomic_consume_credit
+from payments.services import approve_merchant
+from payments.utils.cache import redis_client
+
+
+def _flush_profiles():
+    profile_cache.clear_local()
+    r = redis_client()
+    keys = list(r.scan_iter('profile:*'))
+    if keys:
+        r.delete(*keys)
+
+
+class ProfileCacheTests(TestCase):
+    def setUp(self):
+        _flush_profiles()
+        self.addCleanup(_flush_profiles)
+        self.user = User.objects.create_user(username='pc', password='p')
+        self.m = Merchant.objects.create(user=self.user, is_approved=True, bank_account='IRP')
+        self.acc = WalletAccount.objects.create(merchant=self.m)
+        MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('40.00'))
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('100.00'); pool.save()
+
+    def _warm(self):
+        profile_cache.get_profile(self.user.id)   # learns the merchant id
+        profile_cache.get_profile(self.user.id)   # fills Redis and the local LRU
+
+    def test_single_query_on_miss_then_served_locally(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(profile_cache.get_profile(self.user.id)['available_credit'], '40.00')
+        with self.assertNumQueries(1):
+            profile_cache.get_profile(self.user.id)
+        with self.assertNumQueries(0), mock.patch('payments.profile_cache.redis_client') as rc:
+            profile_cache.get_profile(self.user.id)
+        rc.assert_not_called()
+
+    @override_settings(PROFILE_LOCAL_TTL_S=0)
+    def test_expired_local_entry_revalidates_by_version(self):
+        self._warm()
+        with self.assertNumQueries(0):
+            profile_cache.get_profile(self.user.id)
+        # Another process committed a change and bumped the version
+        MerchantCredit.objects.filter(merchant=self.m).update(utilized_amount=Decimal('15.00'))
+        redis_client().incr(f"profile:ver:{self.m.id}")
+        self.assertEqual(profile_cache.get_profile(self.user.id)['utilized_amount'], '15.00')
+
+    def test_writers_invalidate(self):
+        self._warm()
+        with self.captureOnCommitCallbacks(execute=True):
+            atomic_consume_credit(self.m, self.acc, Decimal('5.00'))
+        self.assertEqual(profile_cache.get_profile(self.user.id)['available_credit'], '35.00')
+        with self.captureOnCommitCallbacks(execute=True):
+            approve_merchant(self.m.id, Decimal('90.00'))
+        self.assertEqual(profile_cache.get_profile(self.user.id)['credit_limit'], '90.00')
+
+    def test_me_view(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        r = client.get('/api/v1/me')
+        self.assertEqual((r.status_code, r.data['merchant_id']), (200, self.m.id))
+        admin = User.objects.create_user(username='pc-admin', password='p', is_staff=True)
+        client.force_authenticate(admin)
+        self.assertEqual(client.get('/api/v1/me').status_code, 404)
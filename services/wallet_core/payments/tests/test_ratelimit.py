@@ -0,0 +1,50 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from unittest import mock
+import uuid
+
+from payments import ratelimit
+from payments.models import Merchant
+from payments.utils.cache import gcra_take
+
+TIERS = {
+    'standard': {'limit': 5, 'period_s': 60, 'burst': 3},
+    'premium': {'limit': 600, 'period_s': 60, 'burst': 50},
+}
+
+
+@override_settings(RATE_LIMIT_TIERS=TIERS, RATE_LIMIT_LEASE_SIZE=0)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        ratelimit.reset_local_state()
+        self.addCleanup(ratelimit.reset_local_state)
+        self.subject = f"test:{uuid.uuid4().hex}"
+
+    def test_burst_then_paced_by_emission_interval(self):
+        decisions = [ratelimit.allow(self.subject) for _ in range(4)]
+        self.assertEqual([d.allowed for d in decisions], [True, True, True, False])
+        self.assertEqual([d.remaining for d in decisions[:3]], [2, 1, 0])
+        # 5/min -> one token every 12s
+        self.assertEqual(decisions[3].retry_after_s, 12)
+
+    @override_settings(RATE_LIMIT_LEASE_SIZE=3)
+    def test_lease_skips_redis_and_keeps_global_limit(self):
+        with mock.patch('payments.ratelimit.gcra_take', wraps=gcra_take) as take:
+            allowed = [ratelimit.allow(self.subject, 'premium').allowed for _ in range(9)]
+        self.assertTrue(all(allowed))
+        self.assertEqual(take.call_count, 3)
+        # A worker leasing the whole standard burst leaves nothing for another worker
+        other = f"{self.subject}:std"
+        self.assertTrue(ratelimit.allow(other).allowed)
+        ratelimit.reset_local_state()
+        self.assertFalse(ratelimit.allow(other).allowed)
+
+    def test_tier_comes_from_merchant(self):
+        user = User.objects.create_user(username='rt', password='p')
+        Merchant.objects.create(user=user, rate_tier='premium')
+        self.assertEqual(ratelimit.tier_for_user(user.id), 'premium')
+        with self.assertNumQueries(0):
+            self.assertEqual(ratelimit.tier_for_user(user.id), 'premium')
+        allowed = [ratelimit.allow_withdrawal(user.id).allowed for _ in range(50)]
+        self.assertTrue(all(allowed))
+        self.assertFalse(ratelimit.allow_withdrawal(user.id).allowed)
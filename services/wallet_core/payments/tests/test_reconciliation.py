@@ -0,0 +1,79 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from decimal import Decimal
+import json
+import os
+import tempfile
+
+from payments import holds, reconciliation
+from payments.models import (
+    Merchant, WalletAccount, MerchantCredit, CreditPool, LedgerEntry, WithdrawalRequest, atomic_consume_credit,
+)
+
+
+@override_settings(RECON_LAG_S=0)
+class ReconciliationTests(TestCase):
+    def setUp(self):
+        self.accounts = []
+        for name in ('rc1', 'rc2'):
+            m = Merchant.objects.create(user=User.objects.create_user(username=name, password='p'), is_approved=True)
+            acc = WalletAccount.objects.create(merchant=m)
+            MerchantCredit.objects.create(merchant=m, credit_limit=Decimal('100.00'))
+            self.accounts.append((m, acc))
+        pool = CreditPool.get_solo()
+        pool.available_amount = Decimal('500.00'); pool.save()
+
+    def _consume(self, i, amount):
+        m, acc = self.accounts[i]
+        atomic_consume_credit(m, acc, Decimal(amount))
+
+    def test_clean_ledger_across_chunks_and_holds(self):
+        self._consume(0, '10.00'); self._consume(1, '2.50'); self._consume(0, '0.01')
+        m, acc = self.accounts[1]
+        holds.hold_credit(WithdrawalRequest.objects.create(merchant=m, account=acc, amount=Decimal('7.00')))
+        # One row per fetch: every pair straddles a chunk boundary
+        run = reconciliation.reconcile(chunk_size=1)
+        self.assertEqual((run.entries_scanned, run.discrepancy_count), (6, 0), run.discrepancies)
+        self.assertEqual(run.merchant_totals[str(self.accounts[0][0].id)], [1001, 1001])
+        self.assertEqual(run.open_entries, [])
+        self.assertEqual(run.pool_funding_minor, 50000)
+
+    def test_incremental_run_scans_only_new_entries(self):
+        self._consume(0, '5.00')
+        first = reconciliation.reconcile()
+        self._consume(1, '3.00')
+        second = reconciliation.reconcile()
+        self.assertEqual((first.entries_scanned, second.entries_scanned), (2, 2))
+        self.assertEqual(second.discrepancy_count, 0, second.discrepancies)
+        self.assertEqual(len(second.merchant_totals), 2)
+        self.assertEqual(reconciliation.reconcile().entries_scanned, 0)
+
+    def test_reports_discrepancies(self):
+        self._consume(0, '5.00'); self._consume(1, '4.00')
+        m0, m1 = self.accounts[0][0], self.accounts[1][0]
+        MerchantCredit.objects.filter(merchant=m0).update(utilized_amount=Decimal('6.00'))
+        LedgerEntry.objects.filter(merchant=m1, direction='CREDIT').delete()
+        run = reconciliation.reconcile(full=True)
+        found = {(d['kind'], d['merchant_id']) for d in run.discrepancies}
+        self.assertEqual(found, {('UTILIZED_MISMATCH', m0.id), ('UTILIZED_MISMATCH', m1.id), ('UNBALANCED_TX', m1.id)})
+        mismatch = next(d for d in run.discrepancies if d['kind'] == 'UTILIZED_MISMATCH' and d['merchant_id'] == m0.id)
+        self.assertEqual((mismatch['expected_minor'], mismatch['utilized_minor']), (500, 600))
+
+        CreditPool.objects.filter(id=1).update(available_amount=Decimal('100.00'))
+        run = reconciliation.reconcile()
+        self.assertIn('POOL_FUNDING_DECREASED', {d['kind'] for d in run.discrepancies})
+
+    def test_command_writes_report(self):
+        self._consume(0, '1.00')
+        MerchantCredit.objects.filter(merchant=self.accounts[0][0]).update(utilized_amount=Decimal('0.00'))
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        with self.assertRaises(CommandError):
+            call_command('reconcile_ledger', '--full', '--output', path, stdout=open(os.devnull, 'w'))
+        with open(path) as f:
+            report = json.load(f)
+        self.assertEqual(report['discrepancy_count'], 1)
+        self.assertEqual(report['discrepancies'][0]['kind'], 'UTILIZED_MISMATCH')
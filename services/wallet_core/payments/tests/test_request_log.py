@@ -0,0 +1,58 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.db import OperationalError
+from unittest import mock
+from rest_framework.test import APIClient
+
+from payments import ratelimit, request_log
+from payments.models import ApiRequestLog
+from payments.request_log import RequestLogBuffer
+
+
+def _rec(i):
+    return {'path': '/api/v1/withdrawals', 'method': 'POST', 'status': 200, 'actor': f'u{i}', 'payload': {'i': i}}
+
+
+class RequestLogBufferTests(TestCase):
+    # The process-wide flusher may commit rows logged by other tests' views; count only ours
+    def _logs(self):
+        return ApiRequestLog.objects.filter(actor__in=['u0', 'u1', 'u2', 'u3', 'u4', 'rl'])
+
+    def test_bounded_buffer_counts_drops_and_flushes_in_batches(self):
+        buf = RequestLogBuffer(capacity=5, batch_size=2)
+        accepted = [buf.put(_rec(i)) for i in range(7)]
+        self.assertEqual(accepted, [True] * 5 + [False] * 2)
+        with self.assertNumQueries(3):
+            self.assertEqual(buf.flush(), 5)
+        self.assertEqual(self._logs().count(), 5)
+        self.assertEqual(buf.stats(), {'enqueued': 5, 'written': 5, 'dropped': 2, 'flush_errors': 0,
+                                       'pending': 0, 'capacity': 5})
+
+    def test_unreachable_database_keeps_batch_for_retry(self):
+        buf = RequestLogBuffer(capacity=10, batch_size=10)
+        for i in range(3):
+            buf.put(_rec(i))
+        with mock.patch.object(ApiRequestLog.objects, 'bulk_create', side_effect=OperationalError('down')):
+            self.assertEqual(buf.flush(), 0)
+        self.assertEqual((buf.stats()['pending'], buf.stats()['flush_errors']), (3, 1))
+        buf.close()
+        self.assertEqual(list(self._logs().order_by('actor').values_list('actor', flat=True)), ['u0', 'u1', 'u2'])
+
+    def test_sync_mode_writes_inline(self):
+        with override_settings(REQUEST_LOG_MODE='sync'):
+            request_log.log(**_rec(1))
+        self.assertEqual(self._logs().get().actor, 'u1')
+
+    def test_rejected_request_is_buffered_not_written(self):
+        user = User.objects.create_user(username='rl', password='p')
+        client = APIClient()
+        client.force_authenticate(user)
+        buf = RequestLogBuffer()
+        with mock.patch('payments.request_log.get_buffer', return_value=buf), \
+                mock.patch('payments.ratelimit.allow_withdrawal', return_value=ratelimit.Decision(False, 0, 1)):
+            r = client.post('/api/v1/withdrawals', {'amount': '1.00'}, format='json')
+        self.assertEqual(r.status_code, 429)
+        self.assertFalse(self._logs().exists())
+        self.assertEqual(buf.stats()['pending'], 1)
+        buf.flush()
+        self.assertEqual(self._logs().get().payload, {'phase': 'ratelimit_exceeded'})
@@ -0,0 +1,64 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django_celery_results.models import TaskResult
+from datetime import timedelta
+import gzip
+import json
+import os
+import shutil
+import tempfile
+
+from django.db import connection
+
+from payments import partitions, retention
+from payments.models import ApiRequestLog, RetentionCheckpoint
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir, True)
+        old = timezone.now() - timedelta(days=40)
+        with connection.cursor() as cur:
+            partitions.create_partition(cur, ApiRequestLog._meta.db_table, partitions.month_start(old))
+        ApiRequestLog.objects.bulk_create(
+            [ApiRequestLog(path='/ret', method='POST', status=200, payload={'n': i}, created_at=old + timedelta(seconds=i))
+             for i in range(5)]
+            + [ApiRequestLog(path='/ret', method='POST', status=200, payload={'n': 'fresh'})])
+
+    def _archived(self, outcome):
+        with gzip.open(outcome.archive, 'rt') as f:
+            return [json.loads(line) for line in f]
+
+    def test_archives_then_deletes_in_batches(self):
+        with override_settings(RETENTION_ARCHIVE_DIR=self.dir):
+            outcome = retention.run_policy('request_log', batch_size=2, sleep_s=0)
+        self.assertEqual((outcome.rows, outcome.batches, outcome.finished), (5, 3, True))
+        self.assertEqual([r['payload']['n'] for r in self._archived(outcome)], [0, 1, 2, 3, 4])
+        self.assertTrue(outcome.archive.startswith(os.path.join(self.dir, ApiRequestLog._meta.db_table)))
+        self.assertEqual(list(ApiRequestLog.objects.filter(path='/ret').values_list('payload', flat=True)), [{'n': 'fresh'}])
+        cp = RetentionCheckpoint.objects.get(policy='request_log')
+        self.assertEqual((cp.cutoff, cp.last_pk, cp.rows_done), (None, '', 0))
+        self.assertIsNotNone(cp.last_finished_at)
+
+    def test_interrupted_pass_resumes_from_checkpoint(self):
+        with override_settings(RETENTION_ARCHIVE_DIR=self.dir):
+            first = retention.run_policy('request_log', batch_size=2, max_batches=1, sleep_s=0)
+            cp = RetentionCheckpoint.objects.get(policy='request_log')
+            self.assertEqual((first.finished, cp.rows_done), (False, 2))
+            second = retention.run_policy('request_log', batch_size=2, sleep_s=0)
+        self.assertEqual((second.rows, second.finished), (3, True))
+        self.assertEqual([r['payload']['n'] for r in self._archived(second)], [2, 3, 4])
+
+    def test_dry_run_writes_nothing(self):
+        outcome = retention.run_policy('request_log', dry_run=True, batch_size=2, sleep_s=0)
+        self.assertEqual((outcome.rows, outcome.archive), (5, None))
+        self.assertEqual(ApiRequestLog.objects.filter(path='/ret').count(), 6)
+        self.assertFalse(RetentionCheckpoint.objects.exists())
+
+    def test_celery_results_deleted(self):
+        for i in range(3):
+            TaskResult.objects.create(task_id=f'ret-{i}', status='SUCCESS')
+        TaskResult.objects.filter(task_id__in=['ret-0', 'ret-1']).update(date_done=timezone.now() - timedelta(days=8))
+        self.assertEqual(retention.run_policy('celery_task_results', sleep_s=0).rows, 2)
+        self.assertEqual(list(TaskResult.objects.values_list('task_id', flat=True)), ['ret-2'])
@@ -0,0 +1,66 @@
+from django.test import SimpleTestCase, override_settings
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import json
+import threading
+
+import requests
+from prometheus_client import REGISTRY
+
+from payments import settlement_client
+
+
+def _calls(outcome):
+    return REGISTRY.get_sample_value('wallet_settlement_call_seconds_count', {'outcome': outcome}) or 0
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    peers = set()
+
+    def do_POST(self):
+        _Handler.peers.add(self.client_address)
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        out = json.dumps({'status': 'SUCCESS', 'bank_reference': f"BNK-{body['merchant_id']}",
+                          'auth': self.headers.get('Authorization')}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(out)))
+        self.end_headers()
+        self.wfile.write(out)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(METRICS_ENABLED=True)
+class SettlementClientTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.url = f"http://127.0.0.1:{cls.server.server_port}/api/settlement/withdraw"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def test_reuses_connection_and_records_latency(self):
+        _Handler.peers.clear()
+        before = _calls('2xx')
+        with override_settings(SETTLEMENT_URL=self.url, INTERNAL_TOKEN='tok'):
+            for i in range(5):
+                r = settlement_client.settle({'merchant_id': i, 'account_id': 'a', 'amount': '1.00'})
+                self.assertEqual(r.json()['bank_reference'], f"BNK-{i}")
+        self.assertEqual(r.json()['auth'], 'Bearer tok')
+        self.assertEqual(len(_Handler.peers), 1)
+        self.assertEqual(_calls('2xx'), before + 5)
+
+    def test_transport_errors_are_counted(self):
+        before = _calls('error')
+        with override_settings(SETTLEMENT_URL='http://127.0.0.1:9/unreachable'):
+            with self.assertRaises(requests.RequestException):
+                settlement_client.settle({'merchant_id': 1}, timeout=0.5)
+        self.assertEqual(_calls('error'), before + 1)
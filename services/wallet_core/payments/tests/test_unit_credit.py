@@ -1,7 +1,7 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
 from decimal import Decimal
-from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, atomic_consume_credit
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, LedgerEntry, atomic_consume_credit, pool_stripe_for
 
 class UnitCreditTests(TestCase):
     def setUp(self):
@@ -26,3 +26,66 @@ class UnitCreditTests(TestCase):
         self.pool.available_amount = Decimal('50.00'); self.pool.save()
         with self.assertRaises(ValueError):
             atomic_consume_credit(self.m, self.acc, Decimal('100.00'))
+
+
+@override_settings(CREDIT_POOL_STRIPES=4)
+class StripedPoolTests(TestCase):
+    def setUp(self):
+        u = User.objects.create_user(username='s1', password='x')
+        self.m = Merchant.objects.create(user=u, is_approved=True, requested_credit=Decimal('100.00'))
+        self.acc = WalletAccount.objects.create(merchant=self.m)
+        self.mc = MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('500.00'), utilized_amount=Decimal('0.00'))
+        CreditPool.topup(Decimal('100.00'))
+
+    def test_topup_spreads_and_get_solo_aggregates(self):
+        self.assertEqual(list(CreditPool.objects.order_by('id').values_list('available_amount', flat=True)), [Decimal('25.00')] * 4)
+        pool = CreditPool.get_solo()
+        self.assertEqual(pool.available_amount, Decimal('100.00'))
+        with self.assertRaises(ValueError):
+            pool.save()
+
+    def test_consume_from_home_stripe(self):
+        atomic_consume_credit(self.m, self.acc, Decimal('10.00'))
+        home = CreditPool.objects.get(id=pool_stripe_for(self.m.id))
+        self.assertEqual(home.available_amount, Decimal('15.00'))
+        self.assertEqual(CreditPool.total_available(), Decimal('90.00'))
+
+    def test_fallback_to_other_stripe(self):
+        CreditPool.objects.filter(id=pool_stripe_for(self.m.id)).update(available_amount=Decimal('0.00'))
+        atomic_consume_credit(self.m, self.acc, Decimal('20.00'))
+        self.assertEqual(CreditPool.total_available(), Decimal('55.00'))
+
+    def test_rebalance_when_no_single_stripe_covers(self):
+        atomic_consume_credit(self.m, self.acc, Decimal('60.00'))
+        self.assertEqual(CreditPool.total_available(), Decimal('40.00'))
+        self.assertFalse(CreditPool.objects.filter(available_amount__lt=0).exists())
+        self.mc.refresh_from_db()
+        self.assertEqual(self.mc.utilized_amount, Decimal('60.00'))
+
+    def test_insufficient_pool_total(self):
+        with self.assertRaisesMessage(ValueError, 'INSUFFICIENT_POOL'):
+            atomic_consume_credit(self.m, self.acc, Decimal('150.00'))
+
+
+@override_settings(CREDIT_ENGINE='sql')
+class SqlEngineCreditTests(UnitCreditTests):
+    def test_reports_which_constraint_failed(self):
+        with self.assertRaisesMessage(ValueError, 'INSUFFICIENT_MERCHANT_CREDIT'):
+            atomic_consume_credit(self.m, self.acc, Decimal('600.00'))
+        self.pool.available_amount = Decimal('50.00'); self.pool.save()
+        with self.assertRaisesMessage(ValueError, 'INSUFFICIENT_POOL'):
+            atomic_consume_credit(self.m, self.acc, Decimal('100.00'))
+        self.assertFalse(LedgerEntry.objects.exists())
+
+    def test_writes_balanced_ledger_pair(self):
+        tx_id = atomic_consume_credit(self.m, self.acc, Decimal('12.34'))
+        rows = LedgerEntry.objects.filter(tx_id=tx_id).order_by('direction')
+        self.assertEqual([(r.direction, r.source, r.amount) for r in rows],
+                         [('CREDIT', 'MERCHANT_CREDIT', Decimal('12.34')), ('DEBIT', 'CREDIT_POOL', Decimal('12.34'))])
+
+    @override_settings(CREDIT_POOL_STRIPES=4)
+    def test_striped_home_stripe_short_falls_back(self):
+        CreditPool.objects.all().delete()
+        CreditPool.topup(Decimal('100.00'))
+        atomic_consume_credit(self.m, self.acc, Decimal('60.00'))
+        self.assertEqual(CreditPool.total_available(), Decimal('40.00'))
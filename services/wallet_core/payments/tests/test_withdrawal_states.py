@@ -0,0 +1,76 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from decimal import Decimal
+from unittest import mock
+import os
+from rest_framework.test import APIClient
+
+from payments import batch_dispatch, holds, withdrawals
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, IdempotencyRecord, WithdrawalRequest
+
+
+def _writes(ctx):
+    sql = [q['sql'] for q in ctx.captured_queries]
+    return (sum(s.startswith('INSERT INTO "payments_withdrawalrequest"') for s in sql),
+            sum(s.startswith('UPDATE "payments_withdrawalrequest"') for s in sql))
+
+
+class WithdrawalStateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ws1', password='p')
+        self.m = Merchant.objects.create(user=self.user, is_approved=True, bank_account='IRW')
+        self.acc = WalletAccount.objects.create(merchant=self.m)
+        MerchantCredit.objects.create(merchant=self.m, credit_limit=Decimal('50.00'))
+        CreditPool.topup(Decimal('100.00'))
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def _wr(self, status):
+        return WithdrawalRequest.objects.create(merchant=self.m, account=self.acc, amount=Decimal('1.00'), status=status)
+
+    def test_only_legal_transitions_apply(self):
+        done, queued = self._wr('SUCCESS'), self._wr('QUEUED')
+        with self.assertRaises(withdrawals.IllegalTransition):
+            withdrawals.transition(done, 'FAILED')
+        with self.assertRaises(withdrawals.IllegalTransition):
+            withdrawals.advance(self._wr('PENDING'), 'SETTLING')
+        self.assertEqual(withdrawals.transition_many([done.id, queued.id], 'SETTLING'), 1)
+        self.assertEqual(withdrawals.transition_many([done.id, queued.id], 'FAILED'), 1)
+        self.assertEqual(dict(WithdrawalRequest.objects.values_list('id', 'status'))[done.id], 'SUCCESS')
+        self.assertEqual(WithdrawalRequest.objects.get(id=queued.id).status, 'FAILED')
+
+    def test_sync_success_is_one_insert_and_one_final_update(self):
+        with mock.patch('payments.settlement_client.settle') as post, CaptureQueriesContext(connection) as ctx:
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = {'status': 'SUCCESS', 'bank_reference': 'BNK-W'}
+            r = self.client.post('/api/v1/withdrawals', {'amount': '5.00'}, format='json', HTTP_IDEMPOTENCY_KEY='ws-1')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(_writes(ctx), (1, 1))
+        wr = WithdrawalRequest.objects.get()
+        self.assertEqual((wr.status, wr.bank_reference), ('SUCCESS', 'BNK-W'))
+        self.assertEqual(IdempotencyRecord.objects.get(key='ws-1').response_json, r.data)
+
+    def test_refused_hold_inserts_failed_row_without_update(self):
+        with mock.patch('payments.settlement_client.settle') as post, CaptureQueriesContext(connection) as ctx:
+            r = self.client.post('/api/v1/withdrawals', {'amount': '60.00'}, format='json')
+        self.assertEqual(r.status_code, 409)
+        post.assert_not_called()
+        self.assertEqual(_writes(ctx), (1, 0))
+        self.assertEqual(WithdrawalRequest.objects.get().status, 'FAILED')
+
+    @override_settings(SETTLEMENT_DISPATCH='batch')
+    def test_async_withdrawal_is_inserted_queued_and_swept_rows_stay_failed(self):
+        with mock.patch.dict(os.environ, {'ASYNC_SETTLEMENT': '1'}), CaptureQueriesContext(connection) as ctx:
+            r = self.client.post('/api/v1/withdrawals', {'amount': '5.00'}, format='json')
+        self.assertEqual(r.status_code, 202)
+        self.assertEqual(_writes(ctx), (1, 0))
+        wr = WithdrawalRequest.objects.get()
+        self.assertEqual(wr.status, 'QUEUED')
+        # The sweeper fails it mid-batch; the late settlement result cannot revive it
+        batch = batch_dispatch.claim(10)
+        holds.release_hold(wr.id)
+        withdrawals.transition_many([wr.id], 'FAILED')
+        batch_dispatch.finalize({str(wr.id): {'status': 'SUCCESS'}}, [b.id for b in batch])
+        self.assertEqual(WithdrawalRequest.objects.get().status, 'FAILED')
@@ -1,13 +1,17 @@
 from django.urls import path
-from .views import MyTokenObtainPairView, register, admin_approve, admin_topup_pool, me, create_withdrawal
-from rest_framework_simplejwt.views import TokenRefreshView
+from .views import MyTokenObtainPairView, MyTokenRefreshView, logout, register, admin_approve, admin_topup_pool, admin_request_log_stats, admin_balances_at, admin_export, me, create_withdrawal, ledger
 
 urlpatterns = [
     path('auth/register', register),
     path('auth/token', MyTokenObtainPairView.as_view()),
-    path('auth/token/refresh', TokenRefreshView.as_view()),
+    path('auth/token/refresh', MyTokenRefreshView.as_view()),
+    path('auth/logout', logout),
     path('admin/approve', admin_approve),
     path('admin/pool/topup', admin_topup_pool),
+    path('admin/request-log/stats', admin_request_log_stats),
+    path('admin/balances/at', admin_balances_at),
+    path('admin/export/<str:kind>', admin_export),
     path('me', me),
     path('withdrawals', create_withdrawal),
+    path('ledger', ledger),
 ]
@@ -7,34 +7,211 @@ from __future__ import annotations
 import os
 import time
 import redis
+import redis.client
+
+from .. import metrics
+from ..metrics import timed
+
+
+class _CountedPipeline(redis.client.Pipeline):
+    def execute(self, raise_on_error=True):
+        metrics.redis_call('PIPELINE')
+        return super().execute(raise_on_error)
+
+
+class _CountedRedis(redis.Redis):
+    # Every command and script call goes through execute_command; counted for payments.metrics
+    def execute_command(self, *args, **options):
+        metrics.redis_call(args[0])
+        return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return _CountedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
 
 # Initialize a Redis connection using REDIS_URL or default to the docker-compose service
-_redis = redis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'), decode_responses=True)
+_redis = _CountedRedis.from_url(os.getenv('REDIS_URL', 'redis://redis:6379/0'), decode_responses=True)
+
+def redis_client() -> redis.Redis:
+    """Shared Redis connection (command counts feed payments.metrics)."""
+    return _redis
+
+# --- Rate limiting (GCRA) ---
+# rl:<subject> holds the theoretical arrival time (TAT) in ms. A request costs
+# `emission_ms` (period / limit); it is admitted while TAT - now stays within
+# emission_ms * burst. Any window of one period therefore admits at most
+# limit + burst requests, with no boundary doubling. The clock is Redis TIME, so
+# workers with skewed clocks agree.
+_gcra_take = _redis.register_script("""
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local emission = tonumber(ARGV[1])
+local tolerance = emission * tonumber(ARGV[2])
+local want = tonumber(ARGV[3])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now)
+local granted = math.min(want, math.floor((now + tolerance - tat) / emission))
+if granted < 1 then
+  return {0, tat + emission - tolerance - now, 0}
+end
+tat = tat + granted * emission
+redis.call('SET', KEYS[1], tat, 'PX', math.ceil(tat - now) + 1000)
+return {granted, 0, math.floor((now + tolerance - tat) / emission)}
+""")
+
+@timed('cache.gcra_take')
+def gcra_take(subject: str, emission_ms: float, burst: int, want: int = 1) -> tuple[int, int, int]:
+    """
+    Take up to `want` tokens for `subject` in one round trip. Returns
+    (granted, retry_after_ms, remaining); granted is 0 when rate limited.
+    """
+    granted, retry_ms, remaining = _gcra_take(keys=[f"rl:{subject}"], args=[emission_ms, burst, want])
+    return int(granted), int(retry_ms), int(remaining)
+
+# --- Credit reservation front ---
+# Counters hold available credit in integer cents as seen by Redis: the DB balance
+# minus reservations that have not been written to Postgres yet.
+CREDIT_READY_KEY = 'credit:ready'
+CREDIT_POOL_KEY = 'credit:pool'
+CREDIT_PENDING_KEY = 'credit:pend'      # hash merchant_id -> reserved, unapplied cents
+CREDIT_HOLDS_KEY = 'credit:holds'       # hash reservation_id -> "merchant_id,cents,ts,state"
+CREDIT_QUEUE_KEY = 'credit:apply'       # committed reservations waiting for the DB writer
+CREDIT_INFLIGHT_KEY = 'credit:apply:inflight'
+
+def credit_avail_key(merchant_id: int) -> str:
+    return f"credit:avail:{merchant_id}"
+
+_credit_reserve = _redis.register_script("""
+if redis.call('EXISTS', KEYS[4]) == 0 then return 'BYPASS' end
+local avail = redis.call('GET', KEYS[1])
+if not avail then return 'MISS' end
+local amt = tonumber(ARGV[1])
+if tonumber(avail) < amt then return 'INSUFFICIENT_MERCHANT_CREDIT' end
+if tonumber(redis.call('GET', KEYS[2]) or '0') < amt then return 'INSUFFICIENT_POOL' end
+redis.call('DECRBY', KEYS[1], amt)
+redis.call('DECRBY', KEYS[2], amt)
+redis.call('HINCRBY', KEYS[3], ARGV[2], amt)
+redis.call('HSET', KEYS[5], ARGV[3], ARGV[2] .. ',' .. ARGV[1] .. ',' .. ARGV[4] .. ',held')
+return 'OK'
+""")
 
-def cache_get(key: str) -> str | None:
-    """Return cached string or None."""
-    return _redis.get(key)
+_credit_release = _redis.register_script("""
+local hold = redis.call('HGET', KEYS[3], ARGV[1])
+if not hold or string.find(hold, ',committed$') then return 0 end
+local mid, amt = string.match(hold, '^(%d+),(%d+),')
+if mid ~= ARGV[2] then return redis.error_reply('RESERVATION_MERCHANT_MISMATCH') end
+redis.call('HDEL', KEYS[3], ARGV[1])
+redis.call('HINCRBY', KEYS[2], mid, -tonumber(amt))
+if redis.call('EXISTS', KEYS[4]) == 1 then redis.call('INCRBY', KEYS[4], amt) end
+if redis.call('EXISTS', KEYS[1]) == 1 then redis.call('INCRBY', KEYS[1], amt) end
+return 1
+""")
 
-def cache_set(key: str, value: str, ttl_sec: int) -> None:
-    """Set a cache key with TTL."""
-    _redis.setex(key, ttl_sec, value)
+_credit_commit = _redis.register_script("""
+local hold = redis.call('HGET', KEYS[1], ARGV[1])
+if not hold then return 0 end
+redis.call('HSET', KEYS[1], ARGV[1], (string.gsub(hold, ',held$', ',committed')))
+redis.call('RPUSH', KEYS[2], ARGV[2])
+return 1
+""")
 
-def cache_del(key: str) -> None:
-    """Delete a cache key if exists."""
-    _redis.delete(key)
+_credit_claim = _redis.register_script("""
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+  redis.call('LTRIM', KEYS[1], #items, -1)
+  redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+""")
 
-def rate_limit_allow(key: str, max_requests: int, window_seconds: int) -> tuple[bool, int]:
+_credit_applied = _redis.register_script("""
+for i = 1, #ARGV do
+  local hold = redis.call('HGET', KEYS[1], ARGV[i])
+  if hold then
+    local mid, amt = string.match(hold, '^(%d+),(%d+),')
+    redis.call('HDEL', KEYS[1], ARGV[i])
+    redis.call('HINCRBY', KEYS[2], mid, -tonumber(amt))
+  end
+end
+redis.call('DEL', KEYS[3])
+return #ARGV
+""")
+
+@timed('cache.credit_reserve')
+def credit_reserve(merchant_id: int, cents: int, reservation_id: str) -> str:
+    """
+    Atomically check and decrement merchant + pool counters. Returns 'OK',
+    'INSUFFICIENT_MERCHANT_CREDIT', 'INSUFFICIENT_POOL', 'MISS' (merchant
+    counter not loaded) or 'BYPASS' (counters not built; use the DB path).
+    """
+    return _credit_reserve(
+        keys=[credit_avail_key(merchant_id), CREDIT_POOL_KEY, CREDIT_PENDING_KEY, CREDIT_READY_KEY, CREDIT_HOLDS_KEY],
+        args=[cents, merchant_id, reservation_id, int(time.time())],
+    )
+
+@timed('cache.credit_release')
+def credit_release(reservation_id: str, merchant_id: int) -> bool:
+    """Give a held reservation back to the counters (settlement failed)."""
+    return bool(_credit_release(
+        keys=[CREDIT_POOL_KEY, CREDIT_PENDING_KEY, CREDIT_HOLDS_KEY, credit_avail_key(merchant_id)],
+        args=[reservation_id, merchant_id],
+    ))
+
+@timed('cache.credit_commit')
+def credit_commit(reservation_id: str, payload: str) -> bool:
+    """Mark a reservation as settled and queue it for the DB writer."""
+    return bool(_credit_commit(keys=[CREDIT_HOLDS_KEY, CREDIT_QUEUE_KEY], args=[reservation_id, payload]))
+
+@timed('cache.credit_claim')
+def credit_claim(batch_size: int) -> list[str]:
+    """Move up to `batch_size` queued reservations to the in-flight list and return them."""
+    return _credit_claim(keys=[CREDIT_QUEUE_KEY, CREDIT_INFLIGHT_KEY], args=[batch_size])
+
+def credit_inflight() -> list[str]:
+    """Reservations claimed by a writer that never acknowledged them."""
+    return _redis.lrange(CREDIT_INFLIGHT_KEY, 0, -1)
+
+@timed('cache.credit_applied')
+def credit_applied(reservation_ids: list[str]) -> None:
+    """Drop holds that are now durable in Postgres and clear the in-flight list."""
+    _credit_applied(keys=[CREDIT_HOLDS_KEY, CREDIT_PENDING_KEY, CREDIT_INFLIGHT_KEY], args=reservation_ids)
+
+# --- Idempotency keys ---
+# idem:<key> holds JSON {"h": request_hash, "t": claim_token} while in flight and
+# {"h": request_hash, "r": response} once done. IDEMPOTENCY_SINCE_KEY records when
+# this Redis started tracking keys, so older keys are looked up in Postgres.
+IDEMPOTENCY_SINCE_KEY = 'idem:since'
+
+def idempotency_key(key: str) -> str:
+    return f"idem:{key}"
+
+_idem_claim = _redis.register_script("""
+local cur = redis.call('GET', KEYS[1])
+if cur then return {'EXISTS', cur} end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[2]))
+local since = redis.call('GET', KEYS[2])
+if not since then
+  redis.call('SET', KEYS[2], ARGV[3])
+  since = ARGV[3]
+end
+return {'CLAIMED', since}
+""")
+
+_idem_release = _redis.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+""")
+
+@timed('cache.idempotency_claim')
+def idempotency_claim(key: str, marker: str, ttl_sec: int) -> tuple[str, str]:
     """
-    Token-bucket style rate limiting using Redis. Returns a tuple:
-    (allowed: bool, remaining: int).
-    Uses a simple counter per window bucket (current epoch/window).
+    SET NX the in-flight marker. Returns ('CLAIMED', since_epoch) or
+    ('EXISTS', current_value) in one round trip.
     """
-    now = int(time.time())
-    bucket = now // window_seconds
-    rkey = f"rl:{key}:{bucket}"
-    pipe = _redis.pipeline()
-    pipe.incr(rkey, 1)
-    pipe.expire(rkey, window_seconds + 2)
-    count, _ = pipe.execute()
-    remaining = max(0, max_requests - int(count))
-    return count <= max_requests, remaining
\ No newline at end of file
+    verdict, value = _idem_claim(keys=[idempotency_key(key), IDEMPOTENCY_SINCE_KEY],
+                                 args=[marker, ttl_sec, int(time.time())])
+    return verdict, value
+
+@timed('cache.idempotency_release')
+def idempotency_release(key: str, marker: str) -> bool:
+    """Delete the key only if it still holds our in-flight marker."""
+    return bool(_idem_release(keys=[idempotency_key(key)], args=[marker]))
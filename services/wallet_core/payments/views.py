@@ -1,35 +1,70 @@
 from __future__ import annotations
+import logging
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import AllowAny
-from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
 from django.views.decorators.csrf import csrf_exempt
-from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.contrib.auth.models import User
 from django.db import transaction
-import requests, hashlib, json
-from .utils.cache import cache_get, cache_set, cache_del, rate_limit_allow
+import hashlib, json
 from .tasks import dispatch_settlement
 import os
-from django.core.serializers.json import DjangoJSONEncoder
-from .serializers import RegisterSerializer, ApproveSerializer, TopupPoolSerializer, WithdrawalCreateSerializer
-from .models import Merchant, WalletAccount, MerchantCredit, CreditPool, WithdrawalRequest, IdempotencyRecord, ApiRequestLog
+from .serializers import (
+    RegisterSerializer, ApproveSerializer, TopupPoolSerializer, WithdrawalCreateSerializer, BalanceAtQuerySerializer,
+    WithdrawalListQuerySerializer, LedgerListQuerySerializer, WithdrawalSerializer, LedgerEntrySerializer,
+    ExportQuerySerializer,
+)
+from .models import Merchant, WalletAccount, MerchantCredit, CreditPool, WithdrawalRequest, LedgerEntry
 from .models import atomic_consume_credit
 from .permissions import IsAdmin
 from .services import create_merchant, approve_merchant
+from . import authentication, balances, batch_dispatch, credit_front, export, history, holds, idempotency, metrics, profile_cache, ratelimit, request_log, settlement_client, withdrawals
+
+logger = logging.getLogger(__name__)
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
-        token['username'] = user.username
+        # Claims let ClaimsJWTAuthentication skip the User/Merchant lookups
+        authentication.apply_claims(token, user)
+        authentication.bind_refresh(token)
         return token
 
 class MyTokenObtainPairView(TokenObtainPairView):
     serializer_class = MyTokenObtainPairSerializer
 
+class MyTokenRefreshSerializer(TokenRefreshSerializer):
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        # Re-read the claims: copying them from the refresh token would keep stale approval state
+        refresh = self.token_class(attrs['refresh'])
+        authentication.check_not_revoked(refresh, check_user=False)
+        user = User.objects.filter(id=refresh['user_id'], is_active=True).first()
+        if user is None:
+            raise AuthenticationFailed('User not found', code='user_not_found')
+        access = refresh.access_token
+        access.set_iat()
+        authentication.apply_claims(access, user)
+        data['access'] = str(access)
+        return data
+
+class MyTokenRefreshView(TokenRefreshView):
+    serializer_class = MyTokenRefreshSerializer
+
+@api_view(['POST'])
+def logout(request):
+    # Deny-list the presented access token and its refresh token until they expire
+    if request.auth is None:
+        return Response({'detail': 'NO_TOKEN'}, status=400)
+    authentication.revoke_token(request.auth)
+    return Response(status=204)
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def register(request):
@@ -52,70 +87,159 @@ def admin_approve(request):
 def admin_topup_pool(request):
     s = TopupPoolSerializer(data=request.data)
     s.is_valid(raise_exception=True)
-    pool = CreditPool.get_solo()
-    with transaction.atomic():
-        pool = CreditPool.objects.select_for_update().get(id=1)
-        pool.available_amount = pool.available_amount + s.validated_data['amount']
-        pool.save(update_fields=['available_amount','updated_at'])
-    return Response({'pool_available': str(pool.available_amount)})
+    # Spread across stripes when CREDIT_POOL_STRIPES > 1; the response reports the aggregate
+    total = CreditPool.topup(s.validated_data['amount'])
+    if credit_front.enabled():
+        credit_front.adjust_pool(s.validated_data['amount'])
+    return Response({'pool_available': str(total)})
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def admin_request_log_stats(request):
+    # Per-process counters of the buffered audit writer (dropped = audit records lost)
+    return Response(request_log.stats())
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def admin_balances_at(request):
+    # Nearest checkpoint at or before `at` plus the ledger rows since it; no full-table aggregate
+    s = BalanceAtQuerySerializer(data=request.query_params)
+    s.is_valid(raise_exception=True)
+    at = s.validated_data['at']
+    data = {'pool': balances.pool_balance_at(at)}
+    if 'merchant_id' in s.validated_data:
+        if not Merchant.objects.filter(id=s.validated_data['merchant_id']).exists():
+            return Response({'detail': 'MERCHANT_NOT_FOUND'}, status=404)
+        data['merchant'] = balances.merchant_balance_at(s.validated_data['merchant_id'], at)
+    return Response(data)
+
+@api_view(['GET'])
+@permission_classes([IsAdmin])
+def admin_export(request, kind):
+    # Server-side cursor -> encoder -> (gzip) -> client, one chunk at a time; memory stays flat
+    if kind not in export.EXPORTS:
+        return Response({'detail': 'UNKNOWN_EXPORT'}, status=404)
+    s = ExportQuerySerializer(data=request.query_params)
+    s.is_valid(raise_exception=True)
+    v = s.validated_data
+    after = (v['after_created_at'], v['after_id']) if 'after_id' in v else None
+    body = export.stream(kind, v['fmt'], v['gzip'], created_from=v.get('created_from'),
+                         created_to=v.get('created_to'), merchant_id=v.get('merchant_id'), after=after)
+    filename = f"{kind}.{v['fmt']}" + ('.gz' if v['gzip'] else '')
+    resp = StreamingHttpResponse(body, content_type='application/gzip' if v['gzip'] else export.CONTENT_TYPES[v['fmt']])
+    resp['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return resp
 
 @api_view(['GET'])
 def me(request):
-    # Cached profile for 30 seconds to reduce DB load under heavy read traffic
-    cache_key = f"me:{request.user.id}"
-    cached = cache_get(cache_key)
-    if cached:
-        return Response(json.loads(cached))
-    m = request.user.merchant
-    mc = m.credit
-    acc = m.account
-    data = {
-        'merchant_id': m.id,
-        'username': request.user.username,
-        'is_approved': m.is_approved,
-        'account_id': acc.id,
-        'bank_account': m.bank_account,
-        'credit_limit': str(mc.credit_limit),
-        'utilized_amount': str(mc.utilized_amount),
-        'available_credit': str(mc.available),
-    }
-    cache_set(cache_key, json.dumps(data, cls=DjangoJSONEncoder), ttl_sec=30)    
+    # Two-tier profile cache (in-process LRU + Redis), invalidated by per-merchant versions
+    try:
+        data = profile_cache.get_profile(request.user.id)
+    except Merchant.DoesNotExist:
+        return Response({'detail': 'NOT_A_MERCHANT'}, status=404)
     return Response(data)
 
 
 def _log_request(request, status_code:int, payload:dict):
-    ApiRequestLog.objects.create(
-        path=request.path, method=request.method, status=status_code,
-        actor=request.user.username if request.user.is_authenticated else '',
-        payload=payload)
+    # Buffered by default: the flusher thread bulk-inserts, the request does not wait
+    with metrics.phase('withdrawal.request_log'):
+        request_log.log(
+            path=request.path, method=request.method, status=status_code,
+            actor=request.user.username if request.user.is_authenticated else '',
+            payload=payload)
 
-@api_view(['POST'])
+def _mark_failed(wr, reservation: str | None = None, held: bool = False) -> str:
+    # Returns the row's status: FAILED, or the final state the hold sweeper already moved it to
+    try:
+        with transaction.atomic():
+            withdrawals.transition(wr, 'FAILED')
+            if held:
+                holds.release_hold(wr.id)
+    except withdrawals.IllegalTransition:
+        wr.status = WithdrawalRequest.objects.filter(id=wr.id).values_list('status', flat=True).first()
+        logger.warning("withdrawal %s was already %s when its settlement failed", wr.id, wr.status)
+    if reservation:
+        credit_front.release(reservation, wr.merchant_id)
+    return wr.status
+
+def _mark_review(wr, bank_reference: str) -> None:
+    # The bank paid but the credit could not be taken: keep the reference for reconciliation
+    logger.error("withdrawal %s paid by the bank but its credit could not be taken; flagged for review", wr.id)
+    try:
+        withdrawals.transition(wr, 'REVIEW', bank_reference=bank_reference)
+    except withdrawals.IllegalTransition:
+        wr.status = WithdrawalRequest.objects.filter(id=wr.id).values_list('status', flat=True).first()
+
+def _history_page(request, query_serializer, qs_for, item_serializer):
+    # Keyset pages on (created_at, id); no OFFSET, so deep pages cost the same as the first
+    q = query_serializer(data=request.query_params)
+    q.is_valid(raise_exception=True)
+    try:
+        merchant_id = request.user.merchant.id
+    except Merchant.DoesNotExist:
+        return Response({'detail': 'NOT_A_MERCHANT'}, status=404)
+    try:
+        rows, next_cursor = history.keyset_page(qs_for(merchant_id, q.validated_data), q.validated_data)
+    except history.InvalidCursor:
+        return Response({'detail': 'INVALID_CURSOR'}, status=400)
+    return Response({'results': item_serializer(rows, many=True).data, 'next_cursor': next_cursor})
+
+def _withdrawals_qs(merchant_id, f):
+    qs = WithdrawalRequest.objects.filter(merchant_id=merchant_id)
+    return qs.filter(status=f['status']) if f.get('status') else qs
+
+def _ledger_qs(merchant_id, f):
+    qs = LedgerEntry.objects.filter(merchant_id=merchant_id)
+    for field in ('direction', 'source', 'tx_id'):
+        if f.get(field):
+            qs = qs.filter(**{field: f[field]})
+    return qs
+
+@api_view(['GET'])
+def ledger(request):
+    return _history_page(request, LedgerListQuerySerializer, _ledger_qs, LedgerEntrySerializer)
+
+@api_view(['GET', 'POST'])
 def create_withdrawal(request):
     """
-    Create a withdrawal request while enforcing per-merchant rate limits,
-    supporting idempotency, and optionally offloading settlement to a Celery task.
+    GET lists the merchant's withdrawals (keyset pages). POST creates a withdrawal
+    request while enforcing per-merchant rate limits, supporting idempotency, and
+    optionally offloading settlement to a Celery task.
     """
-    # Rate limiting: configurable via env RL_WINDOW_SEC and RL_MAX_REQUESTS
-    rl_window = int(os.getenv('RL_WINDOW_SEC', '60'))
-    rl_limit = int(os.getenv('RL_MAX_REQUESTS', '120'))
-    allow, remain = rate_limit_allow(f"merchant:{request.user.id}:withdrawals", rl_limit, rl_window)
-    if not allow:
+    if request.method == 'GET':
+        return _history_page(request, WithdrawalListQuerySerializer, _withdrawals_qs, WithdrawalSerializer)
+    # Rate limiting: GCRA per merchant tier (settings.RATE_LIMIT_TIERS)
+    with metrics.phase('withdrawal.ratelimit'):
+        decision = ratelimit.allow_withdrawal(request.user.id, getattr(request.user, 'rate_tier', None))
+    if not decision.allowed:
         _log_request(request, 429, {'phase':'ratelimit_exceeded'})
-        return Response({'detail': 'RATE_LIMITED', 'retry_in_seconds': rl_window}, status=429)
+        return Response({'detail': 'RATE_LIMITED', 'retry_in_seconds': decision.retry_after_s}, status=429)
 
-    # Handle idempotency key; compute request hash
+    # Handle idempotency key: claim it in Redis before doing any work
     idem_key = request.headers.get('Idempotency-Key')
+    if not idem_key:
+        return _process_withdrawal(request)
     raw = json.dumps(request.data, sort_keys=True)
     req_hash = hashlib.sha256(raw.encode()).hexdigest()
-    if idem_key:
-        try:
-            rec = IdempotencyRecord.objects.get(key=idem_key)
-            if rec.request_hash == req_hash:
-                return Response(rec.response_json, status=200)
-            else:
-                return Response({'detail':'IDEMPOTENCY_KEY_CONFLICT'}, status=409)
-        except IdempotencyRecord.DoesNotExist:
-            pass
+    with metrics.phase('withdrawal.idempotency'):
+        claim = idempotency.begin(idem_key, req_hash)
+    if claim.verdict == 'REPLAY':
+        return Response(claim.response, status=200)
+    if claim.verdict == 'CONFLICT':
+        return Response({'detail':'IDEMPOTENCY_KEY_CONFLICT'}, status=409)
+    if claim.verdict == 'IN_PROGRESS':
+        return Response({'detail':'IDEMPOTENCY_KEY_IN_PROGRESS'}, status=409)
+    resp = None
+    try:
+        resp = _process_withdrawal(request, claim)
+    finally:
+        # Accepted/finalized outcomes were recorded with the withdrawal's status write;
+        # anything else frees the key for a retry
+        if resp is None or resp.status_code not in (200, 202):
+            idempotency.release(claim)
+    return resp
+
+def _process_withdrawal(request, claim=None):
     # Validate payload using serializer
     s = WithdrawalCreateSerializer(data=request.data)
     s.is_valid(raise_exception=True)
@@ -125,65 +249,98 @@ def create_withdrawal(request):
     account = m.account
     amt = s.validated_data['amount']
 
-    # Create withdrawal record in PENDING state
-    wr = WithdrawalRequest.objects.create(merchant=m, account=account, amount=amt, status='PENDING')
+    # Optional Redis admission: reject over-limit requests before any DB write
+    reservation = None
+    if credit_front.enabled():
+        verdict, reservation = credit_front.reserve(m, amt)
+        if verdict.startswith('INSUFFICIENT_'):
+            _log_request(request, 409, {'phase':'front_rejected','detail':verdict})
+            return Response({'detail': verdict}, status=409)
+
+    # Insert the withdrawal once, already in the state it is known to be in
+    # (payments.withdrawals), in the same transaction as its credit hold
+    queued = os.getenv('ASYNC_SETTLEMENT','0') == '1'
+    wr = WithdrawalRequest(merchant=m, account=account, amount=amt, status='QUEUED' if queued else 'PENDING')
+    if queued:
+        # Kept on the row for the batcher, and for a re-dispatch after a stale claim is reaped
+        wr.reservation_id = reservation or ''
+    out = {'withdrawal_id': str(wr.id), 'status': 'QUEUED'}
+
+    def insert():
+        wr.save(force_insert=True)
+        if queued and claim is not None:
+            idempotency.finish(claim, out)
+
+    held, rejected = False, None
+    with metrics.phase('withdrawal.hold'):
+        if reservation is None and holds.enabled():
+            # Hold the credit before calling settlement so over-limit requests never reach the bank
+            try:
+                holds.hold_credit(wr, then=insert)
+                held = True
+            except ValueError as ve:
+                rejected = str(ve)
+                wr.status = 'FAILED'
+                wr.save(force_insert=True)
+        else:
+            with transaction.atomic():
+                insert()
+    if rejected:
+        _log_request(request, 409, {'phase':'hold_rejected','detail':rejected})
+        return Response({'detail': rejected}, status=409)
 
     # Async offloading if enabled via ASYNC_SETTLEMENT=1
-    if os.getenv('ASYNC_SETTLEMENT','0') == '1':
-        wr.status = 'QUEUED'
-        wr.save(update_fields=['status'])
-        dispatch_settlement.delay(str(wr.id))
-        out = {'withdrawal_id': str(wr.id), 'status': 'QUEUED'}
-        if idem_key:
-            IdempotencyRecord.objects.create(key=idem_key, request_hash=req_hash, response_json=out)
+    if queued:
+        if not batch_dispatch.enabled():
+            dispatch_settlement.delay(str(wr.id), reservation_id=reservation)
         _log_request(request, 202, {'phase':'queued_async'})
         return Response(out, status=202)
 
-    headers = {'Authorization': f"Bearer {settings.INTERNAL_TOKEN}", 'Content-Type': 'application/json'}
     try:
-        r = requests.post(settings.SETTLEMENT_URL, json={
-            'merchant_id': m.id,
-            'account_id': str(account.id),
-            'amount': str(amt),
-            'bank_account': m.bank_account
-        }, headers=headers, timeout=10)
+        with metrics.phase('withdrawal.settlement'):
+            r = settlement_client.settle({
+                'merchant_id': m.id,
+                'account_id': str(account.id),
+                'amount': str(amt),
+                'bank_account': m.bank_account
+            })
         if r.status_code != 200:
-            wr.status = 'FAILED'
-            wr.save(update_fields=['status'])
+            _mark_failed(wr, reservation, held)
             _log_request(request, r.status_code, {'phase':'settlement_failed','resp':r.text})
             return Response({'detail':'SETTLEMENT_FAILED'}, status=502)
         resp = r.json()
         if resp.get('status') != 'SUCCESS':
-            wr.status = 'FAILED'
-            wr.save(update_fields=['status'])
+            _mark_failed(wr, reservation, held)
             return Response({'detail':'SETTLEMENT_REJECTED'}, status=502)
     except Exception as exc:
-        wr.status = 'FAILED'
-        wr.save(update_fields=['status'])
+        _mark_failed(wr, reservation, held)
         _log_request(request, 502, {'phase':'settlement_exception','error':str(exc)})
         return Response({'detail':'SETTLEMENT_ERROR'}, status=502)
 
-    try:
-        tx_id = atomic_consume_credit(m, account, amt)
-    except ValueError as ve:
-        wr.status = 'FAILED'
-        wr.save(update_fields=['status'])
-        return Response({'detail': str(ve)}, status=409)
-
-    wr.status = 'SUCCESS'
-    wr.bank_reference = resp.get('bank_reference','')
-    wr.save(update_fields=['status','bank_reference'])
-
-    cache_del(f"me:{request.user.id}")
-
-    out = {
-        'withdrawal_id': str(wr.id),
-        'status':'SUCCESS',
-        'amount': str(amt),
-        'bank_reference': wr.bank_reference,
-        'tx_id': str(tx_id)
-    }
-    if idem_key:
-        IdempotencyRecord.objects.create(key=idem_key, request_hash=req_hash, response_json=out)
+    if reservation:
+        # Ledger rows are written by the batched front writer
+        tx_id = credit_front.commit(reservation, m, account, amt)
+    elif not held:
+        try:
+            tx_id = atomic_consume_credit(m, account, amt)
+        except ValueError as ve:
+            _mark_review(wr, resp.get('bank_reference', ''))
+            return Response({'detail': str(ve)}, status=409)
+
+    # Final status, ledger capture and idempotency record commit together
+    with metrics.phase('withdrawal.finalize'), transaction.atomic():
+        # The status UPDATE locks the withdrawal before the hold, the order the hold sweeper uses
+        withdrawals.transition(wr, 'SUCCESS', bank_reference=resp.get('bank_reference',''))
+        if held:
+            tx_id = holds.capture_hold(wr.id)
+        out = {
+            'withdrawal_id': str(wr.id),
+            'status':'SUCCESS',
+            'amount': str(amt),
+            'bank_reference': wr.bank_reference,
+            'tx_id': str(tx_id)
+        }
+        if claim is not None:
+            idempotency.finish(claim, out)
     _log_request(request, 200, {'phase':'finalized','resp':out})
     return Response(out, status=200)
@@ -0,0 +1,77 @@
+"""
+Withdrawal status machine.
+
+    PENDING  -> SUCCESS | FAILED          synchronous settlement
+    QUEUED   -> SETTLING                  claimed before the settlement call (task or batch dispatcher)
+    QUEUED   -> SUCCESS | FAILED          hold sweeper, rows settled before the SETTLING claim
+    SETTLING -> SUCCESS | FAILED | QUEUED settlement finalized or requeued
+    PENDING  -> QUEUED                    rows created before withdrawals were inserted QUEUED
+    *        -> REVIEW                    the bank paid a withdrawal whose credit could not be taken
+
+SUCCESS, FAILED and REVIEW are final; the one exception is FAILED -> REVIEW,
+a bank confirmation arriving after the row was failed. REVIEW rows carry the
+bank reference and need manual reconciliation. Every status write goes
+through this module as a guarded `UPDATE ... WHERE status IN (<legal
+sources>)`, so a late writer (a retried task, the hold sweeper) can never
+move a final row.
+
+To keep row versions down, a withdrawal is inserted in the state already
+known at insert time: QUEUED for async settlement, FAILED when its credit
+hold is refused. Async rows are claimed SETTLING before the settlement call
+so the hold sweeper cannot fail them mid-call; otherwise a row is updated
+once more, to its final state, in the same transaction as the ledger writes
+and the idempotency record.
+"""
+
+from __future__ import annotations
+
+from .models import WithdrawalRequest
+
+TRANSITIONS = {
+    'PENDING': ('QUEUED', 'SUCCESS', 'FAILED', 'REVIEW'),
+    'QUEUED': ('SETTLING', 'SUCCESS', 'FAILED', 'REVIEW'),
+    'SETTLING': ('QUEUED', 'SUCCESS', 'FAILED', 'REVIEW'),
+    'SUCCESS': (),
+    'FAILED': ('REVIEW',),
+    'REVIEW': (),
+}
+FINAL = ('SUCCESS', 'FAILED', 'REVIEW')
+
+
+class IllegalTransition(ValueError):
+    pass
+
+
+def sources(to: str) -> tuple[str, ...]:
+    """Statuses a withdrawal may move to `to` from."""
+    return tuple(s for s, targets in TRANSITIONS.items() if to in targets)
+
+
+def advance(wr: WithdrawalRequest, to: str, **fields) -> None:
+    """Set `wr.status` (and `fields`) in memory; the caller holds the row lock and saves."""
+    if to not in TRANSITIONS.get(wr.status, ()):
+        raise IllegalTransition(f'{wr.status} -> {to}')
+    wr.status = to
+    for name, value in fields.items():
+        setattr(wr, name, value)
+
+
+def transition(wr: WithdrawalRequest, to: str, **fields) -> None:
+    """
+    Move one withdrawal to `to` with a single guarded UPDATE (which also takes
+    its row lock). Raises IllegalTransition if the row was not in a source state.
+    """
+    # created_at prunes the scan to one monthly partition
+    updated = (WithdrawalRequest.objects.filter(id=wr.id, created_at=wr.created_at, status__in=sources(to))
+               .update(status=to, **fields))
+    if not updated:
+        current = WithdrawalRequest.objects.filter(id=wr.id).values_list('status', flat=True).first()
+        raise IllegalTransition(f'{current} -> {to}')
+    wr.status = to
+    for name, value in fields.items():
+        setattr(wr, name, value)
+
+
+def transition_many(ids, to: str, **fields) -> int:
+    """Move every withdrawal in `ids` that is in a source state of `to`; others are left alone. Returns rows moved."""
+    return WithdrawalRequest.objects.filter(id__in=ids, status__in=sources(to)).update(status=to, **fields)
@@ -0,0 +1,121 @@
+"""
+Compare credit consumption engines (CREDIT_ENGINE=locking|sql|group) and pool
+stripe counts (CREDIT_POOL_STRIPES) against a real Postgres: throughput,
+latency percentiles and SQL statements per withdrawal.
+
+Creates `bench_c*` merchants, tops the pool up by exactly what the run will
+consume and deletes the merchants (with their ledger rows) afterwards.
+
+Run from the repo root against the docker Postgres (bypass PgBouncer or not,
+to compare), e.g.:
+  DB_HOST=127.0.0.1 DB_PORT=5432 python tests/bench/bench_consume_engines.py \
+    --threads 16 --merchants 32 --ops 200
+
+  # does striping scale? (1 stripe vs 4 vs 8 on the row-locking engine)
+  ... bench_consume_engines.py --engines locking --stripes 1,4,8
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "wallet_core"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection, close_old_connections  # noqa: E402
+from django.test.utils import CaptureQueriesContext, override_settings  # noqa: E402
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, atomic_consume_credit  # noqa: E402
+
+AMOUNT = Decimal("1.00")
+
+
+def seed(n: int, limit: Decimal):
+    User.objects.filter(username__startswith="bench_c").delete()
+    pairs = []
+    for i in range(n):
+        u = User.objects.create_user(username=f"bench_c{i}", password="p")
+        m = Merchant.objects.create(user=u, is_approved=True)
+        acc = WalletAccount.objects.create(merchant=m)
+        MerchantCredit.objects.create(merchant=m, credit_limit=limit)
+        pairs.append((m, acc))
+    return pairs
+
+
+def run_engine(engine: str, pairs, threads: int, ops: int, stripes: int = 1) -> dict:
+    MerchantCredit.objects.filter(merchant__in=[m for m, _ in pairs]).update(utilized_amount=0)
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(ops))
+
+    def worker():
+        close_old_connections()
+        local = []
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    break
+                m, acc = pairs[i % len(pairs)]
+                t0 = time.perf_counter()
+                atomic_consume_credit(m, acc, AMOUNT)
+                local.append(time.perf_counter() - t0)
+        finally:
+            connection.close()
+        with lock:
+            latencies.extend(local)
+
+    with override_settings(CREDIT_ENGINE=engine, CREDIT_POOL_STRIPES=stripes):
+        CreditPool.topup(AMOUNT * ops)
+        # Statements per withdrawal, measured on a single uncontended call
+        CreditPool.topup(AMOUNT)
+        with CaptureQueriesContext(connection) as ctx:
+            atomic_consume_credit(*pairs[0], AMOUNT)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as ex:
+            for _ in range(threads):
+                ex.submit(worker)
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "engine": engine,
+        "stripes": stripes,
+        "ops": len(latencies),
+        "tps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 2),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 2),
+        "queries_per_op": len(ctx.captured_queries),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--engines", default="locking,sql,group")
+    ap.add_argument("--stripes", default="1", help="comma-separated CREDIT_POOL_STRIPES values")
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--merchants", type=int, default=32)
+    ap.add_argument("--ops", type=int, default=2000)
+    args = ap.parse_args()
+
+    pairs = seed(args.merchants, Decimal(args.ops + 1))
+    try:
+        for engine in args.engines.split(","):
+            for stripes in (int(n) for n in args.stripes.split(",")):
+                print(run_engine(engine, pairs, args.threads, args.ops, stripes))
+    finally:
+        User.objects.filter(username__startswith="bench_c").delete()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Memory profile of the streaming ledger export (payments.export): seeds N
+ledger rows for a `bench_export` merchant with one INSERT ... SELECT
+generate_series, then runs `manage.py export_rows ledger` in a child process
+and samples its RSS while it streams to /dev/null. A flat RSS curve (peak
+close to the 10% sample) is the expected result, whatever N is.
+
+--naive also exports the same rows the old way (a materialized queryset),
+for comparison; keep N modest with it.
+
+Run from the repo root against a real Postgres, e.g.:
+  DB_HOST=127.0.0.1 DB_PORT=5432 python tests/bench/bench_export.py --rows 10000000 --gzip
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+CORE = ROOT / "services" / "wallet_core"
+sys.path.insert(0, str(CORE))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from payments.models import Merchant, WalletAccount  # noqa: E402
+
+
+def seed(rows: int) -> Merchant:
+    User.objects.filter(username="bench_export").delete()
+    m = Merchant.objects.create(user=User.objects.create_user(username="bench_export", password="x"), is_approved=True)
+    acc = WalletAccount.objects.create(merchant=m)
+    t0 = time.perf_counter()
+    with connection.cursor() as cur:
+        # Pairs of entries, 1ms apart, ending now (inside the pre-created partitions)
+        cur.execute(
+            """
+            INSERT INTO payments_ledgerentry (id, tx_id, merchant_id, account_id, direction, source, amount, created_at)
+            SELECT gen_random_uuid(), md5((i / 2)::text)::uuid, %s, %s,
+                   CASE WHEN i %% 2 = 0 THEN 'DEBIT' ELSE 'CREDIT' END,
+                   CASE WHEN i %% 2 = 0 THEN 'CREDIT_POOL' ELSE 'MERCHANT_CREDIT' END,
+                   ((i / 2) %% 10000 + 1) / 100.0,
+                   now() - ((%s - i) * interval '1 millisecond')
+              FROM generate_series(0, %s - 1) AS i
+            """,
+            [m.id, acc.id, rows, rows],
+        )
+    print(f"seeded {rows} rows in {time.perf_counter() - t0:.1f}s")
+    return m
+
+
+def rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return 0
+
+
+def profile(cmd: list[str], interval: float) -> tuple[float, list[int]]:
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=CORE, env=os.environ.copy())
+    samples = []
+    while proc.poll() is None:
+        kb = rss_kb(proc.pid)
+        if kb:
+            samples.append(kb)
+        time.sleep(interval)
+    if proc.returncode:
+        raise SystemExit(f"{' '.join(cmd)} exited with {proc.returncode}")
+    return time.perf_counter() - t0, samples
+
+
+def report(label: str, rows: int, elapsed: float, samples: list[int]) -> None:
+    if not samples:
+        print(f"{label}: finished before the first sample ({elapsed:.2f}s)")
+        return
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] // 1024  # noqa: E731
+    print(f"{label}: {rows / elapsed:,.0f} rows/s over {elapsed:.1f}s; "
+          f"RSS MiB at 10%/50%/90%: {pick(0.1)}/{pick(0.5)}/{pick(0.9)}, "
+          f"peak {max(samples) // 1024}")
+
+
+NAIVE = (
+    "import json,sys;from payments.models import LedgerEntry;"
+    "rows=list(LedgerEntry.objects.filter(merchant_id={mid}).order_by('created_at','id').values());"
+    "open('/dev/null','w').write(''.join(json.dumps(r,default=str)+'\\n' for r in rows))"
+)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=10_000_000)
+    ap.add_argument("--fmt", choices=["ndjson", "csv"], default="ndjson")
+    ap.add_argument("--gzip", action="store_true")
+    ap.add_argument("--chunk-size", type=int, default=None)
+    ap.add_argument("--interval", type=float, default=0.25, help="RSS sampling interval (s)")
+    ap.add_argument("--naive", action="store_true", help="Also run the materialize-everything export")
+    ap.add_argument("--keep", action="store_true", help="Keep the seeded rows")
+    args = ap.parse_args()
+
+    m = seed(args.rows)
+    try:
+        cmd = [sys.executable, "manage.py", "export_rows", "ledger", "--merchant", str(m.id),
+               "--format", args.fmt, "--output", os.devnull]
+        if args.gzip:
+            cmd.append("--gzip")
+        if args.chunk_size:
+            cmd += ["--chunk-size", str(args.chunk_size)]
+        report("streaming", args.rows, *profile(cmd, args.interval))
+        if args.naive:
+            naive = [sys.executable, "manage.py", "shell", "-c", NAIVE.format(mid=m.id)]
+            report("materialized", args.rows, *profile(naive, args.interval))
+    finally:
+        if not args.keep:
+            with connection.cursor() as cur:
+                cur.execute("DELETE FROM payments_ledgerentry WHERE merchant_id = %s", [m.id])
+            User.objects.filter(username="bench_export").delete()
+
+
+if __name__ == "__main__":
+    main()
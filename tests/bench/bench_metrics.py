@@ -0,0 +1,96 @@
+"""
+Cost of the hot-path instrumentation (payments.metrics).
+
+1. One `metrics.phase()` block, with metrics disabled and enabled, against
+   an empty block.
+2. End to end: N synchronous withdrawals (settlement mocked) through the API
+   with METRICS_ENABLED off and on. Creates a `bench_metrics` merchant and
+   deletes it (with its rows) afterwards.
+
+Run from the repo root against a real Postgres and Redis, e.g.:
+  DB_HOST=127.0.0.1 DB_PORT=5432 REDIS_URL=redis://127.0.0.1:6379/0 python tests/bench/bench_metrics.py --n 500
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+import uuid
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "wallet_core"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+from payments import metrics  # noqa: E402
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool  # noqa: E402
+
+
+def timer_cost(n: int) -> dict:
+    def empty():
+        pass
+
+    def timed():
+        with metrics.phase("bench.block"):
+            pass
+
+    out = {"empty": timeit.timeit(empty, number=n) / n}
+    for name, flag in (("disabled", False), ("enabled", True)):
+        with override_settings(METRICS_ENABLED=flag):
+            out[name] = timeit.timeit(timed, number=n) / n
+    return out
+
+
+def end_to_end(n: int) -> dict:
+    User.objects.filter(username="bench_metrics").delete()
+    user = User.objects.create_user(username="bench_metrics", password="p")
+    m = Merchant.objects.create(user=user, is_approved=True, bank_account="IRB")
+    WalletAccount.objects.create(merchant=m)
+    MerchantCredit.objects.create(merchant=m, credit_limit=Decimal(2 * n))
+    CreditPool.topup(Decimal(2 * n))
+    client = APIClient()
+    client.force_authenticate(user)
+    out = {}
+    try:
+        with mock.patch("payments.settlement_client.settle") as post, \
+                override_settings(RATE_LIMIT_TIERS={"standard": {"limit": 10**9, "period_s": 1, "burst": 10**9}}):
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = {"status": "SUCCESS", "bank_reference": "BNK"}
+            for name, flag in (("disabled", False), ("enabled", True)):
+                with override_settings(METRICS_ENABLED=flag):
+                    t0 = time.perf_counter()
+                    for _ in range(n):
+                        r = client.post("/api/v1/withdrawals", {"amount": "1.00"}, format="json",
+                                        HTTP_IDEMPOTENCY_KEY=uuid.uuid4().hex)
+                        assert r.status_code == 200, r.data
+                    out[name] = (time.perf_counter() - t0) / n
+    finally:
+        User.objects.filter(username="bench_metrics").delete()
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--blocks", type=int, default=500_000, help="Iterations of the timer micro-benchmark")
+    ap.add_argument("--n", type=int, default=500, help="Withdrawals per mode end to end (0 skips it)")
+    args = ap.parse_args()
+
+    t = timer_cost(args.blocks)
+    print(f"phase() block: empty {t['empty'] * 1e9:,.0f} ns   disabled {t['disabled'] * 1e9:,.0f} ns   "
+          f"enabled {t['enabled'] * 1e9:,.0f} ns")
+    if args.n:
+        e = end_to_end(args.n)
+        print(f"withdrawal:    disabled {e['disabled'] * 1e3:.2f} ms   enabled {e['enabled'] * 1e3:.2f} ms   "
+              f"x{e['enabled'] / e['disabled']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
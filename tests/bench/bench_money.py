@@ -0,0 +1,105 @@
+"""
+Decimal vs integer minor-unit money (MONEY_MINOR_UNITS, payments.money).
+
+1. Arithmetic only: the balance check and the two balance updates of one
+   withdrawal, on in-memory MerchantCredit/CreditPool rows, as the locking
+   engine does them (q() + Decimal vs cents).
+2. Rendering: one amount through the API's MoneyField, Decimal vs cents.
+3. End to end: atomic_consume_credit against a real Postgres in each mode.
+   It creates a `bench_money` merchant and deletes it (with its ledger rows)
+   afterwards.
+
+Run from the repo root, e.g.:
+  DB_HOST=127.0.0.1 DB_PORT=5432 python tests/bench/bench_money.py --ops 2000
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "wallet_core"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from payments import money  # noqa: E402
+from payments.models import (  # noqa: E402
+    Merchant, WalletAccount, MerchantCredit, CreditPool, atomic_consume_credit, minor_of, q,
+)
+from payments.serializers import MoneyField  # noqa: E402
+
+AMOUNT = Decimal("1.00")
+
+
+def arithmetic(n: int) -> dict:
+    mc = MerchantCredit(credit_limit=Decimal("1000000.00"), utilized_amount=Decimal("12.34"),
+                        credit_limit_minor=100000000, utilized_amount_minor=1234)
+    pool = CreditPool(available_amount=Decimal("999999.99"), available_amount_minor=99999999)
+
+    def decimal_path():
+        amount = q(AMOUNT)
+        if mc.available < amount or pool.available_amount < amount:
+            raise ValueError
+        mc.utilized_amount = q(mc.utilized_amount) + amount
+        pool.available_amount = q(pool.available_amount) - amount
+
+    def minor_path():
+        cents = money.to_minor(AMOUNT)
+        if mc.available_minor < cents or minor_of(pool, "available_amount") < cents:
+            raise ValueError
+        mc.utilized_amount_minor = minor_of(mc, "utilized_amount") + cents
+        pool.available_amount_minor = minor_of(pool, "available_amount") - cents
+
+    return {name: n / timeit.timeit(fn, number=n) for name, fn in (("decimal", decimal_path), ("minor", minor_path))}
+
+
+def rendering(n: int) -> dict:
+    field = MoneyField()
+    return {
+        "decimal": n / timeit.timeit(lambda: field.to_representation(Decimal("1234.50")), number=n),
+        "minor": n / timeit.timeit(lambda: field.to_representation(123450), number=n),
+    }
+
+
+def end_to_end(ops: int) -> dict:
+    User.objects.filter(username="bench_money").delete()
+    m = Merchant.objects.create(user=User.objects.create_user(username="bench_money", password="p"), is_approved=True)
+    acc = WalletAccount.objects.create(merchant=m)
+    MerchantCredit.objects.create(merchant=m, credit_limit=AMOUNT * ops * 2)
+    CreditPool.topup(AMOUNT * ops * 2)
+    out = {}
+    try:
+        for name, flag in (("decimal", False), ("minor", True)):
+            with override_settings(MONEY_MINOR_UNITS=flag):
+                t0 = time.perf_counter()
+                for _ in range(ops):
+                    atomic_consume_credit(m, acc, AMOUNT)
+                out[name] = ops / (time.perf_counter() - t0)
+    finally:
+        User.objects.filter(username="bench_money").delete()
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=200_000, help="Iterations of the in-memory benchmarks")
+    ap.add_argument("--ops", type=int, default=1000, help="Withdrawals per mode in the end-to-end run (0 skips it)")
+    args = ap.parse_args()
+
+    results = {"arithmetic": arithmetic(args.n), "rendering": rendering(args.n)}
+    if args.ops:
+        results["consume_end_to_end"] = end_to_end(args.ops)
+    for name, r in results.items():
+        print(f"{name:20s} decimal {r['decimal']:>12,.0f}/s   minor {r['minor']:>12,.0f}/s   "
+              f"x{r['minor'] / r['decimal']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Per-request latency of settlement calls: a fresh `requests.post` per withdrawal
+(the old behaviour) vs the pooled keep-alive `payments.settlement_client`.
+
+By default it starts the real settlement service (services/settlement_service/app.py)
+under uvicorn on a free port; if fastapi/uvicorn are not installed it falls back
+to a stdlib HTTP/1.1 stand-in that speaks the same contract. Point it at a
+running service with --url instead.
+
+Run from the repo root, e.g.:
+  python tests/bench/bench_settlement_client.py --threads 8 --ops 2000
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "services" / "wallet_core"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+import requests  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from payments import settlement_client  # noqa: E402
+
+PATH = "/api/settlement/withdraw"
+BODY = {"merchant_id": 1, "account_id": "00000000-0000-0000-0000-000000000000", "amount": "1.00", "bank_account": "IR0"}
+
+
+class _StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; without TCP_NODELAY a kept-alive
+    # connection stalls on delayed ACKs (~40ms) and the comparison measures that instead
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.headers.get("Authorization") != f"Bearer {settings.INTERNAL_TOKEN}":
+            status, out = 403, {"detail": "Forbidden"}
+        else:
+            status = 200
+            out = {"status": "SUCCESS", "bank_reference": f"BNK-{payload.get('merchant_id')}-{str(payload.get('amount')).replace('.', '')}"}
+        raw = json.dumps(out).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, *args):
+        pass
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve_stand_in(port: int):
+    server = ThreadingHTTPServer(("127.0.0.1", port), _StandIn)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def _wait_for(port: int):
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+
+def start_target():
+    """Return (url, stop, label) for uvicorn + app.py, or the stdlib stand-in."""
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}{PATH}"
+    if not all(importlib.util.find_spec(name) for name in ("uvicorn", "fastapi")):
+        # Separate process so the server does not share the client's GIL
+        proc = multiprocessing.Process(target=_serve_stand_in, args=(port,), daemon=True)
+        proc.start()
+        _wait_for(port)
+        return url, proc.terminate, "stdlib stand-in"
+    env = dict(os.environ, INTERNAL_TOKEN=settings.INTERNAL_TOKEN)
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT / "services" / "settlement_service", env=env,
+    )
+    _wait_for(port)
+    return url, proc.terminate, "uvicorn app.py"
+
+
+def _fresh(url):
+    headers = {"Authorization": f"Bearer {settings.INTERNAL_TOKEN}", "Content-Type": "application/json"}
+    return requests.post(url, json=BODY, headers=headers, timeout=settings.SETTLEMENT_TIMEOUT)
+
+
+def _pooled(url):
+    return settlement_client.settle(BODY)
+
+
+def run(name, call, url, threads, ops) -> dict:
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(ops))
+
+    def worker():
+        local = []
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                break
+            t0 = time.perf_counter()
+            r = call(url)
+            local.append(time.perf_counter() - t0)
+            assert r.status_code == 200, r.text
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        for _ in range(threads):
+            ex.submit(worker)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "client": name,
+        "ops": len(latencies),
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 3),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", help="existing settlement endpoint (skips starting a local one)")
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--ops", type=int, default=2000)
+    args = ap.parse_args()
+
+    stop, target = None, "external"
+    url = args.url
+    if not url:
+        url, stop, target = start_target()
+    print(f"target: {target} {url}")
+    try:
+        with override_settings(SETTLEMENT_URL=url, SETTLEMENT_POOL_SIZE=max(args.threads, 1)):
+            for _ in range(50):  # warm up both paths
+                _fresh(url), _pooled(url)
+            print(run("fresh-connection", _fresh, url, args.threads, args.ops))
+            print(run("pooled-keepalive", _pooled, url, args.threads, args.ops))
+    finally:
+        if stop:
+            stop()
+
+
+if __name__ == "__main__":
+    main()
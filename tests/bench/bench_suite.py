@@ -0,0 +1,296 @@
+"""
+Withdrawal hot-path benchmark suite with JSON baselines.
+
+Cases (each reports ops, throughput, p50 and p95 latency):
+  consume_t<T>_m<M>     atomic_consume_credit, T threads over M merchants
+                        (--consume-grid)
+  ratelimit_t<T>        ratelimit.allow_withdrawal (one GCRA call in Redis)
+  idempotency_replay    POST /withdrawals repeating an already-finished
+                        Idempotency-Key
+  me_hit / me_miss      GET /me with a warm cache, and with the profile
+                        invalidated before every call (outside the timing)
+  withdrawal_t<T>       POST /withdrawals end to end: rate limit,
+                        idempotency, credit hold, settlement, capture.
+                        Settlement goes to a local stand-in (see
+                        bench_settlement_client.start_target).
+
+Requests go through DRF's in-process test client with forced authentication.
+That covers the view stack without gunicorn or JWT decoding.
+
+Each case runs --repeat times and keeps the median run by throughput.
+Without --save, the run is compared with the baseline file (when it exists).
+A case regresses when its throughput drops by more than --tps-tolerance, or
+its p95 rises by more than --p95-tolerance plus --p95-slack-ms. Any
+regression makes the script exit 1. --save writes this run as the new
+baseline. Baselines only compare runs on the same machine and database setup,
+so keep one file per environment (--baseline).
+
+Creates `bench_s*` merchants and deletes them (with their rows) afterwards.
+Run from the repo root against a local Postgres and Redis, e.g.:
+  DB_HOST=127.0.0.1 DB_PORT=5432 REDIS_URL=redis://127.0.0.1:6379/0 \
+    python tests/bench/bench_suite.py --save
+  ... python tests/bench/bench_suite.py --only consume,withdrawal --tps-tolerance 0.1
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "wallet_core"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+# One INSERT per request in the measured window, not a background flush racing the next case
+os.environ.setdefault("REQUEST_LOG_MODE", "sync")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection, close_old_connections  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+from bench_settlement_client import start_target  # noqa: E402
+from payments import profile_cache, ratelimit  # noqa: E402
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool, atomic_consume_credit  # noqa: E402
+
+AMOUNT = Decimal("1.00")
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baselines" / "local.json"
+UNLIMITED = {"standard": {"limit": 10**9, "period_s": 1, "burst": 10**9}}
+
+
+def measure(call, ops: int, threads: int = 1, prepare=None, warmup: int = 20) -> dict:
+    """
+    Run `call()` `ops` times over `threads` threads (each with its own DB
+    connection). `prepare()` runs before each call, outside the timing.
+    """
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(ops))
+
+    def worker():
+        close_old_connections()
+        local = []
+        try:
+            while True:
+                with lock:
+                    i = next(counter, None)
+                if i is None:
+                    break
+                if prepare:
+                    prepare()
+                t0 = time.perf_counter()
+                call()
+                local.append(time.perf_counter() - t0)
+        finally:
+            connection.close()
+        with lock:
+            latencies.extend(local)
+
+    for _ in range(warmup):
+        if prepare:
+            prepare()
+        call()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as ex:
+        for f in [ex.submit(worker) for _ in range(threads)]:
+            f.result()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "tps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p95_ms": round(latencies[max(int(len(latencies) * 0.95) - 1, 0)] * 1000, 3),
+    }
+
+
+def seed(n: int, limit: Decimal) -> list:
+    User.objects.filter(username__startswith="bench_s").delete()
+    out = []
+    for i in range(n):
+        u = User.objects.create_user(username=f"bench_s{i}", password="p")
+        m = Merchant.objects.create(user=u, is_approved=True, bank_account=f"IRS{i}")
+        acc = WalletAccount.objects.create(merchant=m)
+        MerchantCredit.objects.create(merchant=m, credit_limit=limit)
+        out.append((u, m, acc))
+    return out
+
+
+def _client(user) -> APIClient:
+    c = APIClient()
+    c.force_authenticate(user)
+    return c
+
+
+def case_consume(merchants, threads: int, n_merchants: int, ops: int) -> dict:
+    pairs = [(m, acc) for _, m, acc in merchants[:n_merchants]]
+    CreditPool.topup(AMOUNT * (ops + 100))
+    turn = iter(range(10**12))
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            i = next(turn)
+        atomic_consume_credit(*pairs[i % len(pairs)], AMOUNT)
+
+    return measure(call, ops, threads)
+
+
+def case_ratelimit(merchants, threads: int, ops: int) -> dict:
+    user = merchants[0][0]
+    return measure(lambda: ratelimit.allow_withdrawal(user.id, "standard"), ops, threads)
+
+
+def case_idempotency_replay(merchants, ops: int) -> dict:
+    user = merchants[0][0]
+    client, key = _client(user), uuid.uuid4().hex
+    CreditPool.topup(AMOUNT)
+    first = client.post("/api/v1/withdrawals", {"amount": "1.00"}, format="json", HTTP_IDEMPOTENCY_KEY=key)
+    assert first.status_code == 200, first.data
+
+    def call():
+        r = client.post("/api/v1/withdrawals", {"amount": "1.00"}, format="json", HTTP_IDEMPOTENCY_KEY=key)
+        assert r.status_code == 200 and r.data == first.data, r.data
+
+    return measure(call, ops)
+
+
+def case_me(merchants, ops: int, miss: bool) -> dict:
+    user, m, _ = merchants[0]
+    client = _client(user)
+
+    def call():
+        r = client.get("/api/v1/me")
+        assert r.status_code == 200, r.data
+
+    return measure(call, ops, prepare=(lambda: profile_cache.bump([m.id])) if miss else None)
+
+
+def case_withdrawal(merchants, threads: int, ops: int) -> dict:
+    CreditPool.topup(AMOUNT * (ops + 100))
+    local = threading.local()
+    turn = iter(range(10**12))
+    lock = threading.Lock()
+
+    def call():
+        if not hasattr(local, "client"):
+            with lock:
+                local.client = _client(merchants[next(turn) % len(merchants)][0])
+        r = local.client.post("/api/v1/withdrawals", {"amount": "1.00"}, format="json",
+                              HTTP_IDEMPOTENCY_KEY=uuid.uuid4().hex)
+        assert r.status_code == 200, r.data
+
+    return measure(call, ops, threads)
+
+
+def run(args, merchants) -> dict:
+    grid = [tuple(int(x) for x in cell.split("x")) for cell in args.consume_grid.split(",")]
+    cases = {f"consume_t{t}_m{m}": (case_consume, (t, m, args.ops)) for t, m in grid}
+    cases.update({
+        "ratelimit_t1": (case_ratelimit, (1, args.ops)),
+        "ratelimit_t8": (case_ratelimit, (8, args.ops)),
+        "idempotency_replay": (case_idempotency_replay, (args.ops,)),
+        "me_hit": (case_me, (args.ops, False)),
+        "me_miss": (case_me, (args.ops, True)),
+        "withdrawal_t1": (case_withdrawal, (1, args.ops)),
+        "withdrawal_t8": (case_withdrawal, (8, args.ops)),
+    })
+    only = [p for p in (args.only or "").split(",") if p]
+    results = {}
+    url, stop, label = start_target()
+    print(f"settlement target: {label}", file=sys.stderr)
+    try:
+        with override_settings(SETTLEMENT_URL=url, RATE_LIMIT_TIERS=UNLIMITED):
+            ratelimit.reset_local_state()
+            for name, (fn, fn_args) in cases.items():
+                if only and not any(name.startswith(p) for p in only):
+                    continue
+                MerchantCredit.objects.filter(merchant__in=[m for _, m, _ in merchants]).update(utilized_amount=0)
+                # Median run by throughput: one slow or lucky repetition does not move the gate
+                runs = sorted((fn(merchants, *fn_args) for _ in range(args.repeat)), key=lambda r: r["tps"])
+                results[name] = runs[len(runs) // 2]
+                print(f"{name:22s} {results[name]}", file=sys.stderr)
+    finally:
+        stop()
+    return results
+
+
+def compare(results: dict, baseline: dict, tps_tol: float, p95_tol: float, p95_slack_ms: float) -> list[str]:
+    """Regressions of `results` against `baseline` (cases missing on either side are skipped)."""
+    out = []
+    for name, r in results.items():
+        b = baseline.get(name)
+        if not b:
+            continue
+        if r["tps"] < b["tps"] * (1 - tps_tol):
+            out.append(f"{name}: throughput {r['tps']}/s < baseline {b['tps']}/s - {tps_tol:.0%}")
+        if r["p95_ms"] > b["p95_ms"] * (1 + p95_tol) + p95_slack_ms:
+            out.append(f"{name}: p95 {r['p95_ms']}ms > baseline {b['p95_ms']}ms + {p95_tol:.0%} + {p95_slack_ms}ms")
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--ops", type=int, default=1000, help="Timed operations per case")
+    ap.add_argument("--repeat", type=int, default=3, help="Runs per case; the median run by throughput is kept")
+    ap.add_argument("--consume-grid", default="1x1,8x1,8x32,32x32", help="THREADSxMERCHANTS cells for consume_*")
+    ap.add_argument("--only", help="Comma-separated case name prefixes to run")
+    ap.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    ap.add_argument("--save", action="store_true", help="Write this run as the baseline instead of comparing")
+    ap.add_argument("--output", type=Path, help="Also write this run's results here")
+    ap.add_argument("--tps-tolerance", type=float, default=0.15, help="Allowed throughput drop (fraction)")
+    ap.add_argument("--p95-tolerance", type=float, default=0.25, help="Allowed p95 increase (fraction)")
+    ap.add_argument("--p95-slack-ms", type=float, default=0.5, help="Absolute p95 allowance on top, for sub-ms cases")
+    args = ap.parse_args()
+
+    max_merchants = max(int(cell.split("x")[1]) for cell in args.consume_grid.split(","))
+    merchants = seed(max(max_merchants, 8), AMOUNT * (args.ops * 4 + 1000))
+    try:
+        results = run(args, merchants)
+    finally:
+        User.objects.filter(username__startswith="bench_s").delete()
+
+    with connection.cursor() as cur:
+        cur.execute("SHOW server_version")
+        pg = cur.fetchone()[0]
+    doc = {
+        "meta": {"created": datetime.now(timezone.utc).isoformat(timespec="seconds"), "host": platform.node(),
+                 "python": platform.python_version(), "postgres": pg, "ops": args.ops, "repeat": args.repeat},
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(doc, indent=1) + "\n")
+    if args.save:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        # Keep baseline cases this run skipped (--only)
+        if args.baseline.exists():
+            doc["results"] = {**json.loads(args.baseline.read_text())["results"], **results}
+        args.baseline.write_text(json.dumps(doc, indent=1) + "\n")
+        print(f"baseline saved to {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print(f"no baseline at {args.baseline}; run with --save to create one")
+        return
+    base = json.loads(args.baseline.read_text())
+    failed = compare(results, base["results"], args.tps_tolerance, args.p95_tolerance, args.p95_slack_ms)
+    print(f"{'case':22s} {'tps':>10s} {'base':>10s} {'p95 ms':>9s} {'base':>9s}")
+    for name, r in results.items():
+        b = base["results"].get(name, {})
+        print(f"{name:22s} {r['tps']:>10} {b.get('tps', '-'):>10} {r['p95_ms']:>9} {b.get('p95_ms', '-'):>9}")
+    if failed:
+        print("REGRESSIONS:\n  " + "\n  ".join(failed))
+        sys.exit(1)
+    print(f"no regressions against {args.baseline} ({base['meta']['created']})")
+
+
+if __name__ == "__main__":
+    main()
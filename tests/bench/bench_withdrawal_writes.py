@@ -0,0 +1,82 @@
+"""
+Write cost of one synchronous payout: POSTs N withdrawals (settlement mocked,
+credit holds on, Idempotency-Key set) through the API and reports, per payout,
+the WAL generated, write transactions, and WithdrawalRequest row versions (inserts +
+updates from pg_stat_user_tables).
+
+Creates a `bench_wal` merchant and deletes it (with its rows) afterwards.
+Run from the repo root against a real Postgres, e.g.:
+  DB_HOST=127.0.0.1 DB_PORT=5432 python tests/bench/bench_withdrawal_writes.py --n 500
+"""
+import argparse
+import os
+import sys
+import time
+import uuid
+from decimal import Decimal
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "services" / "wallet_core"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+# One audit-log INSERT per request, inside the measured window
+os.environ["REQUEST_LOG_MODE"] = "sync"
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings  # noqa: E402
+from rest_framework.test import APIClient  # noqa: E402
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool  # noqa: E402
+
+
+def counters() -> tuple[int, int, int]:
+    # (WAL position, next transaction id, withdrawal inserts + updates); only writing transactions take an id
+    with connection.cursor() as cur:
+        cur.execute("SELECT pg_stat_clear_snapshot()")
+        cur.execute("SELECT pg_current_wal_lsn() - '0/0'::pg_lsn,"
+                    " txid_snapshot_xmax(txid_current_snapshot()),"
+                    " (SELECT COALESCE(SUM(n_tup_ins + n_tup_upd), 0) FROM pg_stat_user_tables"
+                    "   WHERE relname LIKE 'payments_withdrawalrequest%%')")
+        wal, xid, versions = cur.fetchone()
+    return int(wal), int(xid), int(versions)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--n", type=int, default=500)
+    args = ap.parse_args()
+
+    User.objects.filter(username="bench_wal").delete()
+    user = User.objects.create_user(username="bench_wal", password="p")
+    m = Merchant.objects.create(user=user, is_approved=True, bank_account="IRB")
+    WalletAccount.objects.create(merchant=m)
+    MerchantCredit.objects.create(merchant=m, credit_limit=Decimal(args.n))
+    CreditPool.topup(Decimal(args.n))
+    client = APIClient()
+    client.force_authenticate(user)
+    try:
+        with mock.patch("payments.settlement_client.settle") as post, \
+                override_settings(RATE_LIMIT_TIERS={"standard": {"limit": 10**9, "period_s": 1, "burst": 10**9}}):
+            post.return_value.status_code = 200
+            post.return_value.json.return_value = {"status": "SUCCESS", "bank_reference": "BNK"}
+            time.sleep(1)  # statistics are reported with a delay; start from settled counters
+            wal0, xid0, versions0 = counters()
+            for _ in range(args.n):
+                r = client.post("/api/v1/withdrawals", {"amount": "1.00"}, format="json",
+                                HTTP_IDEMPOTENCY_KEY=uuid.uuid4().hex)
+                assert r.status_code == 200, r.data
+            time.sleep(1)
+            wal1, xid1, versions1 = counters()
+        n = args.n
+        print(f"per payout: WAL {(wal1 - wal0) / n:,.0f} B, write transactions {(xid1 - xid0) / n:.2f}, "
+              f"withdrawal row versions {(versions1 - versions0) / n:.2f}")
+    finally:
+        User.objects.filter(username="bench_wal").delete()
+
+
+if __name__ == "__main__":
+    main()
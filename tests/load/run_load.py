@@ -0,0 +1,335 @@
+"""
+Headless load-test runner for the scenarios in tests/load/scenarios.py.
+
+For each scenario:
+  1. Reset the load-test merchants' credit usage and top the pool up to
+     --pool, so every scenario starts from the same state.
+  2. Run `locust --headless` for --duration with --users / --spawn-rate
+     against --host.
+  3. While Locust runs, sample pg_locks every --lock-interval seconds
+     (payments.lockprof) and the connection counts in pg_stat_activity.
+  4. Diff pg_stat_database and Redis INFO from before to after the run.
+
+Preparation, once per run: create `lt_m{i}` merchants (--merchants; existing
+ones are reused) and an `lt_admin` staff user. Then push one JWT session per
+merchant to Redis for the Locust users. The tokens are signed with this
+process's settings, so DJANGO_SECRET must match the server's. --prepare-only
+stops after this step, for running Locust by hand.
+
+Output in --out:
+  <scenario>_stats.csv, <scenario>_failures.csv   Locust's own CSVs
+  summary.json   per scenario: requests per endpoint (count, failures,
+                 rps, p50/p95/p99), top failures, db, redis, locks
+  summary.md     one comparison table; with --compare, adds the change
+                 from an earlier summary.json
+
+Run from the repo root against a running stack, e.g.:
+  DB_HOST=127.0.0.1 DB_PORT=5432 REDIS_URL=redis://127.0.0.1:6379/0 \
+    python tests/load/run_load.py --host http://127.0.0.1:8000 --duration 2m --users 300
+  ... python tests/load/run_load.py --scenarios mixed,hot_merchant --compare reports/load/prev/summary.json
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from decimal import Decimal
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parents[1] / "services" / "wallet_core"))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection, transaction  # noqa: E402
+from payments import lockprof  # noqa: E402
+from payments.models import Merchant, WalletAccount, MerchantCredit, CreditPool  # noqa: E402
+from payments.views import MyTokenObtainPairSerializer  # noqa: E402
+from payments.utils.cache import redis_client  # noqa: E402
+
+SCENARIO_NAMES = ("withdraw_only", "mixed", "hot_merchant", "retry_storm", "dashboard")
+SESSIONS_KEY = os.getenv("SESSIONS_KEY", "locust:sessions")
+ADMIN_SESSION_KEY = os.getenv("ADMIN_SESSION_KEY", "locust:admin_session")
+
+_DB_COUNTERS = ("xact_commit", "xact_rollback", "deadlocks", "blks_read", "blks_hit",
+                "tup_returned", "tup_fetched", "tup_inserted", "tup_updated", "tup_deleted", "temp_bytes")
+_REDIS_COUNTERS = ("total_commands_processed", "keyspace_hits", "keyspace_misses", "rejected_connections",
+                   "total_connections_received", "expired_keys", "evicted_keys")
+
+
+def _session(user) -> dict:
+    refresh = MyTokenObtainPairSerializer.get_token(user)
+    return {"access": str(refresh.access_token), "refresh": str(refresh), "user_id": user.id}
+
+
+def prepare(n: int, limit: Decimal) -> None:
+    """Create the lt_* users (idempotent) and push their sessions to Redis."""
+    existing = set(User.objects.filter(username__startswith="lt_m").values_list("username", flat=True))
+    with transaction.atomic():
+        for i in range(n):
+            name = f"lt_m{i}"
+            if name in existing:
+                continue
+            u = User.objects.create_user(username=name, password="p")
+            m = Merchant.objects.create(user=u, is_approved=True, bank_account=f"LT{i}")
+            WalletAccount.objects.create(merchant=m)
+            MerchantCredit.objects.create(merchant=m, credit_limit=limit)
+        admin, _ = User.objects.get_or_create(username="lt_admin", defaults={"is_staff": True})
+    users = {u.username: u for u in User.objects.filter(username__in=[f"lt_m{i}" for i in range(n)])}
+    # Keep lt_m0.. first: scenarios.py treats the head of the list as the hot merchants
+    sessions = [json.dumps(_session(users[f"lt_m{i}"])) for i in range(n)]
+    r = redis_client()
+    pipe = r.pipeline()
+    pipe.delete(SESSIONS_KEY)
+    pipe.rpush(SESSIONS_KEY, *sessions)
+    pipe.set(ADMIN_SESSION_KEY, json.dumps(_session(admin)))
+    pipe.execute()
+
+
+def reset_credit(n: int, limit: Decimal, pool: Decimal) -> None:
+    MerchantCredit.objects.filter(merchant__user__username__startswith="lt_m").update(
+        credit_limit=limit, utilized_amount=Decimal("0.00"), utilized_amount_minor=0)
+    short = pool - CreditPool.total_available()
+    if short > 0:
+        CreditPool.topup(short)
+
+
+def db_counters() -> dict:
+    with connection.cursor() as cur:
+        cur.execute("SELECT pg_stat_clear_snapshot()")
+        cur.execute(f"SELECT {', '.join(_DB_COUNTERS)} FROM pg_stat_database WHERE datname = current_database()")
+        return dict(zip(_DB_COUNTERS, (int(v or 0) for v in cur.fetchone())))
+
+
+def redis_counters() -> dict:
+    info = redis_client().info()
+    return {k: int(info.get(k, 0)) for k in _REDIS_COUNTERS}
+
+
+class Sampler(threading.Thread):
+    """Lock snapshots plus connection counts, every `interval` seconds until stop()."""
+
+    def __init__(self, interval: float):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.records, self.connections, self.active = [], [], []
+        self._stop_event = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                self.records.append(lockprof.snapshot())
+                with connection.cursor() as cur:
+                    cur.execute("SELECT count(*), count(*) FILTER (WHERE state = 'active') "
+                                "FROM pg_stat_activity WHERE datname = current_database()")
+                    total, active = cur.fetchone()
+                self.connections.append(total)
+                self.active.append(active)
+                self._stop_event.wait(self.interval)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def parse_stats(prefix: Path) -> tuple[dict, dict]:
+    """(per-endpoint stats, aggregated row) from Locust's <prefix>_stats.csv."""
+    def row_of(row):
+        count, failures = int(row["Request Count"]), int(row["Failure Count"])
+        return {
+            "count": count, "failures": failures,
+            "failure_rate": round(failures / count, 4) if count else 0.0,
+            "rps": round(float(row["Requests/s"]), 2),
+            "p50_ms": float(row["50%"] or 0), "p95_ms": float(row["95%"] or 0), "p99_ms": float(row["99%"] or 0),
+        }
+
+    per_name, total = {}, {}
+    with open(f"{prefix}_stats.csv", newline="") as f:
+        for row in csv.DictReader(f):
+            if row["Name"] == "Aggregated":
+                total = row_of(row)
+            else:
+                per_name[f"{row['Type']} {row['Name']}"] = row_of(row)
+    return per_name, total
+
+
+def parse_failures(prefix: Path, top: int = 10) -> list:
+    path = Path(f"{prefix}_failures.csv")
+    if not path.exists():
+        return []
+    with open(path, newline="") as f:
+        rows = [{"name": f"{r['Method']} {r['Name']}", "error": r["Error"], "occurrences": int(r["Occurrences"])}
+                for r in csv.DictReader(f)]
+    return sorted(rows, key=lambda r: r["occurrences"], reverse=True)[:top]
+
+
+def run_scenario(name: str, args, out: Path) -> dict:
+    prefix = out / name
+    env = {**os.environ, "SCENARIO": name, "SESSIONS_KEY": SESSIONS_KEY, "ADMIN_SESSION_KEY": ADMIN_SESSION_KEY,
+           "REDIS_URL": os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")}
+    cmd = [sys.executable, "-m", "locust", "-f", str(HERE / "scenarios.py"), "--headless", "--only-summary",
+           "--host", args.host, "-u", str(args.users), "-r", str(args.spawn_rate), "-t", args.duration,
+           "--csv", str(prefix), "--exit-code-on-error", "0", "--loglevel", "WARNING"]
+    if args.processes > 1:
+        cmd += ["--processes", str(args.processes)]
+
+    db0, redis0 = db_counters(), redis_counters()
+    sampler = Sampler(args.lock_interval)
+    sampler.start()
+    started = time.perf_counter()
+    try:
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    finally:
+        sampler.stop()
+    elapsed = time.perf_counter() - started
+    db1, redis1 = db_counters(), redis_counters()
+    if proc.returncode != 0:
+        raise SystemExit(f"locust failed for {name} (exit {proc.returncode}):\n{proc.stderr[-2000:]}")
+
+    per_name, total = parse_stats(prefix)
+    db = {k: db1[k] - db0[k] for k in _DB_COUNTERS}
+    rd = {k: redis1[k] - redis0[k] for k in _REDIS_COUNTERS}
+    blocks = db["blks_hit"] + db["blks_read"]
+    lookups = rd["keyspace_hits"] + rd["keyspace_misses"]
+    locks = lockprof.summarize(sampler.records)
+    return {
+        "scenario": name,
+        "elapsed_s": round(elapsed, 1),
+        "total": total,
+        "requests": per_name,
+        "failures": parse_failures(prefix),
+        "db": {
+            **db,
+            "commits_per_s": round(db["xact_commit"] / elapsed, 1),
+            "cache_hit_ratio": round(db["blks_hit"] / blocks, 4) if blocks else None,
+            "max_connections": max(sampler.connections, default=0),
+            "max_active": max(sampler.active, default=0),
+        },
+        "redis": {
+            **rd,
+            "commands_per_s": round(rd["total_commands_processed"] / elapsed, 1),
+            "hit_ratio": round(rd["keyspace_hits"] / lookups, 4) if lookups else None,
+            "used_memory_mb": round(redis_client().info("memory")["used_memory"] / 2**20, 1),
+        },
+        "locks": {k: locks[k] for k in ("samples", "samples_with_waiters", "lock_wait", "lock_wait_by_table",
+                                        "longest_chain", "top_blockers")},
+    }
+
+
+# --- Report ---
+
+COLUMNS = (  # (header, getter)
+    ("rps", lambda s: s["total"].get("rps", 0)),
+    ("p50 ms", lambda s: s["total"].get("p50_ms", 0)),
+    ("p95 ms", lambda s: s["total"].get("p95_ms", 0)),
+    ("p99 ms", lambda s: s["total"].get("p99_ms", 0)),
+    ("fail %", lambda s: round(s["total"].get("failure_rate", 0) * 100, 2)),
+    ("db tx/s", lambda s: s["db"]["commits_per_s"]),
+    ("deadlocks", lambda s: s["db"]["deadlocks"]),
+    ("lock wait p95 ms", lambda s: s["locks"]["lock_wait"]["p95_ms"]),
+    ("lock chain", lambda s: s["locks"]["longest_chain"]),
+    ("redis cmd/s", lambda s: s["redis"]["commands_per_s"]),
+)
+
+
+def _delta(now: float, before: float) -> str:
+    if not before:
+        return ""
+    return f" ({(now - before) / before * 100:+.0f}%)"
+
+
+def render_markdown(summary: dict, baseline: dict | None) -> str:
+    prev = {s["scenario"]: s for s in (baseline or {}).get("scenarios", [])}
+    cfg = summary["config"]
+    lines = [
+        f"# Load test {summary['created_at']}",
+        "",
+        f"{cfg['users']} users, spawn rate {cfg['spawn_rate']}/s, {cfg['duration']} per scenario, "
+        f"{cfg['merchants']} merchants, host {cfg['host']}"
+        + (f"; compared with {baseline['created_at']}" if baseline else ""),
+        "",
+        "| scenario | " + " | ".join(h for h, _ in COLUMNS) + " |",
+        "|---" * (len(COLUMNS) + 1) + "|",
+    ]
+    for s in summary["scenarios"]:
+        cells = []
+        for _, get in COLUMNS:
+            value = get(s)
+            cells.append(f"{value}{_delta(value, get(prev[s['scenario']])) if s['scenario'] in prev else ''}")
+        lines.append(f"| {s['scenario']} | " + " | ".join(cells) + " |")
+    for s in summary["scenarios"]:
+        lines += ["", f"## {s['scenario']}", "", "| endpoint | count | fail % | rps | p50 ms | p95 ms | p99 ms |",
+                  "|---|---|---|---|---|---|---|"]
+        for name, r in sorted(s["requests"].items()):
+            lines.append(f"| {name} | {r['count']} | {round(r['failure_rate'] * 100, 2)} | {r['rps']} | "
+                         f"{r['p50_ms']} | {r['p95_ms']} | {r['p99_ms']} |")
+        if s["failures"]:
+            lines += ["", "Top failures:", ""]
+            lines += [f"- {f['occurrences']} x {f['name']}: {f['error']}" for f in s["failures"]]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default=os.getenv("TARGET_HOST", "http://127.0.0.1:8000"))
+    ap.add_argument("--scenarios", default=",".join(SCENARIO_NAMES),
+                    help=f"comma-separated, from: {', '.join(SCENARIO_NAMES)}")
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--spawn-rate", type=float, default=50)
+    ap.add_argument("--duration", default="1m", help="per scenario, in Locust's format (90s, 2m)")
+    ap.add_argument("--processes", type=int, default=1, help="Locust worker processes (--processes)")
+    ap.add_argument("--merchants", type=int, default=500)
+    ap.add_argument("--credit-limit", type=Decimal, default=Decimal("1000000.00"))
+    ap.add_argument("--pool", type=Decimal, default=Decimal("100000000.00"),
+                    help="pool balance each scenario starts from")
+    ap.add_argument("--lock-interval", type=float, default=0.25)
+    ap.add_argument("--out", type=Path,
+                    default=Path("reports/load") / datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ"))
+    ap.add_argument("--compare", type=Path, help="earlier summary.json to compare against")
+    ap.add_argument("--prepare-only", action="store_true")
+    args = ap.parse_args()
+
+    names = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(names) - set(SCENARIO_NAMES)
+    if unknown:
+        ap.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    prepare(args.merchants, args.credit_limit)
+    print(f"[run_load] {args.merchants} sessions in {SESSIONS_KEY}", file=sys.stderr)
+    if args.prepare_only:
+        return
+
+    args.out.mkdir(parents=True, exist_ok=True)
+    results = []
+    for name in names:
+        reset_credit(args.merchants, args.credit_limit, args.pool)
+        print(f"[run_load] {name}: {args.users} users for {args.duration}", file=sys.stderr)
+        results.append(run_scenario(name, args, args.out))
+        t = results[-1]["total"]
+        print(f"[run_load] {name}: {t.get('rps')} rps, p95 {t.get('p95_ms')}ms, "
+              f"{t.get('failures')} failures", file=sys.stderr)
+
+    summary = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {"host": args.host, "users": args.users, "spawn_rate": args.spawn_rate,
+                   "duration": args.duration, "processes": args.processes, "merchants": args.merchants},
+        "scenarios": results,
+    }
+    baseline = json.loads(args.compare.read_text()) if args.compare else None
+    (args.out / "summary.json").write_text(json.dumps(summary, indent=2, default=str))
+    (args.out / "summary.md").write_text(render_markdown(summary, baseline))
+    print(json.dumps({"out": str(args.out), "scenarios": {s["scenario"]: s["total"] for s in results}}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Weighted merchant traffic mixes for Locust. SCENARIO selects one (default
+`mixed`):
+
+  SCENARIO=hot_merchant REDIS_URL=redis://127.0.0.1:6379/0 \
+    locust -f tests/load/scenarios.py --host http://127.0.0.1:8000 --headless -u 300 -r 50 -t 2m
+
+tests/load/run_load.py seeds the merchants and runs each scenario headless.
+It also writes the sessions this file reads from Redis: one JSON entry per
+merchant in SESSIONS_KEY ({"access", "refresh", "user_id"}) and one
+staff session in ADMIN_SESSION_KEY.
+
+Each simulated user takes one merchant session. In scenarios with
+`hot_share`, that fraction of users is spread over the first
+`hot_merchants` merchants, so a few merchants get most of the traffic
+(their credit rows, rate limit keys and cached profiles). The other users
+are spread over all merchants.
+
+Tasks (weights per scenario in SCENARIOS):
+  withdraw        POST /withdrawals with a fresh Idempotency-Key
+  withdraw_retry  POST, then the same request and key again, `retries`
+                  times, like a client retrying after a lost response.
+                  Expects a replay (200/202) or IN_PROGRESS (409).
+  over_limit      POST more than any merchant's credit; expects 409
+  me              GET /me (dashboard polling)
+  history         GET /withdrawals?limit=20
+  refresh         POST /auth/token/refresh, then use the new access token
+Scenarios with `admin_topup_s` add one staff user that tops up the credit
+pool at that interval.
+
+Rate limiting (429) and exhausted credit (409 on a normal withdrawal) are
+recorded as failures, so they show up in the failures report.
+"""
+import json
+import os
+import random
+import uuid
+
+import redis
+from locust import FastHttpUser, between, constant, task
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+SESSIONS_KEY = os.getenv("SESSIONS_KEY", "locust:sessions")
+ADMIN_SESSION_KEY = os.getenv("ADMIN_SESSION_KEY", "locust:admin_session")
+REQ_TIMEOUT = float(os.getenv("REQ_TIMEOUT", "5"))
+WAIT_MIN = float(os.getenv("WAIT_MIN", "0.05"))
+WAIT_MAX = float(os.getenv("WAIT_MAX", "0.5"))
+
+_MIXED = {"withdraw": 40, "me": 30, "history": 8, "withdraw_retry": 10, "over_limit": 5, "refresh": 7}
+SCENARIOS = {
+    # The original locustfile's traffic, for comparison
+    "withdraw_only": {"tasks": {"withdraw": 1}},
+    "mixed": {"tasks": _MIXED, "admin_topup_s": 10},
+    "hot_merchant": {"tasks": _MIXED, "admin_topup_s": 10, "hot_share": 0.8, "hot_merchants": 5},
+    "retry_storm": {"tasks": {"withdraw": 30, "withdraw_retry": 60, "me": 10}, "retries": 3},
+    "dashboard": {"tasks": {"me": 60, "history": 30, "withdraw": 10}},
+}
+SCENARIO = os.getenv("SCENARIO", "mixed")
+if SCENARIO not in SCENARIOS:
+    raise SystemExit(f"SCENARIO must be one of {', '.join(SCENARIOS)}, not {SCENARIO!r}")
+SC = SCENARIOS[SCENARIO]
+
+_r = redis.from_url(REDIS_URL, decode_responses=True)
+_sessions: list | None = None
+
+
+def _pick_session() -> dict | None:
+    global _sessions
+    if _sessions is None:
+        _sessions = [json.loads(s) for s in _r.lrange(SESSIONS_KEY, 0, -1)]
+    if not _sessions:
+        return None
+    hot = min(SC.get("hot_merchants", 0), len(_sessions))
+    if hot and random.random() < SC.get("hot_share", 0):
+        return dict(_sessions[random.randrange(hot)])
+    return dict(_sessions[random.randrange(len(_sessions))])
+
+
+def _amount() -> str:
+    return f"{random.randint(100, 500) / 100:.2f}"
+
+
+class MerchantUser(FastHttpUser):
+    host = os.getenv("TARGET_HOST", "http://127.0.0.1:8000")
+    wait_time = between(WAIT_MIN, WAIT_MAX)
+
+    def on_start(self):
+        self.session = _pick_session()
+        if self.session is None:
+            raise SystemExit(f"No sessions in {SESSIONS_KEY}; run tests/load/run_load.py --prepare-only first")
+
+    def _headers(self, idem: str | None = None) -> dict:
+        h = {"Authorization": f"Bearer {self.session['access']}"}
+        if idem:
+            h["Idempotency-Key"] = idem
+        return h
+
+    def _post_withdrawal(self, name: str, amount: str, idem: str, ok=(200, 202)):
+        with self.client.post("/api/v1/withdrawals", json={"amount": amount}, headers=self._headers(idem),
+                              name=name, timeout=REQ_TIMEOUT, catch_response=True) as r:
+            if r.status_code in ok:
+                r.success()
+            else:
+                r.failure(f"{r.status_code} {(r.text or '')[:80]}")
+
+    def withdraw(self):
+        self._post_withdrawal("/withdrawals", _amount(), uuid.uuid4().hex)
+
+    def withdraw_retry(self):
+        idem, amount = uuid.uuid4().hex, _amount()
+        self._post_withdrawal("/withdrawals", amount, idem)
+        for _ in range(SC.get("retries", 1)):
+            self._post_withdrawal("/withdrawals [retry]", amount, idem, ok=(200, 202, 409))
+
+    def over_limit(self):
+        self._post_withdrawal("/withdrawals [over limit]", "100000000.00", uuid.uuid4().hex, ok=(409,))
+
+    def me(self):
+        self.client.get("/api/v1/me", headers=self._headers(), name="/me", timeout=REQ_TIMEOUT)
+
+    def history(self):
+        self.client.get("/api/v1/withdrawals?limit=20", headers=self._headers(), name="/withdrawals [list]",
+                        timeout=REQ_TIMEOUT)
+
+    def refresh(self):
+        with self.client.post("/api/v1/auth/token/refresh", json={"refresh": self.session["refresh"]},
+                              name="/auth/token/refresh", timeout=REQ_TIMEOUT, catch_response=True) as r:
+            if r.status_code == 200:
+                self.session["access"] = r.json()["access"]
+                r.success()
+            else:
+                r.failure(f"{r.status_code}")
+
+    tasks = {fn: SC["tasks"][name] for name, fn in list(locals().items()) if name in SC["tasks"]}
+
+
+if SC.get("admin_topup_s"):
+    class AdminUser(FastHttpUser):
+        host = os.getenv("TARGET_HOST", "http://127.0.0.1:8000")
+        fixed_count = 1
+        wait_time = constant(SC["admin_topup_s"])
+
+        def on_start(self):
+            raw = _r.get(ADMIN_SESSION_KEY)
+            self.access = json.loads(raw)["access"] if raw else None
+
+        @task
+        def topup(self):
+            if self.access:
+                self.client.post("/api/v1/admin/pool/topup", json={"amount": "1000.00"},
+                                 headers={"Authorization": f"Bearer {self.access}"}, name="/admin/pool/topup",
+                                 timeout=REQ_TIMEOUT)